@@ -2,12 +2,15 @@ import os
 import csv
 from io import StringIO
 import datetime
+import logging
+import threading
 import time
 
 from django.core.files.storage import FileSystemStorage
 from django.conf import settings
 from django.core.files.storage import default_storage
-from django.db.models import Q
+from django.db import transaction
+from django.db.models import Q, prefetch_related_objects
 
 from seed.data_importer.models import (
     ImportFile,
@@ -15,19 +18,28 @@ from seed.data_importer.models import (
 
 from seed.models.certification import GreenAssessmentPropertyAuditLog, GreenAssessmentURL
 from seed.models import (
+    DATA_STATE_MATCHING,
+    MERGE_STATE_NEW,
     Column,
+    Property,
+    PropertyAuditLog,
     PropertyState,
     PropertyView
 )
 
 from seed.models.auditlog import (
+    AUDIT_IMPORT,
     AUDIT_USER_EXPORT,
 )
 
 from helix.models import HELIXGreenAssessmentProperty, HelixMeasurement
-from helix.utils.address import normalize_address_str
+from helix.utils import reso_cache
+from helix.utils.labels import save_fingerprints
+from helix.utils.address import normalize_address_str, normalize_addresses
 from seed.utils.cache import get_cache
 
+logger = logging.getLogger(__name__)
+
 
 def save_and_load(user, dataset, cycle, data, file_name):
     """
@@ -93,153 +105,487 @@ def upload(filename, data, dataset, cycle):
     return f.pk
 
 
-def wait_for_task(key):
+# columns of the single property import file mapped to PropertyState fields
+PROPERTY_MAPPING = {
+    'Address Line 1': 'address_line_1',
+    'City': 'city',
+    'State': 'state',
+    'Postal Code': 'postal_code',
+    'Custom ID 1': 'custom_id_1',
+}
+
+
+def create_propertyview(org, cycle, data):
+    """
+    Create a property from a row of the single property import file, without going
+    through the file upload and the save, map and match tasks.
+    The row is first matched on normalized address within the organization, the way
+    propertyview_find does, and the views of a matching state are returned instead.
+    Returns a PropertyView queryset.
+    """
+    views = create_propertyviews(org, cycle, [data])[0]
+    return PropertyView.objects.filter(pk__in=[view.pk for view in views])
+
+
+def create_propertyviews(org, cycle, rows, workers=1):
+    """
+    create_propertyview for many rows at once. Returns the list of views of every row, in row order.
+    All rows are matched on normalized address in a single query, and rows sharing a new
+    normalized address share a new property. States are saved one by one so SEED's save hooks
+    run, audit logs, properties and views are inserted in bulk.
+    Addresses are normalized in this process unless workers is given, see normalize_addresses.
     """
-    wait for a celery task to finish running
+    fields = [{PROPERTY_MAPPING[column]: value for column, value in data.items() if column in PROPERTY_MAPPING} for data in rows]
+    normalized = normalize_addresses(((row.get('address_line_1'), '', row.get('postal_code')) for row in fields), workers)
+    normalized = [result if result else (None, {}) for result in normalized]
+
+    with transaction.atomic():
+        views = {}
+        addresses = {normalized_address for normalized_address, extra_data in normalized if normalized_address}
+        if addresses:
+            matches = PropertyView.objects.filter(
+                state__organization=org, state__normalized_address__in=addresses).select_related('state')
+            for view in matches:
+                views.setdefault(view.state.normalized_address, []).append(view)
+
+        # a row without a normalized address never matches, not even another row
+        keys = [normalized_address or ('row', i) for i, (normalized_address, extra_data) in enumerate(normalized)]
+        states = {}
+        for key, row, (normalized_address, extra_data) in zip(keys, fields, normalized):
+            if key in views or key in states:
+                continue
+            states[key] = PropertyState.objects.create(
+                organization=org,
+                data_state=DATA_STATE_MATCHING,
+                merge_state=MERGE_STATE_NEW,
+                normalized_address=normalized_address,
+                extra_data=extra_data,
+                **row)
+
+        if states:
+            PropertyAuditLog.objects.bulk_create([PropertyAuditLog(
+                organization=org,
+                state=state,
+                name='Import Creation',
+                description='Creation from Import file.',
+                record_type=AUDIT_IMPORT) for state in states.values()])
+            properties = Property.objects.bulk_create([Property(organization=org) for state in states])
+            new_views = PropertyView.objects.bulk_create([
+                PropertyView(property=prop, cycle=cycle, state=state) for prop, state in zip(properties, states.values())])
+            for key, view in zip(states, new_views):
+                views[key] = [view]
+    return [views[key] for key in keys]
+
+
+# seconds wait_for_task waits for a celery task before giving up
+TASK_TIMEOUT = 300
+
+
+def wait_for_task(key, timeout=TASK_TIMEOUT, on_progress=None):
     """
+    wait for a celery task to finish running, polling with exponential backoff.
+    on_progress is called with every progress value read. Raises TimeoutError when
+    the task has not finished after timeout seconds.
+    """
+    deadline = time.time() + timeout
+    delay = 0.1
     prog = 0
     while prog < 100:
-        prog = int(get_cache(key)['progress'])
+        prog = int(get_cache(key).get('progress') or 0)
+        if on_progress is not None:
+            on_progress(prog)
+        if prog >= 100:
+            break
+        if time.time() + delay > deadline:
+            raise TimeoutError('task ' + key + ' did not finish in ' + str(timeout) + ' seconds')
         # Call to sleep is required otherwise this method will hang.
-        time.sleep(0.5)
+        time.sleep(delay)
+        delay = min(2 * delay, 5)
+
+
+_propertyview_find_stats = {}
+_propertyview_find_stats_lock = threading.Lock()
+
+
+def propertyview_find_stats():
+    """
+    Number of requests resolved by each propertyview_find tier, and the total seconds they took.
+    Requests that did not find a property are counted under None.
+    """
+    with _propertyview_find_stats_lock:
+        return {tier: dict(stats) for tier, stats in _propertyview_find_stats.items()}
+
+
+def _record_propertyview_find(tier, elapsed):
+    with _propertyview_find_stats_lock:
+        stats = _propertyview_find_stats.setdefault(tier, {'count': 0, 'seconds': 0.0})
+        stats['count'] += 1
+        stats['seconds'] += elapsed
+    logger.info('propertyview_find resolved by %s in %.1f ms', tier, 1000 * elapsed)
+
+
+def _propertyview_by_uid(property_uid, org, zip, substring=False):
+    if substring:
+        # LIKE '%uid%' can not use an index, last resort only
+        uid_match = Q(ubid__icontains=property_uid) | Q(custom_id_1__icontains=property_uid)
+    else:
+        uid_match = Q(ubid__iexact=property_uid) | Q(custom_id_1__iexact=property_uid)
+    state_ids = PropertyState.objects.filter(uid_match)
+
+    if org:
+        state_ids = state_ids.filter(organization=org)
+
+    if zip:
+        state_ids = state_ids.filter(postal_code=zip)
+    return PropertyView.objects.filter(state_id__in=state_ids)
+
+
+def _propertyview_by_address(street, zip, org):
+    normalized_address, extra_data = normalize_address_str(street, '', zip, {})
+    if org:
+        state_ids = PropertyState.objects.filter(normalized_address=normalized_address, organization=org)
+    else:
+        state_ids = PropertyState.objects.filter(normalized_address=normalized_address)
+    return PropertyView.objects.filter(state_id__in=state_ids)
 
 
 def propertyview_find(request, org=None):
     """
     find propertyview by id, uid or address
+
+    Exact matches on the property id, the uid (ubid or custom_id_1) and the normalized
+    address are tried first, all of which are indexed. A substring match on the uid
+    is only tried when none of them found a property.
     """
+    start = time.time()
     propertyview = None
     zip = request.GET.get('postal_code', None)
     if zip is None:
         zip = request.GET.get('zipcode', None)
+    property_uid = request.GET.get('property_uid', None)
+    street = request.GET.get('address_line_1', None)
+    if street is None:
+        street = request.GET.get('street', None)
 
+    lookups = []
     if 'property_id' in request.GET and request.GET['property_id']:
-        propertyview_pk = request.GET['property_id']
-        propertyview = PropertyView.objects.filter(pk=propertyview_pk)
-
-    if not propertyview:
-        if 'property_uid' in request.GET and request.GET['property_uid']:
-            property_uid = request.GET['property_uid']
-            state_ids = PropertyState.objects.filter(Q(ubid__icontains=property_uid) | Q(custom_id_1__icontains=property_uid))
-            
-            if org: 
-                state_ids = state_ids.filter(organization=org)
-
-            if zip:
-                state_ids = state_ids.filter(postal_code=zip)
-            propertyview = PropertyView.objects.filter(state_id__in=state_ids)
-
-    if not propertyview:
-        street = request.GET.get('address_line_1', None)
-        if street is None:
-            street = request.GET.get('street',None)
-        if street and zip:
-            normalized_address, extra_data = normalize_address_str(street, '', zip, {})
-            if org:
-                state_ids = PropertyState.objects.filter(normalized_address=normalized_address, organization=org)
-            else:
-                state_ids = PropertyState.objects.filter(normalized_address=normalized_address)
-            propertyview = PropertyView.objects.filter(state_id__in=state_ids)
-
+        lookups.append(('property_id', lambda: PropertyView.objects.filter(pk=request.GET['property_id'])))
+    if property_uid:
+        lookups.append(('uid', lambda: _propertyview_by_uid(property_uid, org, zip)))
+    if street and zip:
+        lookups.append(('address', lambda: _propertyview_by_address(street, zip, org)))
+    if property_uid:
+        lookups.append(('uid_substring', lambda: _propertyview_by_uid(property_uid, org, zip, substring=True)))
+
+    tier = None
+    for name, lookup in lookups:
+        propertyview = lookup()
+        if propertyview:
+            tier = name
+            break
+
+    _record_propertyview_find(tier, time.time() - start)
     return propertyview
 
 
+def _find_params(params):
+    """
+    (property_id, property_uid, street, zip) of a mapping of request parameters
+    """
+    zip = params.get('postal_code', None)
+    if zip is None:
+        zip = params.get('zipcode', None)
+    street = params.get('address_line_1', None)
+    if street is None:
+        street = params.get('street', None)
+    return params.get('property_id', None), params.get('property_uid', None), street, zip
+
+
+def propertyviews_find(records, org=None, workers=1):
+    """
+    propertyview_find for many records at once, each a mapping of request parameters.
+    Returns the list of matching views of every record, in record order, empty when nothing matched.
+    Each exact tier is resolved for all records left with a single query. The substring match on
+    the uid is not tried. Addresses are normalized in this process unless workers is given,
+    see normalize_addresses.
+    """
+    params = [_find_params(record) for record in records]
+    found = [[] for record in records]
+
+    pending = [i for i, (property_id, property_uid, street, zip) in enumerate(params) if str(property_id or '').isdigit()]
+    if pending:
+        by_id = PropertyView.objects.in_bulk([int(params[i][0]) for i in pending])
+        for i in pending:
+            if int(params[i][0]) in by_id:
+                found[i] = [by_id[int(params[i][0])]]
+
+    pending = [i for i, (property_id, property_uid, street, zip) in enumerate(params) if not found[i] and property_uid]
+    if pending:
+        uid_match = Q()
+        for property_uid in {params[i][1] for i in pending}:
+            uid_match |= Q(ubid__iexact=property_uid) | Q(custom_id_1__iexact=property_uid)
+        state_ids = PropertyState.objects.filter(uid_match)
+        if org:
+            state_ids = state_ids.filter(organization=org)
+        by_uid = {}
+        for view in PropertyView.objects.filter(state_id__in=state_ids).select_related('state').order_by('pk'):
+            for uid in {(view.state.ubid or '').upper(), (view.state.custom_id_1 or '').upper()}:
+                by_uid.setdefault(uid, []).append(view)
+        for i in pending:
+            property_id, property_uid, street, zip = params[i]
+            found[i] = [view for view in by_uid.get(property_uid.upper(), []) if not zip or view.state.postal_code == zip]
+
+    pending = [i for i, (property_id, property_uid, street, zip) in enumerate(params) if not found[i] and street and zip]
+    if pending:
+        normalized = normalize_addresses(((params[i][2], '', params[i][3]) for i in pending), workers)
+        addresses = {i: result[0] for i, result in zip(pending, normalized) if result and result[0]}
+        state_ids = PropertyState.objects.filter(normalized_address__in=set(addresses.values()))
+        if org:
+            state_ids = state_ids.filter(organization=org)
+        by_address = {}
+        for view in PropertyView.objects.filter(state_id__in=state_ids).select_related('state').order_by('pk'):
+            by_address.setdefault(view.state.normalized_address, []).append(view)
+        for i, normalized_address in addresses.items():
+            found[i] = by_address.get(normalized_address, [])
+    return found
+
+
+def is_true(value):
+    """
+    Interpret a request parameter as a boolean
+    """
+    return str(value).lower() == 'true'
+
+
 def data_dict_from_vars(request, txtvars, floatvars, intvars, boolvars):
     """
     Create data dictionary from request variables
     """
+    return data_dict_from_params(request.GET, txtvars, floatvars, intvars, boolvars)
+
+
+def data_dict_from_params(params, txtvars, floatvars, intvars, boolvars):
+    """
+    Create data dictionary from a mapping of parameters, e.g. request.GET or a record of a batch request
+    """
     data_dict = {}
     for var in txtvars:
-        if var in request.GET and request.GET[var] is not None:
-            data_dict[var] = request.GET[var]
+        if var in params and params[var] is not None:
+            data_dict[var] = params[var]
         else:
             data_dict[var] = None
     for var in floatvars:
-        if var in request.GET and (request.GET[var] not in [None,""]):
-            data_dict[var] = float(request.GET[var])
+        if var in params and (params[var] not in [None,""]):
+            data_dict[var] = float(params[var])
     for var in intvars:
-        if var in request.GET and (request.GET[var] not in [None,""]):
-            data_dict[var] = int(request.GET[var])
+        if var in params and (params[var] not in [None,""]):
+            data_dict[var] = int(params[var])
     for var in boolvars:
-        if var in request.GET and request.GET[var] == "true":
+        if var in params and params[var] in ["true", True]:
             data_dict[var] = True
         else:
             data_dict[var] = False
     return data_dict
 
 
-def add_certification_label_to_property(propertyview, user, assessment, url, data_dict=None, status=None, reference_id=None, org=None):
+def add_certification_label_to_property(propertyview, user, assessment, url, data_dict=None, status=None, reference_id=None, org=None, fingerprint=None):
+    """
+    Add profile or scorecard URL to property, with the fingerprint of the label if it was rendered
     """
-    Add profile or scorecard URL to property
+    add_certification_labels([(pv, url, data_dict, status, reference_id) for pv in propertyview], user, assessment, org,
+                             {url: fingerprint} if fingerprint else None)
+
+
+def add_certification_labels(labels, user, assessment, org=None, fingerprints=None):
     """
-    for pv in propertyview:
-        assessment_data = {'assessment': assessment, 'view': pv, 'date': datetime.date.today()}
+    add_certification_label_to_property for many properties at once.
+    labels is a list of (propertyview, url, data_dict, status, reference_id) tuples, one per view,
+    fingerprints the fingerprint of every rendered label by url.
+
+    Everything is written in a single transaction. The latest assessment of every view and the
+    latest audit log of every assessment are read with one DISTINCT ON query each, existing
+    assessments, urls and measurements are written with bulk_update and bulk_create, and column
+    mappings are created once. New assessments are created one by one, multi-table inheritance
+    models can not be bulk created, and every assessment is still logged through log or
+    initialize_audit_logs, so the audit trail is unchanged.
+    A state is only saved, through save so SEED's save hooks run, when a label adds keys to its extra_data.
+    """
+    with transaction.atomic():
+        _add_certification_labels(labels, user, assessment, org, fingerprints or {})
+        # bulk writes send no signals
+        reso_cache.invalidate_views({label[0].pk for label in labels})
+
+
+# fields of an existing assessment updated by a label
+LABEL_ASSESSMENT_FIELDS = ['date', 'status', 'status_date', 'reference_id', 'source', 'opt_out']
+
+
+def latest_assessments(views, assessment):
+    """
+    (latest assessment of every view by view id, latest audit log of every assessment by
+    assessment id) of views for assessment, with one DISTINCT ON query each
+    """
+    views_by_pk = {pv.pk: pv for pv in views}
+    green_properties = {}
+    prior_assessments = HELIXGreenAssessmentProperty.objects.filter(
+            view__in=views,
+            assessment=assessment).order_by('view_id', '-date', '-id').distinct('view_id')
+    for green_property in prior_assessments:
+        # the audit log reads the organization through the view
+        green_property.view = views_by_pk[green_property.view_id]
+        green_properties[green_property.view_id] = green_property
+
+    audit_logs = {}
+    old_audit_logs = GreenAssessmentPropertyAuditLog.objects.filter(
+            greenassessmentproperty__in=[green_property.pk for green_property in green_properties.values()]).exclude(
+            record_type=AUDIT_USER_EXPORT).order_by('greenassessmentproperty_id', '-created', '-id').distinct('greenassessmentproperty_id')
+    for old_audit_log in old_audit_logs:
+        audit_logs[old_audit_log.greenassessmentproperty_id] = old_audit_log
+    return green_properties, audit_logs
+
+
+def log_assessment(green_property, changed_fields, audit_logs, user):
+    """
+    Save a new assessment with its first audit log, or log the changes of an existing one,
+    which is left for the caller to save, in bulk. audit_logs is kept up to date.
+    """
+    if green_property.pk is None:
+        green_property.save()
+        audit_logs[green_property.pk] = green_property.initialize_audit_logs(user=user)
+        return
+    old_audit_log = audit_logs.get(green_property.pk)
+    if old_audit_log is not None:
+        # log changes
+        audit_logs[green_property.pk] = green_property.log(
+                changed_fields=changed_fields,
+                ancestor=old_audit_log.ancestor,
+                parent=old_audit_log,
+                user=user) or old_audit_log
+    else:
+        audit_logs[green_property.pk] = green_property.initialize_audit_logs(user=user)
+
+
+def _add_certification_labels(labels, user, assessment, org, fingerprints):
+    today = datetime.date.today()
+    now = datetime.datetime.now()
+    views = [label[0] for label in labels]
+    prefetch_related_objects(views, 'state', 'cycle')
+    green_properties, audit_logs = latest_assessments(views, assessment)
+
+    labeled = []
+    updated = {}
+    for pv, url, data_dict, status, reference_id in labels:
+        assessment_data = {'assessment': assessment, 'view': pv, 'date': today}
         if data_dict and 'source' in data_dict:
             assessment_data['source'] = data_dict['source']
-            
-        # consolidate with green addendum
-        priorAssessments = HELIXGreenAssessmentProperty.objects.filter(
-                view=pv,
-                assessment=assessment)
-        if(not priorAssessments.exists()):
+
+        green_property = green_properties.get(pv.pk)
+        if green_property is None:
             # If the property does not have an assessment in the database
             # for the specifed assesment type create a new one.
-            green_property = HELIXGreenAssessmentProperty.objects.create(**assessment_data)
-            green_property.initialize_audit_logs(user=user)
-            green_property.save()
+            green_property = HELIXGreenAssessmentProperty(**assessment_data)
         else:
-            # find most recently created property and a corresponding audit log
-            green_property = priorAssessments.order_by('date').last()
             green_property.date = assessment_data['date']
-            old_audit_log = GreenAssessmentPropertyAuditLog.objects.filter(greenassessmentproperty=green_property).exclude(record_type=AUDIT_USER_EXPORT).order_by('created').last()
-            if old_audit_log is not None:
-                # log changes
-                green_property.log(
-                        changed_fields=assessment_data,
-                        ancestor=old_audit_log.ancestor,
-                        parent=old_audit_log,
-                        user=user)
-            else:
-                green_property.initialize_audit_logs(user=user)
         if status is not None:
             green_property.status = status.lower()
-            green_property.status_date = datetime.date.today()
+            green_property.status_date = today
         if reference_id is not None:
             green_property.reference_id = reference_id
         if 'source' in assessment_data:
             green_property.source = assessment_data['source']
         if data_dict and 'opt_out' in data_dict:
             green_property.opt_out = data_dict['opt_out']
-        green_property.save()        
 
-        ga_url, _created = GreenAssessmentURL.objects.get_or_create(property_assessment=green_property)
-        ga_url.url = url
-        ga_url.description = 'Profile generated on ' + datetime.datetime.now().strftime("%Y-%m-%d %H:%M")
-        ga_url.save()
-        
-        if data_dict and 'mmbtu' in data_dict:
-            measurement_data = {'assessment_property_id': green_property.id, 'measurement_type': 'CONS', 'unit': 'MMBTU', 'year': datetime.datetime.now().year}
-            measurement_record, created = HelixMeasurement.objects.get_or_create(**measurement_data)
-            measurement_record.quantity = int(data_dict["mmbtu"])
-            measurement_record.save()
-        if data_dict and 'score' in data_dict:
-            measurement_data = {'assessment_property_id': green_property.id, 'measurement_type': 'COST', 'unit': '$', 'year': datetime.datetime.now().year}
-            measurement_record, created = HelixMeasurement.objects.get_or_create(**measurement_data)
-            measurement_record.quantity = int(data_dict["score"])
-            measurement_record.save()
-
-        state_keys = pv.state.__dict__.keys()
-        extra_data_keys = pv.state.extra_data.keys()
-        
-        column_data = []
-        for key, value in data_dict.items():
-            if (key not in state_keys) and (key not in extra_data_keys):
-                pv.state.extra_data[key] = value
-                column_data.append({
+        if green_property.pk is not None:
+            updated[green_property.pk] = green_property
+        log_assessment(green_property, assessment_data, audit_logs, user)
+        green_properties[pv.pk] = green_property
+        labeled.append((pv, green_property, url, data_dict))
+    HELIXGreenAssessmentProperty.objects.bulk_update(list(updated.values()), LABEL_ASSESSMENT_FIELDS)
+
+    assessment_ids = [green_property.pk for pv, green_property, url, data_dict in labeled]
+    _add_label_urls(labeled, assessment_ids, now, fingerprints)
+    _add_label_measurements(labeled, assessment_ids, now.year)
+
+    column_data = {}
+    states = {}
+    changed_states = set()
+    for pv, green_property, url, data_dict in labeled:
+        if not data_dict:
+            continue
+        # a state shared by several labels is updated once, with the keys of all of them
+        state = states.setdefault(pv.state.pk, pv.state)
+        state_keys = state.__dict__.keys()
+        extra_data_keys = state.extra_data.keys()
+        new_keys = [key for key in data_dict if key not in state_keys and key not in extra_data_keys]
+        for key in new_keys:
+            state.extra_data[key] = data_dict[key]
+            column_data[key] = {
                 "from_field": key,
                 "to_field": key,
                 "to_table_name": "PropertyState"
-                })
-        pv.state.save()
-        if org:
-            Column.create_mappings(column_data, org, user)
+            }
+        if new_keys:
+            changed_states.add(state.pk)
+    for state_id in changed_states:
+        states[state_id].save()
+    if org:
+        Column.create_mappings(list(column_data.values()), org, user)
+
+
+def _add_label_urls(labeled, assessment_ids, now, fingerprints):
+    urls = {}
+    for ga_url in GreenAssessmentURL.objects.filter(property_assessment_id__in=assessment_ids).order_by('id'):
+        urls.setdefault(ga_url.property_assessment_id, ga_url)
+
+    description = 'Profile generated on ' + now.strftime("%Y-%m-%d %H:%M")
+    existing_urls = list(urls.values())
+    new_urls = []
+    for pv, green_property, url, data_dict in labeled:
+        ga_url = urls.get(green_property.pk)
+        if ga_url is None:
+            ga_url = urls[green_property.pk] = GreenAssessmentURL(property_assessment_id=green_property.pk)
+            new_urls.append(ga_url)
+        ga_url.url = url
+        ga_url.description = description
+    GreenAssessmentURL.objects.bulk_update(existing_urls, ['url', 'description'])
+    GreenAssessmentURL.objects.bulk_create(new_urls)
+    save_fingerprints([(ga_url, fingerprints.get(ga_url.url)) for ga_url in existing_urls + new_urls])
+
+
+# data_dict key of a label and the (measurement_type, unit) it is stored as
+LABEL_MEASUREMENTS = {
+    'mmbtu': ('CONS', 'MMBTU'),
+    'score': ('COST', '$'),
+}
+
+
+def _add_label_measurements(labeled, assessment_ids, year):
+    if not any(data_dict and key in data_dict for pv, green_property, url, data_dict in labeled for key in LABEL_MEASUREMENTS):
+        return
+    measurements = {}
+    matches = HelixMeasurement.objects.filter(
+        assessment_property_id__in=assessment_ids,
+        measurement_type__in=[measurement_type for measurement_type, unit in LABEL_MEASUREMENTS.values()],
+        unit__in=[unit for measurement_type, unit in LABEL_MEASUREMENTS.values()],
+        year=year).order_by('id')
+    for match in matches:
+        measurements.setdefault((match.assessment_property_id, match.measurement_type, match.unit), match)
+
+    updated_measurements = {}
+    new_measurements = []
+    for pv, green_property, url, data_dict in labeled:
+        for key, (measurement_type, unit) in LABEL_MEASUREMENTS.items():
+            if not data_dict or key not in data_dict:
+                continue
+            measurement_key = (green_property.pk, measurement_type, unit)
+            measurement_record = measurements.get(measurement_key)
+            if measurement_record is None:
+                measurement_record = measurements[measurement_key] = HelixMeasurement(
+                    assessment_property_id=green_property.pk, measurement_type=measurement_type, unit=unit, year=year)
+                new_measurements.append(measurement_record)
+            else:
+                updated_measurements[measurement_record.pk] = measurement_record
+            measurement_record.quantity = int(data_dict[key])
+    HelixMeasurement.objects.bulk_update(list(updated_measurements.values()), ['quantity'])
+    HelixMeasurement.objects.bulk_create(new_measurements)
@@ -0,0 +1,36 @@
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from helix.models import HELIXGreenAssessment, HELIXOrganization
+from helix.utils import hes_sync
+
+
+def _date(value):
+    return datetime.datetime.strptime(value, '%Y-%m-%d').date()
+
+
+class Command(BaseCommand):
+    help = "Sync the Home Energy Scores of an organization's buildings assessed in a date window, or of the given buildings"
+
+    def add_arguments(self, parser):
+        parser.add_argument('organization', help='name of the organization')
+        parser.add_argument('--start-date', type=_date, help='first assessment date, yyyy-mm-dd, defaults to the organization hes_start_date')
+        parser.add_argument('--end-date', type=_date, help='last assessment date, yyyy-mm-dd, defaults to the organization hes_end_date')
+        parser.add_argument('--hes-id', action='append', dest='hes_ids', help='building to sync instead of the date window, repeatable')
+        parser.add_argument('--refresh', action='store_true', help='fetch buildings again even when their response is cached')
+
+    def handle(self, *args, **options):
+        try:
+            org = HELIXOrganization.objects.get(name=options['organization'])
+        except HELIXOrganization.DoesNotExist:
+            raise CommandError('organization %s does not exist' % options['organization'])
+        try:
+            # no other threads are running here, so addresses may be normalized in a process pool
+            result = hes_sync.sync(org, None, options['hes_ids'], options['start_date'], options['end_date'], options['refresh'],
+                                   workers=None)
+        except HELIXGreenAssessment.DoesNotExist:
+            raise CommandError('create a certification named %s first' % hes_sync.HES_ASSESSMENT_NAME)
+        self.stdout.write('fetched %(fetched)s, written %(written)s, unchanged %(unchanged)s' % result)
+        if result['failed']:
+            self.stdout.write('failed: ' + ', '.join(result['failed']))
@@ -0,0 +1,29 @@
+from django.db import migrations
+
+# Indexes on seed_propertystate for the exact match lookups of helix_utils.propertyview_find.
+# iexact lookups compare UPPER(column::text), so the uid indexes are on that expression.
+
+
+class Migration(migrations.Migration):
+
+    # CREATE INDEX CONCURRENTLY can not run inside a transaction
+    atomic = False
+
+    dependencies = [
+        ('helix', '0002_auto_20200424_1259'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            'CREATE INDEX CONCURRENTLY IF NOT EXISTS helix_propertystate_ubid_upper ON seed_propertystate (UPPER(ubid::text));',
+            'DROP INDEX CONCURRENTLY IF EXISTS helix_propertystate_ubid_upper;',
+        ),
+        migrations.RunSQL(
+            'CREATE INDEX CONCURRENTLY IF NOT EXISTS helix_propertystate_custom_id_1_upper ON seed_propertystate (UPPER(custom_id_1::text));',
+            'DROP INDEX CONCURRENTLY IF EXISTS helix_propertystate_custom_id_1_upper;',
+        ),
+        migrations.RunSQL(
+            'CREATE INDEX CONCURRENTLY IF NOT EXISTS helix_propertystate_normalized_address_org ON seed_propertystate (normalized_address, organization_id);',
+            'DROP INDEX CONCURRENTLY IF EXISTS helix_propertystate_normalized_address_org;',
+        ),
+    ]
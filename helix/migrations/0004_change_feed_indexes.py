@@ -0,0 +1,25 @@
+from django.db import migrations
+
+# Indexes for the keyset scans of the change feed in helix.utils.feed, which reads
+# properties by (updated, id) and green assessment audit logs by (created, id) per organization.
+
+
+class Migration(migrations.Migration):
+
+    # CREATE INDEX CONCURRENTLY can not run inside a transaction
+    atomic = False
+
+    dependencies = [
+        ('helix', '0003_propertystate_lookup_indexes'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            'CREATE INDEX CONCURRENTLY IF NOT EXISTS helix_property_org_updated ON seed_property (organization_id, updated, id);',
+            'DROP INDEX CONCURRENTLY IF EXISTS helix_property_org_updated;',
+        ),
+        migrations.RunSQL(
+            'CREATE INDEX CONCURRENTLY IF NOT EXISTS helix_greenassessmentpropertyauditlog_org_created ON seed_greenassessmentpropertyauditlog (organization_id, created, id);',
+            'DROP INDEX CONCURRENTLY IF EXISTS helix_greenassessmentpropertyauditlog_org_created;',
+        ),
+    ]
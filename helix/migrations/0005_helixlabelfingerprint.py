@@ -0,0 +1,22 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('seed', '0114_auto_20191202_1652'),
+        ('helix', '0004_change_feed_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HELIXLabelFingerprint',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('label_type', models.CharField(max_length=100)),
+                ('digest', models.CharField(db_index=True, max_length=64)),
+                ('assessment_url', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='fingerprint', to='seed.GreenAssessmentURL')),
+            ],
+        ),
+    ]
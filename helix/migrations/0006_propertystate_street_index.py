@@ -0,0 +1,21 @@
+from django.db import migrations
+
+# Index on seed_propertystate for the street lookups of duplicates.page_candidates,
+# on the same ->> expressions KeyTextTransform filters with.
+
+
+class Migration(migrations.Migration):
+
+    # CREATE INDEX CONCURRENTLY can not run inside a transaction
+    atomic = False
+
+    dependencies = [
+        ('helix', '0005_helixlabelfingerprint'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS helix_propertystate_street ON seed_propertystate ((extra_data ->> 'StreetNumber'), (extra_data ->> 'StreetName'));",
+            'DROP INDEX CONCURRENTLY IF EXISTS helix_propertystate_street;',
+        ),
+    ]
@@ -85,6 +85,18 @@ class HELIXGreenAssessmentProperty(certification.GreenAssessmentProperty):
     # hes_estimated_savings, hes_rate
 
 
+class HELIXLabelFingerprint(models.Model):
+    """
+    Fingerprint of the data a label was rendered from, to reuse the label when the same data is labeled again
+    assessment_url  GreenAssessmentURL of the rendered label
+    label_type      Label method that rendered it
+    digest          sha256 of the label type, template version and data
+    """
+    assessment_url = models.OneToOneField(certification.GreenAssessmentURL, on_delete=models.CASCADE, related_name='fingerprint')
+    label_type = models.CharField(max_length=100)
+    digest = models.CharField(max_length=64, db_index=True)
+
+
 class HELIXOrganization(Organization):
     """
     Additional fields for Organization
@@ -192,19 +204,25 @@ class HELIXPropertyMeasure(property_measures.PropertyMeasure):
     reference_id = models.CharField(max_length=100, null=True, blank=True)
     source = models.CharField(max_length=5, choices=SOURCE_CHOICES, null=True, blank=True)
 
+    # fields read by reso_dict_from_values
+    RESO_VALUES = ('electric', 'ownership', 'source')
+
     def to_reso_dict(self):
         """
         Return a dict where keys are RESO Power Production Ownership and Electric compatible names.
         """
-        reso_dict = {'Electric': None, 'PowerProductionOwnership': None, 'PowerProductionSource': None}
-        if self.electric:
-            reso_dict['Electric'] = dict(self.ELECTRIC_CHOICES)[self.electric]
-        if self.ownership:
-            reso_dict['PowerProductionOwnership'] = dict(self.OWNERSHIP_CHOICES)[self.ownership]
-        if self.source:
-            reso_dict['PowerProductionSource'] = dict(self.SOURCE_CHOICES)[self.source]
+        return self.reso_dict_from_values({key: getattr(self, key) for key in self.RESO_VALUES})
 
-        return reso_dict
+    @classmethod
+    def reso_dict_from_values(cls, values):
+        """
+        to_reso_dict of a measure given as a mapping of its RESO_VALUES, e.g. a .values() row
+        """
+        return {
+            'Electric': MEASURE_ELECTRIC_LABELS.get(values['electric']) if values['electric'] else None,
+            'PowerProductionOwnership': MEASURE_OWNERSHIP_LABELS.get(values['ownership']) if values['ownership'] else None,
+            'PowerProductionSource': MEASURE_SOURCE_LABELS.get(values['source']) if values['source'] else None,
+        }
 
     def to_label_dict(self, index=0):
         ext = '' if index == 0 else '_'+str(index+1)
@@ -222,6 +240,12 @@ class HELIXPropertyMeasure(property_measures.PropertyMeasure):
         return ga_dict
 
 
+# choice labels by value, built once instead of on every to_reso_dict call
+MEASURE_ELECTRIC_LABELS = dict(HELIXPropertyMeasure.ELECTRIC_CHOICES)
+MEASURE_OWNERSHIP_LABELS = dict(HELIXPropertyMeasure.OWNERSHIP_CHOICES)
+MEASURE_SOURCE_LABELS = dict(HELIXPropertyMeasure.SOURCE_CHOICES)
+
+
 class HelixMeasurement(models.Model):
     """
     Measurementsattached to a certification.
@@ -343,34 +367,40 @@ class HelixMeasurement(models.Model):
     status = models.CharField(max_length=13, choices=STATUS_CHOICES)
     year = models.IntegerField(null=True, blank=True)
 
+    # fields read by reso_dict_from_values
+    RESO_VALUES = ('measurement_type', 'measurement_subtype', 'quantity', 'status', 'year')
+
     def to_reso_dict(self):
         """
         Return a dict where keys are RESO Power Production compatible names.
         RESO Power Production field names may optionally contain the type
         (i.e. name). e.g. Powerproduction[Type]Annual
         """
-        reso_dict = {}
-        if self.measurement_type == 'PROD':
-            for key, val in self.PV_PROD_MAPPING.items():
-                attr = getattr(self, key)
-                if attr in dict(self.STATUS_CHOICES).keys():
-                    attr = dict(self.STATUS_CHOICES)[attr]
-                if attr in dict(self.MEASUREMENT_SUBTYPE_CHOICES).keys():
-                    attr = dict(self.MEASUREMENT_SUBTYPE_CHOICES)[attr]
-                reso_dict[val] = attr
-
-        if self.measurement_type == 'CAP':
-            for key, val in self.PV_CAP_MAPPING.items():
-                attr = getattr(self, key)
-                if attr in dict(self.MEASUREMENT_SUBTYPE_CHOICES).keys():
-                    attr = dict(self.MEASUREMENT_SUBTYPE_CHOICES)[attr]
-                reso_dict[val] = attr
+        return self.reso_dict_from_values({key: getattr(self, key) for key in self.RESO_VALUES})
 
-        if self.measurement_type == 'COST':
-            for key, val in self.PV_COST_MAPPING.items():
-                reso_dict[val] = getattr(self, key)
-
-        return reso_dict
+    @classmethod
+    def reso_dict_from_values(cls, values):
+        """
+        to_reso_dict of a measurement given as a mapping of its RESO_VALUES, e.g. a .values() row
+        """
+        if values['measurement_type'] == 'PROD':
+            return {val: MEASUREMENT_PROD_LABELS.get(values[key], values[key]) for key, val in cls.PV_PROD_MAPPING.items()}
+        if values['measurement_type'] == 'CAP':
+            return {val: MEASUREMENT_SUBTYPE_LABELS.get(values[key], values[key]) for key, val in cls.PV_CAP_MAPPING.items()}
+        if values['measurement_type'] == 'COST':
+            return {val: values[key] for key, val in cls.PV_COST_MAPPING.items()}
+        return {}
+
+    @classmethod
+    def reso_dicts(cls, rows, key):
+        """
+        RESO dicts of .values() rows of measurements with RESO_VALUES and key, merged in row
+        order by the value of key, e.g. a property id. No instance is created.
+        """
+        reso_dicts = {}
+        for row in rows:
+            reso_dicts.setdefault(row[key], {}).update(cls.reso_dict_from_values(row))
+        return reso_dicts
 
     def to_label_dict(self, index=0, prefix=''):
         ga_dict = {}
@@ -384,3 +414,9 @@ class HelixMeasurement(models.Model):
         if self.measurement_type == 'SAVE':
             ga_dict[prefix+'_estimated_savings'] = str(round(self.quantity))
         return ga_dict
+
+
+# choice labels by value, built once instead of on every to_reso_dict call. Production
+# values are status or subtype codes, which do not overlap.
+MEASUREMENT_SUBTYPE_LABELS = dict(HelixMeasurement.MEASUREMENT_SUBTYPE_CHOICES)
+MEASUREMENT_PROD_LABELS = dict(HelixMeasurement.STATUS_CHOICES, **MEASUREMENT_SUBTYPE_LABELS)
@@ -0,0 +1,36 @@
+"""
+Timing of find_duplicates for growing numbers of states.
+Run with: python -m helix.tests.benchmark_duplicates
+"""
+import random
+import time
+
+from helix.utils.duplicates import DuplicateState, find_duplicates
+
+
+def synthetic_states(count, seed=0):
+    """
+    Roughly one likely duplicate per ten states, spread over many streets
+    """
+    rand = random.Random(seed)
+    streets = max(count // 10, 1)
+    return [DuplicateState(
+        id=i, address_line_1=None, city=None, postal_code='0%04d' % rand.randint(0, 20), normalized_address=None,
+        StreetNumber=str(rand.randint(1, 50)),
+        StreetName='street %d' % rand.randint(0, streets),
+        StreetDirPrefix=rand.choice(['', 'n']),
+        UnitNumber=rand.choice(['', '', '', '1'])) for i in range(count)]
+
+
+def main():
+    print('%10s %10s %12s %14s' % ('states', 'pairs', 'seconds', 'us per state'))
+    for count in (1000, 10000, 100000, 300000):
+        states = synthetic_states(count)
+        start = time.perf_counter()
+        pairs = sum(1 for _ in find_duplicates(states))
+        elapsed = time.perf_counter() - start
+        print('%10d %10d %12.3f %14.2f' % (count, pairs, elapsed, 1e6 * elapsed / count))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+from unittest import mock
+
+from django.test import TestCase
+
+from helix.utils import address
+
+
+class TestAddressCache(TestCase):
+
+    def setUp(self):
+        address.address_cache_clear()
+
+    def test_hits_and_misses(self):
+        cache = address.AddressCache(maxsize=10)
+        self.assertIsNone(cache.get('a'))
+        cache.set('a', 1)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.get('a'), 1)
+        info = cache.info()
+        self.assertEqual((info.hits, info.misses, info.evictions, info.currsize), (2, 1, 0, 1))
+
+        cache.clear()
+        self.assertEqual(cache.info(), address.AddressCacheInfo(0, 0, 0, 10, 0))
+
+    def test_least_recently_used_is_evicted(self):
+        cache = address.AddressCache(maxsize=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.get('c'), 3)
+        self.assertEqual(cache.info().evictions, 1)
+        self.assertEqual(cache.info().currsize, 2)
+
+    def test_normalize_address_str_is_cached(self):
+        first = address.normalize_address_str('12 North Main Street Apt 3', None, '02139', {})
+        second = address.normalize_address_str('12 North Main Street Apt 3', None, '02139', {})
+        self.assertEqual(first, second)
+        info = address.address_cache_info()
+        self.assertEqual((info.hits, info.misses), (1, 1))
+
+    def test_cached_results_can_not_be_changed(self):
+        normalized, extra_data = address.normalize_address_str('12 North Main Street Apt 3', None, '02139', {})
+        expected = dict(extra_data)
+        extra_data['StreetName'] = 'changed'
+        extra_data['Other'] = 'added'
+
+        caller_data = {'Existing': 'kept'}
+        self.assertEqual(address.normalize_address_str('12 North Main Street Apt 3', None, '02139', caller_data),
+                         (normalized, dict(expected, Existing='kept')))
+        self.assertIs(address.normalize_address_str('12 North Main Street Apt 3', None, '02139', caller_data)[1], caller_data)
+
+
+class TestNormalizeAddresses(TestCase):
+
+    ADDRESSES = [
+        '12 North Main Street Apt 3',
+        ('1 Elm St', 'Unit 2', '02139'),
+        '400 Massachusetts Avenue',
+        '',
+        ('77 Broadway', None, '2142'),
+        '9 Oak Rd',
+        '31 W 5th Street',
+    ]
+
+    def _serial(self):
+        return [address.normalize_address_str(*address._address_args(value), {}) for value in self.ADDRESSES]
+
+    def test_pool_results_in_input_order(self):
+        with mock.patch('helix.utils.address.ProcessPoolExecutor', wraps=address.ProcessPoolExecutor) as executor:
+            results = list(address.normalize_addresses(self.ADDRESSES, workers=2, chunk_size=2))
+        executor.assert_called_once_with(max_workers=2)
+        self.assertEqual(results, self._serial())
+        self.assertEqual(results[3], None)
+        self.assertTrue(results[2][0].startswith('400 massachusetts'))
+
+    def test_single_worker_is_serial(self):
+        with mock.patch('helix.utils.address.ProcessPoolExecutor') as executor:
+            results = list(address.normalize_addresses(self.ADDRESSES, workers=1, chunk_size=2))
+            results_zero = list(address.normalize_addresses(self.ADDRESSES, workers=0, chunk_size=2))
+        executor.assert_not_called()
+        self.assertEqual(results, self._serial())
+        self.assertEqual(results_zero, results)
@@ -0,0 +1,70 @@
+from unittest import mock
+
+import zeep.client
+from django.test import TestCase
+
+from helix.models import HELIXOrganization as Organization
+from helix.utils import clients
+from helix.utils.clients import HESSessionPool
+
+
+class StubHesSession(object):
+    def __init__(self, org, fail=0):
+        self.org = org
+        self.fail = fail
+        self.ended = False
+
+    def query_hes(self, hes_id):
+        if self.fail:
+            self.fail -= 1
+            raise RuntimeError('session expired')
+        return {'status': 'success', 'building_id': hes_id}
+
+    def end_session(self):
+        self.ended = True
+
+
+class TestHESSessionPool(TestCase):
+
+    def setUp(self):
+        self.org = Organization.objects.create(hes_partner_name='partner', hes_partner_password='secret')
+        self.sessions = []
+
+    def _factory(self, fail=0):
+        def factory(org):
+            session = StubHesSession(org, fail if not self.sessions else 0)
+            self.sessions.append(session)
+            return session
+        return factory
+
+    def test_sessions_are_reused(self):
+        pool = HESSessionPool(self._factory())
+        for hes_id in (1, 2, 3):
+            self.assertEqual(pool.call(self.org, lambda client: client.query_hes(hes_id))['building_id'], hes_id)
+        self.assertEqual(len(self.sessions), 1)
+        pool.clear()
+        self.assertTrue(self.sessions[0].ended)
+
+    def test_failed_call_logs_in_again(self):
+        pool = HESSessionPool(self._factory(fail=1))
+        self.assertEqual(pool.call(self.org, lambda client: client.query_hes(4))['building_id'], 4)
+        self.assertEqual(len(self.sessions), 2)
+        self.assertTrue(self.sessions[0].ended)
+        self.assertFalse(self.sessions[1].ended)
+
+
+class TestWsdlCache(TestCase):
+
+    def setUp(self):
+        clients.clear_wsdl_cache()
+
+    def test_wsdl_is_parsed_once(self):
+        with mock.patch.object(clients, '_Document', side_effect=lambda *args, **kwargs: object()) as document:
+            first = zeep.client.Document('https://hes.example/wsdl', 'transport', strict=True)
+            self.assertIs(zeep.client.Document('https://hes.example/wsdl', 'other transport', strict=True), first)
+            self.assertIsNot(zeep.client.Document('https://other.example/wsdl', 'transport'), first)
+            self.assertEqual(document.call_count, 2)
+
+            with self.settings(HELIX_HES_WSDL_TTL=0):
+                self.assertIsNot(zeep.client.Document('https://hes.example/wsdl', 'transport'), first)
+            self.assertEqual(document.call_count, 3)
@@ -0,0 +1,103 @@
+import random
+from collections import namedtuple
+
+from django.test import SimpleTestCase, TestCase
+
+from seed.models import PropertyState
+
+from helix.models import HELIXOrganization as Organization
+from helix.utils import export
+from helix.utils.duplicates import DuplicateState, find_duplicates, page_candidates, state_rows
+from helix.views import _duplicate_rows
+
+State = namedtuple('State', ['id', 'postal_code', 'extra_data'])
+
+
+def _duplicate_states(states):
+    """
+    DuplicateState rows of states, as state_rows reads them
+    """
+    return [DuplicateState(id=state.id, address_line_1=None, city=None, postal_code=state.postal_code, normalized_address=None,
+                           **{part: state.extra_data.get(part) for part in ('StreetNumber', 'StreetName', 'StreetDirPrefix', 'UnitNumber')})
+            for state in states]
+
+
+def _nested_loop_duplicates(states):
+    """
+    Reference implementation, comparing every state to every other one
+    """
+    pairs = []
+    skip_states = []
+    for state in states:
+        if state.id in skip_states:
+            continue
+        for rem_state in states:
+            if state.extra_data['StreetNumber'] == rem_state.extra_data['StreetNumber'] and state.extra_data['StreetName'] == rem_state.extra_data['StreetName'] and state.extra_data['UnitNumber'] == rem_state.extra_data['UnitNumber'] and state.postal_code == rem_state.postal_code and state.id != rem_state.id:
+                pairs.append(('Similar street address, same postal code', state.id, rem_state.id))
+                skip_states.append(rem_state.id)
+                continue
+            if state.extra_data['StreetNumber'] == rem_state.extra_data['StreetNumber'] and state.extra_data['StreetName'] == rem_state.extra_data['StreetName'] and state.postal_code == rem_state.postal_code and state.id != rem_state.id:
+                pairs.append(('Similar address, excludes unit #, same postal code', state.id, rem_state.id))
+                skip_states.append(rem_state.id)
+                continue
+            if state.extra_data['StreetNumber'] == rem_state.extra_data['StreetNumber'] and state.extra_data['StreetDirPrefix'] == rem_state.extra_data['StreetDirPrefix'] and state.extra_data['StreetName'] == rem_state.extra_data['StreetName'] and state.extra_data['UnitNumber'] == rem_state.extra_data['UnitNumber'] and state.postal_code != rem_state.postal_code and state.id != rem_state.id:
+                pairs.append(('Same street address, different postal code', state.id, rem_state.id))
+                skip_states.append(rem_state.id)
+                continue
+    return pairs
+
+
+def _random_states(count, seed=0):
+    rand = random.Random(seed)
+    return [State(i, rand.choice(['02139', '02140']), {
+        'StreetNumber': str(rand.randint(1, 6)),
+        'StreetName': rand.choice(['main', 'elm']),
+        'StreetDirPrefix': rand.choice(['', 'n']),
+        'UnitNumber': rand.choice(['', '1', '2'])}) for i in range(count)]
+
+
+class TestHelixDuplicates(SimpleTestCase):
+
+    def test_matches_nested_loop(self):
+        for seed in range(10):
+            states = _random_states(60, seed)
+            found = [(reason, state.id, match.id) for reason, state, match in find_duplicates(_duplicate_states(states))]
+            self.assertEqual(found, _nested_loop_duplicates(states))
+
+    def test_unparsed_states_are_not_matched(self):
+        states = [State(1, '02139', {}), State(2, '02139', {})]
+        self.assertEqual(list(find_duplicates(_duplicate_states(states))), [])
+
+
+class TestHelixDuplicateStates(TestCase):
+
+    def test_state_rows(self):
+        org = Organization.objects.create()
+        # extra_data as normalize_address_str parses it, without an address to parse again on save
+        parsed = PropertyState.objects.create(organization=org, city='Cambridge',
+                                              postal_code='02139', extra_data={'StreetNumber': '12', 'StreetName': 'main',
+                                                                               'StreetDirPrefix': 'n', 'UnitNumber': '3', 'Other': 'x'})
+        unparsed = PropertyState.objects.create(organization=org, postal_code='02139', extra_data={})
+        rows = list(state_rows(PropertyState.objects.filter(pk__in=[parsed.pk, unparsed.pk]).order_by('id'), chunk_size=1))
+        self.assertEqual([row.id for row in rows], [parsed.pk, unparsed.pk])
+        self.assertEqual((rows[0].StreetNumber, rows[0].StreetName, rows[0].StreetDirPrefix, rows[0].UnitNumber), ('12', 'main', 'n', '3'))
+        self.assertEqual((rows[0].city, rows[0].postal_code), ('Cambridge', '02139'))
+        self.assertEqual((rows[1].StreetNumber, rows[1].StreetName), (None, None))
+
+    def test_pages_list_the_pairs_of_the_whole_export(self):
+        org = Organization.objects.create()
+        for state in _random_states(40):
+            PropertyState.objects.create(organization=org, postal_code=state.postal_code, extra_data=state.extra_data)
+        PropertyState.objects.create(organization=org, postal_code='02139', extra_data={})
+        states = PropertyState.objects.filter(organization=org).order_by('id')
+        rows = list(_duplicate_rows(list(state_rows(states))))
+
+        paged = rows[:1]
+        after_id = 0
+        while after_id is not None:
+            page, next_after_id = export.page_ids(states, after_id, 7)
+            paged += list(_duplicate_rows(list(state_rows(page_candidates(states, page))), after_id, page[-1] if page else None))[1:]
+            after_id = next_after_id
+        self.assertEqual(paged, rows)
+        self.assertFalse(page_candidates(states, []).exists())
+        self.assertFalse(page_candidates(states, [states.last().pk]).exists())
@@ -0,0 +1,255 @@
+import datetime
+import unittest
+
+from django.db import connection
+from django.http import StreamingHttpResponse
+from django.test import TestCase
+from django.template.loader import render_to_string
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from seed.landing.models import SEEDUser as User
+from seed.lib.superperms.orgs.models import OrganizationUser
+from seed.models import Cycle, Measure, Property, PropertyState, PropertyView
+from seed.models.certification import GreenAssessmentPropertyAuditLog
+
+from helix.models import HELIXOrganization as Organization
+from helix.models import HELIXGreenAssessment, HELIXGreenAssessmentProperty, HelixMeasurement, HELIXPropertyMeasure
+from helix.utils import arrow_export, export, lookups, reso_cache
+from helix.views import helix_reso_export_xml
+
+
+class TestHelixExport(TestCase):
+
+    def setUp(self):
+        lookups.clear()
+        self.user = User.objects.create(username='test_user@demo.com')
+        self.org = Organization.objects.create()
+        OrganizationUser.objects.create(user=self.user, organization=self.org)
+
+        self.cycle = Cycle.objects.create(
+                organization=self.org,
+                user=self.user,
+                name="test",
+                start=timezone.now(),
+                end=timezone.now()
+        )
+        self.assessment = HELIXGreenAssessment.objects.create(
+                organization=self.org,
+                name='LEED for Homes',
+                recognition_type='CRT',
+                is_reso_certification=True
+        )
+        self.measure = Measure.objects.create(
+                organization=self.org,
+                name='install_photovoltaic_system',
+                display_name='Install photovoltaic system',
+                category='renewable_energy_systems',
+                category_display_name='Renewable Energy Systems'
+        )
+
+    def _create_views(self, count):
+        """
+        Create count properties, each with one assessment and one pv measure
+        """
+        view_ids = []
+        for i in range(count):
+            state = PropertyState.objects.create(
+                    organization=self.org,
+                    address_line_1=str(i) + ' Main St',
+                    city='Cambridge',
+                    state='MA',
+                    postal_code='02139',
+                    extra_data={})
+            prop = Property.objects.create(organization=self.org)
+            view = PropertyView.objects.create(property=prop, cycle=self.cycle, state=state)
+            HELIXGreenAssessmentProperty.objects.create(assessment=self.assessment, view=view, date=datetime.date.today())
+            measure = HELIXPropertyMeasure.objects.create(measure=self.measure, property_state=state, property_measure_name='pv')
+            HelixMeasurement.objects.create(measure_property=measure, measurement_type='CAP', measurement_subtype='PV', quantity=5.0, unit='KW', year=2019)
+            view_ids.append(view.pk)
+        return PropertyView.objects.filter(pk__in=view_ids)
+
+    def _csv_export_queries(self, count):
+        views = self._create_views(count)
+        organizations = lookups.user_organization_ids(self.user)
+        lookups.reso_certification_ids(organizations)
+        with CaptureQueriesContext(connection) as queries:
+            assessments = list(export.export_assessments(views, organizations))
+            measures = list(export.export_measures(views))
+            rows = list(export.csv_rows(assessments, measures))
+        self.assertEqual(len(rows), 2 * count)
+        return len(queries.captured_queries)
+
+    def test_csv_export_query_count_is_constant(self):
+        self.assertEqual(self._csv_export_queries(10), self._csv_export_queries(100))
+
+    def test_csv_export_rows(self):
+        views = self._create_views(1)
+        organizations = lookups.user_organization_ids(self.user)
+        assessments = list(export.export_assessments(views, organizations))
+        measures = list(export.export_measures(views))
+        header = export.csv_header(bool(measures))
+        rows = list(export.csv_rows(assessments, measures))
+
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(len(rows[0]), len(header) - len(export.POWER_PRODUCTION_FIELDS))
+        self.assertEqual(len(rows[1]), len(header))
+        self.assertEqual(rows[0][header.index('Unparsed Address')], '0 Main St')
+        self.assertEqual(rows[1][header.index('PowerProductionSize')], 5.0)
+
+    def test_csv_export_street_parts_from_extra_data(self):
+        views = self._create_views(1)
+        PropertyState.objects.filter(pk=views[0].state_id).update(extra_data={'StreetNumber': '0', 'StreetName': 'Main', 'Other': 'x' * 1000})
+        organizations = lookups.user_organization_ids(self.user)
+        header = export.csv_header(True)
+        rows = list(export.csv_rows(list(export.export_assessments(views, organizations)), list(export.export_measures(views))))
+        for row in rows:
+            self.assertEqual(row[header.index('StreetNumber')], '0')
+            self.assertEqual(row[header.index('StreetName')], 'Main')
+            self.assertEqual(row[header.index('UnitNumber')], '')
+            self.assertEqual(row[header.index('City')], 'Cambridge')
+
+    @unittest.skipUnless(arrow_export.available(), 'needs pyarrow')
+    def test_arrow_export_record_batches(self):
+        views = self._create_views(3)
+        organizations = lookups.user_organization_ids(self.user)
+        measures = export.export_measures(views)
+        schema = arrow_export.schema(measures.exists())
+        batches = list(arrow_export.record_batches(export.export_assessments(views, organizations), measures, schema, chunk_size=4))
+        self.assertEqual([batch.num_rows for batch in batches], [4, 2])
+
+        table = arrow_export.pyarrow.Table.from_batches(batches)
+        self.assertEqual(str(table.schema.field('PowerProductionSize').type), 'double')
+        self.assertEqual(str(table.schema.field('PowerProductionYearInstall').type), 'int64')
+        self.assertEqual(sorted(size for size in table.column('PowerProductionSize').to_pylist() if size is not None), [5.0] * 3)
+        self.assertEqual(table.column('PowerProductionYearInstall').null_count, 3)
+
+    def _xml_export_queries(self, count):
+        """
+        Queries to export a property with count assessments and count pv measures
+        """
+        state = PropertyState.objects.create(
+                organization=self.org,
+                address_line_1='1 Main St',
+                city='Cambridge',
+                state='MA',
+                postal_code='02139',
+                normalized_address='1 main st 02139',
+                extra_data={})
+        view = PropertyView.objects.create(property=Property.objects.create(organization=self.org), cycle=self.cycle, state=state)
+        for i in range(count):
+            assessment = HELIXGreenAssessmentProperty.objects.create(assessment=self.assessment, view=view, date=datetime.date.today())
+            HelixMeasurement.objects.create(assessment_property=assessment, measurement_type='COST', quantity=1000 + i, unit='$', year=2019)
+            measure = HELIXPropertyMeasure.objects.create(measure=self.measure, property_state=state, property_measure_name='pv')
+            HelixMeasurement.objects.create(measure_property=measure, measurement_type='CAP', measurement_subtype='PV', quantity=5.0 + i, unit='KW', year=2019)
+        organizations = lookups.user_organization_ids(self.user)
+        lookups.reso_certification_ids(organizations)
+
+        with CaptureQueriesContext(connection) as queries:
+            content, assessments = export.reso_xml_content(PropertyView.objects.filter(pk=view.pk), organizations)
+            xml = render_to_string('reso_export_template.xml', {'content': content})
+        self.assertEqual(len(assessments), count)
+        self.assertEqual(xml.count('<GreenBuildingVerification>'), count)
+        self.assertIn('<PowerProductionSize>' + str(5.0 + count - 1) + '</PowerProductionSize>', xml)
+        return len(queries.captured_queries)
+
+    def test_xml_export_query_count_is_constant(self):
+        self.assertEqual(self._xml_export_queries(1), self._xml_export_queries(5))
+
+    def test_batch_xml_contents(self):
+        views = self._create_views(3)
+        organizations = lookups.user_organization_ids(self.user)
+        logged = []
+        contents = list(export.stream_reso_xml_contents(views, organizations, chunk_size=2, on_assessments=logged.extend))
+
+        self.assertEqual([content['property'].address_line_1 for content in contents], ['0 Main St', '1 Main St', '2 Main St'])
+        self.assertEqual([len(content['assessments']) for content in contents], [1, 1, 1])
+        self.assertEqual(contents[2]['measurements']['PowerProductionSize'], 5.0)
+        self.assertEqual(len(logged), 3)
+
+    def test_xml_export_cache_key_follows_data(self):
+        views = self._create_views(1)
+        view = views.first()
+        reso_certifications = lookups.reso_certification_ids(lookups.user_organization_ids(self.user))
+        key = reso_cache.export_key([view.pk], reso_certifications)
+        self.assertEqual(reso_cache.export_key([view.pk], reso_certifications), key)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            HelixMeasurement.objects.filter(measure_property__property_state=view.state).first().save()
+        changed_key = reso_cache.export_key([view.pk], reso_certifications)
+        self.assertNotEqual(changed_key, key)
+        self.assertNotEqual(reso_cache.export_key([view.pk], []), changed_key)
+
+    def _reso_export_xml(self, params, etag=None):
+        request = APIRequestFactory().get('/helix/helix-reso-export-xml/', params, HTTP_IF_NONE_MATCH=etag or '')
+        force_authenticate(request, user=self.user)
+        return helix_reso_export_xml(request)
+
+    def test_xml_export_unknown_property_id(self):
+        view = self._create_views(1).first()
+        PropertyState.objects.filter(pk=view.state_id).update(custom_id_1='ABC-123')
+        missing_id = str(view.pk + 1000)
+        reso_certifications = lookups.reso_certification_ids(lookups.user_organization_ids(self.user))
+        missing_etag = reso_cache.etag(reso_cache.export_key([int(missing_id)], reso_certifications, False))
+
+        self.assertEqual(self._reso_export_xml({'property_id': missing_id}, missing_etag).status_code, 404)
+
+        response = self._reso_export_xml({'property_id': missing_id, 'property_uid': 'ABC-123'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['ETag'], reso_cache.etag(reso_cache.export_key([view.pk], reso_certifications, False)))
+        response.close()
+        self.assertEqual(self._reso_export_xml({'property_id': view.pk}, response['ETag']).status_code, 304)
+
+    def test_page_ids(self):
+        views = self._create_views(5)
+        view_ids = sorted(views.values_list('pk', flat=True))
+        self.assertEqual(export.page_params({}), (None, None))
+        after_id, limit = export.page_params({'limit': '2'})
+
+        pages = []
+        while after_id is not None:
+            page, after_id = export.page_ids(views, after_id, limit)
+            pages.append(page)
+        self.assertEqual(pages, [view_ids[0:2], view_ids[2:4], view_ids[4:]])
+
+    def test_export_audit_log_written_after_response(self):
+        views = self._create_views(2)
+        rows = export.audit_rows(export.export_assessments(views, lookups.user_organization_ids(self.user)))
+        logs = GreenAssessmentPropertyAuditLog.objects.filter(description='Exported via test')
+
+        audit_log = export.ExportAuditLog(self.user, 'Exported via test')
+        audit_log.add_rows(rows)
+        response = audit_log.finish(StreamingHttpResponse(iter(['a', 'b'])))
+        self.assertEqual(logs.count(), 0)
+        self.assertEqual(b''.join(response.streaming_content), b'ab')
+        self.assertEqual(logs.count(), 2)
+
+        audit_log = export.ExportAuditLog(self.user, 'Exported via test', deferred=True)
+        audit_log.add_rows(rows)
+        response = audit_log.finish(export.AuditedHttpResponse('ab'))
+        self.assertEqual(logs.count(), 2)
+        response.close()
+        self.assertEqual(logs.count(), 4)
+
+    def test_chunk_size_param(self):
+        self.assertEqual(export.chunk_size_param({}), export.EXPORT_CHUNK_SIZE)
+        self.assertEqual(export.chunk_size_param({'chunk_size': '10'}), 10)
+        for chunk_size in ('x', '0', '-5'):
+            with self.assertRaises(ValueError):
+                export.chunk_size_param({'chunk_size': chunk_size})
+
+    def test_measurement_reso_dicts_from_values(self):
+        views = list(self._create_views(2))
+        measure = HELIXPropertyMeasure.objects.get(property_state=views[0].state)
+        HelixMeasurement.objects.create(measure_property=measure, measurement_type='PROD', measurement_subtype='PV',
+                                        quantity=6000, unit='KWH', status='ESTIMATE')
+        measurements = HelixMeasurement.objects.filter(measure_property__property_state__in=[view.state for view in views]).order_by('id')
+
+        expected = {}
+        for measurement in measurements:
+            expected.setdefault(measurement.measure_property.property_state_id, {}).update(measurement.to_reso_dict())
+        rows = measurements.values('measure_property__property_state_id', *HelixMeasurement.RESO_VALUES)
+        self.assertEqual(HelixMeasurement.reso_dicts(rows, 'measure_property__property_state_id'), expected)
+        self.assertEqual(expected[views[0].state_id]['PowerProductionAnnualStatus'], 'Estimated')
+        self.assertEqual(expected[views[0].state_id]['PowerProductionType'], 'Photovoltaics')
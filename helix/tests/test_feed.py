@@ -0,0 +1,58 @@
+import datetime
+
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from seed.landing.models import SEEDUser as User
+from seed.models import Cycle, Property, PropertyState, PropertyView
+
+from helix.models import HELIXOrganization as Organization
+from helix.utils import feed
+
+
+@override_settings(HELIX_CHANGE_FEED_LAG=0)
+class TestHelixChangeFeed(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(username='test_user@demo.com')
+        self.org = Organization.objects.create()
+        self.cycle = Cycle.objects.create(
+                organization=self.org,
+                user=self.user,
+                name="test",
+                start=timezone.now(),
+                end=timezone.now()
+        )
+        self.view_ids = []
+        for i in range(5):
+            state = PropertyState.objects.create(organization=self.org, address_line_1=str(i) + ' Main St', extra_data={})
+            prop = Property.objects.create(organization=self.org)
+            self.view_ids.append(PropertyView.objects.create(property=prop, cycle=self.cycle, state=state).pk)
+
+    def test_pages_cover_every_change_once(self):
+        marks = feed.start_marks(None)
+        pages = []
+        has_more = True
+        while has_more:
+            view_ids, marks, has_more = feed.changes([self.org.pk], feed.decode_cursor(feed.encode_cursor(marks)), limit=2)
+            pages.append(view_ids)
+        self.assertEqual([view_id for page in pages for view_id in page], self.view_ids)
+        self.assertTrue(all(len(page) <= 2 for page in pages))
+
+        # nothing changed since the last cursor
+        self.assertEqual(feed.changes([self.org.pk], marks, limit=2), ([], marks, False))
+
+        Property.objects.get(pk=PropertyView.objects.get(pk=self.view_ids[1]).property_id).save()
+        view_ids, marks, has_more = feed.changes([self.org.pk], marks, limit=2)
+        self.assertEqual(view_ids, [self.view_ids[1]])
+
+    @override_settings(HELIX_CHANGE_FEED_LAG=60)
+    def test_recent_changes_wait_for_the_lag(self):
+        marks = feed.start_marks(None)
+        self.assertEqual(feed.changes([self.org.pk], marks), ([], marks, False))
+        later = timezone.now() + datetime.timedelta(seconds=61)
+        self.assertEqual(feed.changes([self.org.pk], marks, now=later)[0], self.view_ids)
+
+    def test_invalid_cursor(self):
+        with self.assertRaises(feed.InvalidCursor):
+            feed.decode_cursor('not a cursor')
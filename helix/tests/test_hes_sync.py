@@ -0,0 +1,95 @@
+import datetime
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import TestCase
+from django.utils import timezone
+
+from seed.landing.models import SEEDUser as User
+from seed.models import Cycle, PropertyView
+
+from helix.models import HELIXOrganization as Organization
+from helix.models import HELIXGreenAssessment, HELIXGreenAssessmentProperty, HelixMeasurement
+from helix.utils.clients import HESSessionPool
+from helix.utils import hes_cache, hes_sync, lookups
+
+BUILDINGS = {
+    '1001': {'status': 'success', 'address': '1 Main St', 'city': 'Cambridge', 'state': 'MA', 'zip_code': '02139',
+             'assessment_date': '2020-03-01', 'base_score': 7, 'hescore_version': '2019', 'utility_electric': 8000},
+    '1002': {'status': 'success', 'address': '2 Main St', 'city': 'Cambridge', 'state': 'MA', 'zip_code': '02139',
+             'assessment_date': '2020-04-01', 'base_score': 5, 'hescore_version': '2019', 'utility_electric': 9000,
+             'utility_natural_gas': 600},
+    '1003': {'status': 'error'},
+}
+
+
+class StubHesClient(object):
+    """
+    Stands in for hes.HesHelix, counting the queries
+    """
+    queries = 0
+
+    def __init__(self, org):
+        self.org = org
+
+    def query_by_partner(self, partner, start_date, end_date):
+        return list(BUILDINGS)
+
+    def query_hes(self, hes_id):
+        StubHesClient.queries += 1
+        return dict(BUILDINGS[hes_id])
+
+    def end_session(self):
+        pass
+
+
+class TestHesSync(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        lookups.clear()
+        StubHesClient.queries = 0
+        self.user = User.objects.create(username='test_user@demo.com')
+        self.org = Organization.objects.create(hes='TST')
+        Cycle.objects.create(organization=self.org, user=self.user, name='test', start=timezone.now(), end=timezone.now())
+        self.assessment = HELIXGreenAssessment.objects.create(
+            organization=self.org, name='Home Energy Score', recognition_type='SCR', is_reso_certification=True)
+
+    def test_sync(self):
+        result = hes_sync.sync(self.org, self.user, client_factory=StubHesClient)
+        self.assertEqual(result, {'fetched': 2, 'written': 2, 'unchanged': 0, 'failed': ['1003']})
+        self.assertEqual(PropertyView.objects.filter(state__organization=self.org).count(), 2)
+
+        green_properties = HELIXGreenAssessmentProperty.objects.filter(assessment=self.assessment)
+        self.assertEqual(sorted((g.reference_id, g.metric) for g in green_properties), [('1001', 7), ('1002', 5)])
+        measurements = HelixMeasurement.objects.filter(assessment_property__in=green_properties)
+        self.assertEqual(sorted((m.fuel, m.quantity) for m in measurements), [('ELEC', 8000), ('ELEC', 9000), ('NATG', 600)])
+
+        # cached responses are not fetched again, unchanged buildings are not written again
+        queries = StubHesClient.queries
+        result = hes_sync.sync(self.org, self.user, hes_ids=['1001', '1002'], client_factory=StubHesClient)
+        self.assertEqual(result, {'fetched': 2, 'written': 0, 'unchanged': 2, 'failed': []})
+        self.assertEqual(StubHesClient.queries, queries)
+        self.assertEqual(HelixMeasurement.objects.filter(assessment_property__in=green_properties).count(), 3)
+
+        # a building with a new score and date updates its assessment and replaces its measurements
+        rescored = dict(BUILDINGS['1001'], assessment_date='2021-03-01', base_score=8, utility_electric=7000)
+        with mock.patch.dict(BUILDINGS, {'1001': rescored}):
+            result = hes_sync.sync(self.org, self.user, hes_ids=['1001', '1002'], refresh=True, client_factory=StubHesClient)
+        self.assertEqual(result, {'fetched': 2, 'written': 1, 'unchanged': 1, 'failed': []})
+        green_property = HELIXGreenAssessmentProperty.objects.get(assessment=self.assessment, reference_id='1001')
+        self.assertEqual((green_property.date, green_property.metric), (datetime.date(2021, 3, 1), 8))
+        self.assertEqual(green_properties.count(), 2)
+        self.assertEqual(sorted((m.fuel, m.quantity) for m in HelixMeasurement.objects.filter(assessment_property__in=green_properties)),
+                         [('ELEC', 7000), ('ELEC', 9000), ('NATG', 600)])
+
+    def test_response_cache(self):
+        hes_cache.reset_stats()
+        pool = HESSessionPool(StubHesClient)
+        for refresh in (False, False, True):
+            self.assertEqual(hes_cache.query(pool, self.org, '1001', refresh)['base_score'], 7)
+            self.assertEqual(hes_cache.query(pool, self.org, '1003', refresh)['status'], 'error')
+        self.assertEqual(StubHesClient.queries, 4)
+        stats = hes_cache.stats()
+        self.assertEqual((stats['hits'], stats['negative_hits'], stats['misses'], stats['refreshes']), (1, 1, 2, 2))
+        self.assertEqual(stats['hit_rate'], 2 / 6)
@@ -0,0 +1,68 @@
+import json
+import time
+
+from django.test import TestCase
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from seed.landing.models import SEEDUser as User
+
+from helix.utils import jobs
+from helix.views import helix_job_status
+
+
+def add(job, a, b):
+    job.stage('adding', 50)
+    return a + b
+
+
+def fail(job):
+    raise ValueError('boom')
+
+
+class TestHelixJobs(TestCase):
+
+    def _wait(self, job_id, timeout=10):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            job = jobs.get_job(job_id)
+            if job['status'] in ('success', 'error'):
+                return job
+            time.sleep(0.01)
+        self.fail('job ' + job_id + ' did not finish')
+
+    def _status(self, job_id):
+        request = APIRequestFactory().get('/helix/helix-job-status/', {'job_id': job_id})
+        request.user = User.objects.get_or_create(username='test_user@demo.com')[0]
+        force_authenticate(request, user=request.user)
+        response = helix_job_status(request)
+        return response.status_code, json.loads(response.content)
+
+    def test_job_result(self):
+        job = self._wait(jobs.submit(add, 1, 2))
+        self.assertEqual(job['status'], 'success')
+        self.assertEqual(job['result'], 3)
+        self.assertEqual((job['stage'], job['progress']), ('adding', 100))
+
+    def test_failed_job(self):
+        job = self._wait(jobs.submit(fail))
+        self.assertEqual(job['status'], 'error')
+        self.assertEqual(job['message'], 'boom')
+
+    def test_lost_job_is_failed(self):
+        jobs._update('lost', status='running', worker='stopped')
+        self.assertEqual(jobs.get_job('lost')['status'], 'error')
+        self.assertIn('lost', jobs.get_job('lost')['message'])
+
+        jobs.heartbeat()
+        jobs._update('alive', status='running', worker=jobs.worker_id())
+        self.assertEqual(jobs.get_job('alive')['status'], 'running')
+
+    def test_status_endpoint(self):
+        job_id = jobs.submit(add, 2, 2)
+        self._wait(job_id)
+        status_code, job = self._status(job_id)
+        self.assertEqual(status_code, 200)
+        self.assertEqual((job['status'], job['result']), ('success', 4))
+
+        status_code, job = self._status('missing')
+        self.assertEqual(status_code, 404)
@@ -0,0 +1,139 @@
+import datetime
+from unittest import mock
+
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from seed.landing.models import SEEDUser as User
+from seed.lib.superperms.orgs.models import OrganizationUser
+from seed.models import Cycle, Property, PropertyState, PropertyView
+from seed.models.certification import GreenAssessmentURL
+
+from helix.models import HELIXOrganization as Organization
+from helix.models import HELIXGreenAssessment, HELIXGreenAssessmentProperty, HelixMeasurement
+import helix.helix_utils as utils
+from helix.utils import labels
+
+
+class TestHelixLabels(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(username='test_user@demo.com')
+        self.org = Organization.objects.create()
+        OrganizationUser.objects.create(user=self.user, organization=self.org)
+
+        self.cycle = Cycle.objects.create(
+                organization=self.org,
+                user=self.user,
+                name="test",
+                start=timezone.now(),
+                end=timezone.now()
+        )
+        self.assessment = HELIXGreenAssessment.objects.create(
+                organization=self.org,
+                name='Massachusetts Scorecard',
+                recognition_type='CRT',
+                is_reso_certification=True
+        )
+
+    def _create_views(self, count):
+        views = []
+        for i in range(count):
+            state = PropertyState.objects.create(
+                    organization=self.org,
+                    address_line_1=str(i) + ' Main St',
+                    city='Cambridge',
+                    state='MA',
+                    postal_code='02139',
+                    extra_data={})
+            prop = Property.objects.create(organization=self.org)
+            views.append(PropertyView.objects.create(property=prop, cycle=self.cycle, state=state))
+        return views
+
+    def _labels(self, views, url):
+        return [(view, url, {'mmbtu': 120, 'base_score': 7}, 'Draft', 'ref' + str(view.pk)) for view in views]
+
+    def test_add_certification_labels(self):
+        views = self._create_views(3)
+        utils.add_certification_labels(self._labels(views, 'https://first.com'), self.user, self.assessment, self.org)
+        utils.add_certification_labels(self._labels(views, 'https://second.com'), self.user, self.assessment, self.org)
+
+        green_properties = HELIXGreenAssessmentProperty.objects.filter(view__in=views)
+        self.assertEqual(green_properties.count(), 3)
+        self.assertEqual({(g.status, g.reference_id) for g in green_properties}, {('draft', 'ref' + str(view.pk)) for view in views})
+        urls = GreenAssessmentURL.objects.filter(property_assessment__in=green_properties)
+        self.assertEqual([u.url for u in urls], ['https://second.com'] * 3)
+        measurements = HelixMeasurement.objects.filter(assessment_property__in=green_properties)
+        self.assertEqual([(m.measurement_type, m.unit, m.quantity) for m in measurements], [('CONS', 'MMBTU', 120)] * 3)
+        for view in views:
+            view.state.refresh_from_db()
+            self.assertEqual(view.state.extra_data['base_score'], 7)
+
+    def test_create_and_find_in_bulk(self):
+        rows = [{'Address Line 1': '1 Main St', 'City': 'Cambridge', 'State': 'MA', 'Postal Code': '02139'},
+                {'Address Line 1': '1 Main Street', 'City': 'Cambridge', 'State': 'MA', 'Postal Code': '02139'},
+                {'Address Line 1': '2 Main St', 'City': 'Cambridge', 'State': 'MA', 'Postal Code': '02139'}]
+        created = utils.create_propertyviews(self.org, self.cycle, rows)
+        self.assertEqual(created[0], created[1])
+        self.assertNotEqual(created[0], created[2])
+        self.assertEqual(utils.create_propertyviews(self.org, self.cycle, rows[2:]), created[2:])
+
+        records = [
+            {'property_id': str(created[2][0].pk)},
+            {'address_line_1': '1 Main Street', 'postal_code': '02139'},
+            {'address_line_1': '3 Main St', 'postal_code': '02139'},
+        ]
+        self.assertEqual(utils.propertyviews_find(records, self.org), [created[2], created[0], []])
+
+    def _label_queries(self, count):
+        views = self._create_views(count)
+        utils.add_certification_labels(self._labels(views, 'https://first.com'), self.user, self.assessment, self.org)
+        views = list(PropertyView.objects.filter(pk__in=[view.pk for view in views]))
+        with CaptureQueriesContext(connection) as queries:
+            utils.add_certification_labels(self._labels(views, 'https://second.com'), self.user, self.assessment, self.org)
+        return len(queries.captured_queries)
+
+    def test_relabel_queries_per_view(self):
+        # a relabel saves and logs every assessment, everything else is written in bulk
+        per_view = (self._label_queries(20) - self._label_queries(10)) / 10
+        self.assertLessEqual(per_view, 4)
+
+    def test_render_many(self):
+        def render(method, data, bucket):
+            if data is None:
+                raise ValueError('no data')
+            return method + '/' + data
+
+        with mock.patch.object(labels, '_render', render):
+            results = labels.render_many([('a', '1'), ('b', None), ('c', '3')])
+        self.assertEqual(results[0], 'a/1')
+        self.assertIsInstance(results[1], ValueError)
+        self.assertEqual(results[2], 'c/3')
+
+    def test_label_fingerprints(self):
+        views = self._create_views(2)
+        fingerprint = labels.fingerprint('massachusetts_energy_scorecard', {'mmbtu': 120})
+        self.assertEqual(fingerprint, labels.fingerprint('massachusetts_energy_scorecard', {'mmbtu': 120}))
+        self.assertNotEqual(fingerprint, labels.fingerprint('massachusetts_energy_scorecard', {'mmbtu': 121}))
+
+        utils.add_certification_labels(self._labels(views[:1], 'https://first.com'), self.user, self.assessment, self.org,
+                                       {'https://first.com': fingerprint})
+        self.assertEqual(labels.find_many([(views[:1], fingerprint), (views[1:], fingerprint)], self.assessment),
+                         ['https://first.com', None])
+
+        # a label given by url replaces the fingerprinted one
+        utils.add_certification_labels(self._labels(views[:1], 'https://second.com'), self.user, self.assessment, self.org)
+        self.assertIsNone(labels.find(views[:1], fingerprint, self.assessment))
+
+    def test_label_fingerprints_of_latest_assessment_only(self):
+        views = self._create_views(1)
+        fingerprint = labels.fingerprint('massachusetts_energy_scorecard', {'mmbtu': 120})
+        utils.add_certification_labels(self._labels(views, 'https://first.com'), self.user, self.assessment, self.org,
+                                       {'https://first.com': fingerprint})
+        self.assertEqual(labels.find(views, fingerprint, self.assessment), 'https://first.com')
+
+        HELIXGreenAssessmentProperty.objects.create(
+            assessment=self.assessment, view=views[0], date=datetime.date.today() + datetime.timedelta(days=1))
+        self.assertIsNone(labels.find(views, fingerprint, self.assessment))
@@ -0,0 +1,73 @@
+from django.core.cache import cache
+from django.test import TestCase
+
+from seed.landing.models import SEEDUser as User
+from seed.lib.superperms.orgs.models import OrganizationUser
+
+from helix.models import HELIXOrganization as Organization
+from helix.models import HELIXGreenAssessment
+from helix.utils import lookups
+
+
+class TestHelixLookups(TestCase):
+
+    def setUp(self):
+        lookups.clear()
+        self.user = User.objects.create(username='test_user@demo.com')
+        self.org = Organization.objects.create(name='ClearlyEnergy')
+
+    def test_lookups_are_cached(self):
+        lookups.organization(name='ClearlyEnergy')
+        lookups.user_organization_ids(self.user)
+        lookups.reso_certification_ids([self.org.pk])
+        with self.assertNumQueries(0):
+            self.assertEqual(lookups.organization(name='ClearlyEnergy').pk, self.org.pk)
+            self.assertEqual(lookups.user_organization_ids(self.user), frozenset())
+            self.assertEqual(lookups.reso_certification_ids([self.org.pk]), frozenset())
+
+    def test_saves_invalidate_lookups(self):
+        self.assertEqual(lookups.user_organization_ids(self.user), frozenset())
+        with self.captureOnCommitCallbacks(execute=True):
+            OrganizationUser.objects.create(user=self.user, organization=self.org)
+        self.assertEqual(lookups.user_organization_ids(self.user), frozenset([self.org.pk]))
+        self.assertEqual(lookups.user_organization(self.user, 'ClearlyEnergy').pk, self.org.pk)
+
+        self.assertEqual(lookups.reso_certification_ids([self.org.pk]), frozenset())
+        assessment = HELIXGreenAssessment.objects.create(
+                organization=self.org,
+                name='LEED for Homes',
+                recognition_type='CRT',
+                is_reso_certification=True
+        )
+        self.assertEqual(lookups.reso_certification_ids([self.org.pk]), frozenset([assessment.pk]))
+        self.assertEqual(lookups.assessment(self.org.pk, 'LEED for Homes').pk, assessment.pk)
+
+        self.org.name = 'Clearly Energy'
+        self.org.save()
+        with self.assertRaises(Organization.DoesNotExist):
+            lookups.organization(name='ClearlyEnergy')
+
+    def test_revoked_membership_is_not_cached(self):
+        membership = OrganizationUser.objects.create(user=self.user, organization=self.org)
+        self.assertEqual(lookups.user_organization(self.user, 'ClearlyEnergy').pk, self.org.pk)
+        version = cache.get(lookups._version_key('user:%s' % self.user.pk))
+
+        # membership is versioned in the shared cache, not in this process
+        lookups.clear()
+        with self.captureOnCommitCallbacks(execute=True):
+            membership.delete()
+        self.assertNotEqual(cache.get(lookups._version_key('user:%s' % self.user.pk)), version)
+        self.assertEqual(lookups.user_organization_ids(self.user), frozenset())
+        with self.assertRaises(Organization.DoesNotExist):
+            lookups.user_organization(self.user, 'ClearlyEnergy')
+
+    def test_user_organization_with_shared_name(self):
+        other = Organization.objects.create(name='ClearlyEnergy')
+        OrganizationUser.objects.create(user=self.user, organization=other)
+        self.assertEqual(lookups.user_organization(self.user, 'ClearlyEnergy').pk, other.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(lookups.user_organization(self.user, 'ClearlyEnergy').pk, other.pk)
+
+        OrganizationUser.objects.create(user=self.user, organization=self.org)
+        with self.assertRaises(Organization.MultipleObjectsReturned):
+            lookups.user_organization(self.user, 'ClearlyEnergy')
@@ -1,7 +1,128 @@
-from django.test import TestCase
+import json
+from unittest import mock
+
+from django.test import RequestFactory, TestCase
+from django.utils import timezone
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from seed.landing.models import SEEDUser as User
+from seed.models import Cycle
+
+from helix.models import HELIXOrganization as Organization
+import helix.helix_utils as utils
+from helix.views import helix_propertyview_find_stats
 
 
 class TestHelixUtil(TestCase):
 
     def test_dummy(self):
         self.assertEqual(2, 2)
+
+
+class TestPropertyviewFind(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(username='test_user@demo.com')
+        self.org = Organization.objects.create()
+        self.cycle = Cycle.objects.create(
+                organization=self.org,
+                user=self.user,
+                name="test",
+                start=timezone.now(),
+                end=timezone.now()
+        )
+        self.view = self._create_view('12 Main Street', '02139', 'ABC-123')
+        self.factory = RequestFactory()
+
+    def _create_view(self, street, postal_code, custom_id):
+        return utils.create_propertyview(self.org, self.cycle, {
+            'Address Line 1': street, 'City': 'Cambridge', 'State': 'MA', 'Postal Code': postal_code, 'Custom ID 1': custom_id})[0]
+
+    def _find(self, **params):
+        """
+        Views found for params, and the tier that found them
+        """
+        before = utils.propertyview_find_stats()
+        views = utils.propertyview_find(self.factory.get('/', params), self.org)
+        after = utils.propertyview_find_stats()
+        tiers = [tier for tier in after if after[tier]['count'] != before.get(tier, {}).get('count', 0)]
+        self.assertEqual(len(tiers), 1)
+        return sorted(view.pk for view in views or []), tiers[0]
+
+    def test_property_id(self):
+        self.assertEqual(self._find(property_id=self.view.pk, property_uid='ABC-123'), ([self.view.pk], 'property_id'))
+
+    def test_exact_uid(self):
+        self.assertEqual(self._find(property_uid='abc-123'), ([self.view.pk], 'uid'))
+        self.assertEqual(self._find(property_uid='abc-123', postal_code='02139'), ([self.view.pk], 'uid'))
+
+    def test_address(self):
+        self.assertEqual(self._find(street='12 Main St', postal_code='02139'), ([self.view.pk], 'address'))
+        self.assertEqual(self._find(address_line_1='12 main street', zipcode='02139'), ([self.view.pk], 'address'))
+
+    def test_uid_substring(self):
+        self.assertEqual(self._find(property_uid='BC-12'), ([self.view.pk], 'uid_substring'))
+
+    def test_not_found(self):
+        self.assertEqual(self._find(property_uid='XYZ', street='1 Elm St', postal_code='02139'), ([], None))
+
+    def test_substring_only_after_exact_tiers_miss(self):
+        # ABC-12 is a substring of ABC-123, but exactly the uid of another property
+        other = self._create_view('1 Elm Street', '02139', 'ABC-12')
+        self.assertEqual(self._find(property_uid='ABC-12'), ([other.pk], 'uid'))
+
+        # BC-12 is a substring of both uids, the address is exact
+        self.assertEqual(self._find(property_uid='BC-12', street='1 Elm St', postal_code='02139'), ([other.pk], 'address'))
+        self.assertEqual(self._find(property_uid='BC-12'), (sorted([self.view.pk, other.pk]), 'uid_substring'))
+
+    def test_stats_endpoint(self):
+        self._find(property_uid='XYZ')
+        request = APIRequestFactory().get('/helix/helix-propertyview-find-stats/')
+        force_authenticate(request, user=self.user)
+        stats = json.loads(helix_propertyview_find_stats(request).content)['stats']
+        self.assertEqual(stats['not_found'], utils.propertyview_find_stats()[None])
+
+    def test_many_addresses_are_normalized_in_process(self):
+        rows = [{'Address Line 1': '%d Elm Street' % number, 'Postal Code': '02139'} for number in range(1, 600)]
+        with mock.patch('helix.utils.address.ProcessPoolExecutor') as executor:
+            views = utils.create_propertyviews(self.org, self.cycle, rows)
+            found = utils.propertyviews_find([{'street': '12 Main St', 'postal_code': '02139'}] * 600, self.org)
+        executor.assert_not_called()
+        self.assertEqual(len(views), len(rows))
+        self.assertEqual([view.pk for view in found[0]], [self.view.pk])
+
+
+class TestWaitForTask(TestCase):
+
+    def _wait(self, progress, timeout=utils.TASK_TIMEOUT):
+        """
+        Progress values seen and sleeps made by wait_for_task while the task reports progress
+        """
+        clock = [0.0]
+        sleeps = []
+        seen = []
+
+        def sleep(delay):
+            sleeps.append(delay)
+            clock[0] += delay
+
+        values = iter(progress)
+        with mock.patch.object(utils, 'get_cache', lambda key: {'progress': next(values)}), \
+                mock.patch.object(utils.time, 'time', lambda: clock[0]), \
+                mock.patch.object(utils.time, 'sleep', sleep):
+            utils.wait_for_task('task', timeout=timeout, on_progress=seen.append)
+        return seen, sleeps
+
+    def test_backoff_until_done(self):
+        seen, sleeps = self._wait([0, None, 40, 80, 100])
+        self.assertEqual(seen, [0, 0, 40, 80, 100])
+        self.assertEqual(sleeps, [0.1, 0.2, 0.4, 0.8])
+
+    def test_delay_is_capped(self):
+        seen, sleeps = self._wait([0] * 10 + [100])
+        self.assertEqual(max(sleeps), 5)
+        self.assertEqual(sleeps[-3:], [5, 5, 5])
+
+    def test_timeout(self):
+        with self.assertRaises(TimeoutError):
+            self._wait(iter(lambda: 10, None), timeout=1)
@@ -1,4 +1,4 @@
-from django.test import TestCase
+from django.test import RequestFactory, TestCase
 from django.core import management
 from django.utils import timezone
 
@@ -6,12 +6,15 @@ from seed.landing.models import SEEDUser as User
 # from seed.lib.superperms.orgs.models import Organization, OrganizationUser
 from seed.lib.superperms.orgs.models import OrganizationUser
 from helix.models import HELIXOrganization as Organization
-from seed.models import Cycle
+from seed.models import Column, Cycle
 
 # from seed.models.certification import GreenAssessmentProperty, GreenAssessmentPropertyAuditLog
 # from seed.models.certification import GreenAssessment
 from seed.data_importer.models import ImportRecord
 
+from helix.helix_utils import PROPERTY_MAPPING
+from helix.views import _create_propertyview
+
 
 class TestHelixView(TestCase):
 
@@ -50,3 +53,32 @@ class TestHelixView(TestCase):
                 super_organization=self.org,
                 owner=self.user
         )
+
+    STATE_FIELDS = ['address_line_1', 'city', 'state', 'postal_code', 'custom_id_1', 'normalized_address',
+                    'extra_data', 'data_state', 'merge_state']
+
+    def _created_state(self, org, params):
+        """
+        (state fields, cycle id) of the property _create_propertyview created for params
+        """
+        request = RequestFactory().get('/', params)
+        views = list(_create_propertyview(request, org, self.user, 'test'))
+        self.assertEqual(len(views), 1)
+        state = views[0].state
+        return {field: getattr(state, field) for field in self.STATE_FIELDS}, views[0].cycle_id
+
+    def test_create_propertyview_matches_import(self):
+        params = {'street': '12 North Main Street Apt 3', 'city': 'Cambridge', 'state': 'MA',
+                  'postal_code': '02139', 'property_uid': 'ABC-123'}
+        Column.create_mappings([
+            {'from_field': column, 'to_field': field, 'to_table_name': 'PropertyState'}
+            for column, field in PROPERTY_MAPPING.items()], self.org, self.user)
+        with self.settings(HELIX_DIRECT_PROPERTY_CREATE=False):
+            imported, imported_cycle = self._created_state(self.org, params)
+
+        org = Organization.objects.create()
+        cycle = Cycle.objects.create(organization=org, user=self.user, name="direct", start=timezone.now(), end=timezone.now())
+        created, created_cycle = self._created_state(org, params)
+
+        self.assertEqual(created, imported)
+        self.assertEqual((imported_cycle, created_cycle), (self.cycle.pk, cycle.pk))
@@ -6,13 +6,19 @@ from helix.views import (
     helix_dups_export,
     helix_reso_export_xml,
     helix_reso_export_list_xml,
+    helix_reso_export_batch_xml,
     helix_green_addendum,
     helix_home_energy_score,
+    helix_hes_sync,
+    helix_hes_cache_stats,
+    helix_propertyview_find_stats,
     helix_vermont_profile,
     helix_massachusetts_scorecard,
     massachusetts_scorecard,
+    massachusetts_scorecard_batch,
     helix_remove_profile,
-    remotely_label
+    remotely_label,
+    helix_job_status
 )
 
 urlpatterns = [
@@ -22,11 +28,17 @@ urlpatterns = [
     url(r'^helix-dups-export/$', helix_dups_export, name="helix_dups_export"),
     url(r'^helix-reso-export-xml/$', helix_reso_export_xml, name="helix_reso_export_xml"),
     url(r'^helix-reso-export-list-xml/$', helix_reso_export_list_xml, name="helix_reso_export_list_xml"),
+    url(r'^helix-reso-export-batch-xml/$', helix_reso_export_batch_xml, name="helix_reso_export_batch_xml"),
     url(r'^helix-green-addendum/$', helix_green_addendum, name="helix_green_addendum"),
     url(r'^helix-home-energy-score/$', helix_home_energy_score, name="helix_home_energy_score"),
+    url(r'^helix-hes-sync/$', helix_hes_sync, name="helix_hes_sync"),
+    url(r'^helix-hes-cache-stats/$', helix_hes_cache_stats, name="helix_hes_cache_stats"),
+    url(r'^helix-propertyview-find-stats/$', helix_propertyview_find_stats, name="helix_propertyview_find_stats"),
     url(r'^helix-vermont-profile/$', helix_vermont_profile, name="helix_vermont_profile"),
     url(r'^massachusetts-scorecard/$', massachusetts_scorecard, name="massachusetts_scorecard"),
+    url(r'^massachusetts-scorecard-batch/$', massachusetts_scorecard_batch, name="massachusetts_scorecard_batch"),
     url(r'^helix-massachusetts-scorecard/$', helix_massachusetts_scorecard, name="helix_massachusetts_scorecard"),
     url(r'^helix-remove-profile/$', helix_remove_profile, name="helix_remove_profile"),
     url(r'^remotely_label/$', remotely_label, name="remotely_label"),
+    url(r'^helix-job-status/$', helix_job_status, name="helix_job_status"),
 ]
@@ -4,10 +4,24 @@
 :copyright (c) 2014 - 2017, The Regents of the University of California, through Lawrence Berkeley National Laboratory (subject to receipt of any required approvals from the U.S. Department of Energy) and contributors. All rights reserved.  # NOQA
 :author
 """
+import os
 import re
+import threading
+from collections import OrderedDict, deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain, islice
+
 import usaddress
 from streetaddress import StreetAddressFormatter
 
+# number of distinct addresses kept by the normalize_address_str cache
+ADDRESS_CACHE_SIZE = 20000
+
+# addresses sent to a worker process at a time by normalize_addresses
+NORMALIZE_CHUNK_SIZE = 500
+
+AddressCacheInfo = namedtuple('AddressCacheInfo', ['hits', 'misses', 'evictions', 'maxsize', 'currsize'])
+
 STATE_MAP = {
         'Alaska': 'AK',
         'Alabama': 'AL',
@@ -170,18 +184,70 @@ def _normalize_secondary_address(secondary):
     return secondary
 
 
-def normalize_address_str(address_val, address_val_2, postal_code, extra_data):
+class AddressCache(object):
+    """
+    Bounded least recently used cache of parsed addresses, shared between threads
     """
-    Normalize the address to conform to short abbreviations.
 
-    If an invalid address_val is provided, None is returned.
+    def __init__(self, maxsize=ADDRESS_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def info(self):
+        with self._lock:
+            return AddressCacheInfo(self.hits, self.misses, self.evictions, self.maxsize, len(self._data))
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = self.evictions = 0
+
+
+ADDRESS_CACHE = AddressCache()
+
+# stateless, so a single formatter serves every call
+FORMATTER = StreetAddressFormatter()
+
+
+def address_cache_info():
+    """
+    Hits, misses and evictions of the normalize_address_str cache
+    """
+    return ADDRESS_CACHE.info()
+
 
-    If a valid address is provided, a normalized version is returned.
+def address_cache_clear():
+    ADDRESS_CACHE.clear()
+
+
+def _parse_address_str(address_val, address_val_2, postal_code):
     """
-    # if this string is empty the regular expression in the sa wont
-    # like it, and fail, so leave returning nothing
-    if not address_val:
-        return None
+    Normalized address and the parsed fields to add to extra_data
+    """
+    extra_data = {}
 
     # if this is a byte string, then convert to a string-string
     if isinstance(address_val, bytes):
@@ -273,16 +339,93 @@ def normalize_address_str(address_val, address_val_2, postal_code, extra_data):
             normalized_address = normalized_address + ' ' + _normalize_address_number(addr['OccupancyIdentifier'])
             extra_data['UnitNumber'] = _normalize_address_number(addr['OccupancyIdentifier'])
 
-        formatter = StreetAddressFormatter()
-        normalized_address = formatter.abbrev_street_avenue_etc(normalized_address)
+        normalized_address = FORMATTER.abbrev_street_avenue_etc(normalized_address)
         if postal_code is not None:
             normalized_address = normalized_address + ' ' + postal_code
-        street_name = formatter.abbrev_street_avenue_etc(street_name)
+        street_name = FORMATTER.abbrev_street_avenue_etc(street_name)
         extra_data['StreetName'] = street_name
 
     return normalized_address.lower().strip(), extra_data
 
 
+def normalize_address_str(address_val, address_val_2, postal_code, extra_data):
+    """
+    Normalize the address to conform to short abbreviations.
+
+    If an invalid address_val is provided, None is returned.
+
+    If a valid address is provided, a normalized version is returned, and the
+    parsed street number, name, suffix, etc. are added to extra_data.
+    Results are cached on (address_val, address_val_2, postal_code).
+    """
+    # if this string is empty the regular expression in the sa wont
+    # like it, and fail, so leave returning nothing
+    if not address_val:
+        return None
+
+    key = (address_val, address_val_2, postal_code)
+    try:
+        cached = ADDRESS_CACHE.get(key)
+    except TypeError:
+        # unhashable input, parse without caching
+        key = cached = None
+    if cached is None:
+        normalized_address, fields = _parse_address_str(address_val, address_val_2, postal_code)
+        cached = (normalized_address, tuple(fields.items()))
+        if key is not None:
+            ADDRESS_CACHE.set(key, cached)
+
+    normalized_address, fields = cached
+    extra_data.update(fields)
+    return normalized_address, extra_data
+
+
+def _address_args(address):
+    """
+    (address_val, address_val_2, postal_code) from a string or a tuple of up to three values
+    """
+    if address is None or isinstance(address, (str, bytes)):
+        return address, None, None
+    return (tuple(address) + (None, None))[:3]
+
+
+def _normalize_chunk(chunk):
+    return [normalize_address_str(address_val, address_val_2, postal_code, {}) for address_val, address_val_2, postal_code in chunk]
+
+
+def normalize_addresses(addresses, workers=None, chunk_size=NORMALIZE_CHUNK_SIZE):
+    """
+    Normalize many addresses, yielding the normalize_address_str result of each one in input order.
+
+    Every address is a string or an (address_val, address_val_2, postal_code) tuple.
+    Chunks of chunk_size addresses are parsed in a pool of workers processes (all cores by
+    default), with at most two chunks per worker in flight so memory does not grow with the
+    input. Input that fits in a single chunk, or workers=1, is normalized in this process.
+
+    The pool forks this process, which can deadlock on locks held by its other threads, so
+    request and job code passes workers=1, the pool is for management commands and scripts.
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    args = (_address_args(address) for address in addresses)
+    chunks = iter(lambda: list(islice(args, chunk_size)), [])
+
+    first_chunks = list(islice(chunks, 2))
+    if workers <= 1 or len(first_chunks) < 2:
+        for chunk in chain(first_chunks, chunks):
+            yield from _normalize_chunk(chunk)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for chunk in chain(first_chunks, chunks):
+            pending.append(executor.submit(_normalize_chunk, chunk))
+            if len(pending) >= 2 * workers:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+
+
 def normalize_postal_code(postal_code_val):
     """
     Normalize the postal code to have a minimum of 5 digits
@@ -0,0 +1,117 @@
+# !/usr/bin/env python
+# encoding: utf-8
+"""
+Arrow IPC and Parquet versions of the csv export, for analytics clients.
+
+Rows are read chunk by chunk like the streaming csv export and every chunk becomes
+one record batch, so memory stays bounded by the chunk size whatever the size of the
+portfolio. The file is written to a temporary file and sent from there. Coordinates,
+metrics, sizes and years are typed numeric columns, everything else is a string.
+
+Needs pyarrow, installed with the arrow extra of the package.
+"""
+import os
+import tempfile
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+from helix.utils import export
+
+# content type of every format
+FORMATS = {
+    'arrow': 'application/vnd.apache.arrow.file',
+    'parquet': 'application/vnd.apache.parquet',
+}
+
+FLOAT_COLUMNS = ['Latitude', 'Longitude', 'GreenVerificationMetric', 'PowerProductionSize', 'PowerProductionAnnual']
+INT_COLUMNS = ['GreenVerificationYear', 'PowerProductionYearInstall']
+
+
+def available():
+    return pyarrow is not None
+
+
+def _kind(name):
+    if name in FLOAT_COLUMNS:
+        return float
+    if name in INT_COLUMNS:
+        return int
+    return str
+
+
+def schema(include_measures):
+    """
+    Arrow schema of the export, the csv header with typed numeric columns
+    """
+    types = {float: pyarrow.float64(), int: pyarrow.int64(), str: pyarrow.string()}
+    return pyarrow.schema([pyarrow.field(name, types[_kind(name)]) for name in export.csv_header(include_measures)])
+
+
+def _value(value, kind):
+    # csv rows hold str() of missing values
+    if value is None or value == '' or value == 'None':
+        return None
+    if kind is str:
+        return str(value)
+    try:
+        return kind(float(value)) if kind is int else float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _batch(rows, arrow_schema):
+    kinds = [_kind(field.name) for field in arrow_schema]
+    columns = [[] for kind in kinds]
+    for row in rows:
+        # assessment rows have no power production columns
+        for i, kind in enumerate(kinds):
+            columns[i].append(_value(row[i], kind) if i < len(row) else None)
+    return pyarrow.RecordBatch.from_arrays(
+        [pyarrow.array(column, type=field.type) for column, field in zip(columns, arrow_schema)], schema=arrow_schema)
+
+
+def record_batches(assessments, measures, arrow_schema, chunk_size=export.EXPORT_CHUNK_SIZE, on_assessments=None):
+    """
+    Record batches of at most chunk_size rows of the csv export of the assessments and
+    measures querysets, see stream_csv_rows
+    """
+    rows = []
+    for row in export.stream_csv_rows(assessments, measures, chunk_size, on_assessments):
+        rows.append(row)
+        if len(rows) == chunk_size:
+            yield _batch(rows, arrow_schema)
+            rows = []
+    if rows:
+        yield _batch(rows, arrow_schema)
+
+
+def write(file_format, path, batches, arrow_schema):
+    if file_format == 'parquet':
+        with pyarrow.parquet.ParquetWriter(path, arrow_schema) as writer:
+            for batch in batches:
+                writer.write_table(pyarrow.Table.from_batches([batch], schema=arrow_schema))
+    else:
+        with pyarrow.ipc.new_file(path, arrow_schema) as writer:
+            for batch in batches:
+                writer.write_batch(batch)
+
+
+def export_file(file_format, assessments, measures, chunk_size=export.EXPORT_CHUNK_SIZE, on_assessments=None):
+    """
+    Open binary file with the export of the assessments and measures querysets in
+    file_format, arrow or parquet. Its path is unlinked before it is returned, so
+    the data is freed once the file is closed.
+    """
+    arrow_schema = schema(measures.exists())
+    with tempfile.NamedTemporaryFile(prefix='helix-export-', suffix='.' + file_format, delete=False) as output:
+        path = output.name
+    try:
+        write(file_format, path, record_batches(assessments, measures, arrow_schema, chunk_size, on_assessments), arrow_schema)
+        return open(path, 'rb')
+    finally:
+        os.unlink(path)
@@ -0,0 +1,165 @@
+# !/usr/bin/env python
+# encoding: utf-8
+"""
+Process wide clients of the label and Home Energy Score services.
+
+Building a label.Label opens new boto sessions, and building a hes.HesHelix downloads
+and parses the HES WSDL and logs in. The clients here are built once and reused: a
+Label per thread, and a pool of logged in HES sessions per organization. A HES session
+is ended once it was idle for HELIX_HES_SESSION_TTL seconds, and a call that fails is
+retried once on a new session, in case the old one expired on the HES side.
+
+hes.HesHelix builds its own zeep client, so the parsed WSDL is cached at the zeep level:
+every zeep client of the process shares the Document parsed from a WSDL url, for
+HELIX_HES_WSDL_TTL seconds. New sessions, logins after a failed call and sessions of
+other organizations then only log in.
+"""
+import atexit
+import logging
+import threading
+import time
+
+import zeep.client
+from django.conf import settings
+
+from hes import hes
+from label import label
+
+logger = logging.getLogger(__name__)
+
+# seconds an idle HES session is kept, unless HELIX_HES_SESSION_TTL is set
+HES_SESSION_TTL = 10 * 60
+
+# idle HES sessions kept per organization, unless HELIX_HES_POOL_SIZE is set
+HES_POOL_SIZE = 4
+
+# seconds a parsed WSDL is reused before it is downloaded again, unless HELIX_HES_WSDL_TTL is set
+HES_WSDL_TTL = 60 * 60 * 24
+
+_local = threading.local()
+
+_Document = zeep.client.Document
+_documents = {}
+_documents_lock = threading.Lock()
+
+
+def _cached_document(location, *args, **kwargs):
+    """
+    zeep Document of the WSDL at location, parsed once per process
+    """
+    if not isinstance(location, str):
+        return _Document(location, *args, **kwargs)
+    now = time.monotonic()
+    # held while parsing, so concurrent logins wait for one download
+    with _documents_lock:
+        loaded = _documents.get(location)
+        if loaded is None or now - loaded[0] >= getattr(settings, 'HELIX_HES_WSDL_TTL', HES_WSDL_TTL):
+            loaded = _documents[location] = (now, _Document(location, *args, **kwargs))
+        return loaded[1]
+
+
+def clear_wsdl_cache():
+    with _documents_lock:
+        _documents.clear()
+
+
+# zeep.Client parses its WSDL through this name
+zeep.client.Document = _cached_document
+
+
+def label_client():
+    """
+    label.Label of the current thread
+    """
+    client = getattr(_local, 'label', None)
+    if client is None:
+        client = _local.label = label.Label(settings.AWS_ACCESS_KEY_ID, settings.AWS_SECRET_ACCESS_KEY)
+    return client
+
+
+def hes_client(org):
+    """
+    New HES session logged in with the partner credentials of org
+    """
+    return hes.HesHelix(settings.HES_CLIENT_URL, org.hes_partner_name, org.hes_partner_password, settings.HES_USER_KEY)
+
+
+class HESSessionPool:
+    """
+    Logged in HES sessions by organization. factory(org) logs a new session in.
+    """
+    def __init__(self, factory=hes_client):
+        self.factory = factory
+        self.idle = {}
+        self.lock = threading.Lock()
+
+    def _key(self, org):
+        # new credentials get new sessions
+        return org.pk, org.hes_partner_name, org.hes_partner_password
+
+    def acquire(self, org):
+        """
+        Idle session of org, or a new one. Give it back with release, or end it with discard.
+        """
+        now = time.monotonic()
+        expired = []
+        client = None
+        with self.lock:
+            sessions = self.idle.get(self._key(org), [])
+            while sessions:
+                idle_since, session = sessions.pop()
+                if now - idle_since < getattr(settings, 'HELIX_HES_SESSION_TTL', HES_SESSION_TTL):
+                    client = session
+                    break
+                expired.append(session)
+        for session in expired:
+            self.discard(session)
+        return client if client is not None else self.factory(org)
+
+    def release(self, org, client):
+        with self.lock:
+            sessions = self.idle.setdefault(self._key(org), [])
+            if len(sessions) < getattr(settings, 'HELIX_HES_POOL_SIZE', HES_POOL_SIZE):
+                sessions.append((time.monotonic(), client))
+                return
+        self.discard(client)
+
+    def discard(self, client):
+        try:
+            client.end_session()
+        except Exception:
+            logger.debug('ending a HES session failed', exc_info=True)
+
+    def call(self, org, func):
+        """
+        func(session) on a session of org. When it raises, the session is ended and func is
+        called once more on a new session.
+        """
+        client = self.acquire(org)
+        try:
+            result = func(client)
+        except Exception:
+            logger.info('HES call failed, retrying on a new session', exc_info=True)
+            self.discard(client)
+            client = self.factory(org)
+            try:
+                result = func(client)
+            except Exception:
+                self.discard(client)
+                raise
+        self.release(org, client)
+        return result
+
+    def clear(self):
+        """
+        End every idle session
+        """
+        with self.lock:
+            sessions = [session for idle in self.idle.values() for idle_since, session in idle]
+            self.idle.clear()
+        for session in sessions:
+            self.discard(session)
+
+
+HES_SESSIONS = HESSessionPool()
+atexit.register(HES_SESSIONS.clear)
@@ -0,0 +1,123 @@
+# !/usr/bin/env python
+# encoding: utf-8
+"""
+Likely duplicate detection for property states, based on the address fields
+parsed into extra_data by normalize_address_str.
+
+States are read as DuplicateState tuples of the few columns matching and the
+export need, with the street parts extracted from extra_data by the database.
+"""
+from collections import defaultdict, namedtuple
+
+try:
+    from django.db.models.fields.json import KeyTextTransform
+except ImportError:  # django < 3.1
+    from django.contrib.postgres.fields.jsonb import KeyTextTransform
+
+from seed.models import PropertyState
+
+# state columns read for matching and listing
+STATE_COLUMNS = ['id', 'address_line_1', 'city', 'postal_code', 'normalized_address']
+
+# extra_data keys read for matching
+STREET_PARTS = ['StreetNumber', 'StreetName', 'StreetDirPrefix', 'UnitNumber']
+
+DuplicateState = namedtuple('DuplicateState', STATE_COLUMNS + STREET_PARTS)
+
+SAME_POSTAL_CODE = 'Similar street address, same postal code'
+SAME_POSTAL_CODE_EXCLUDES_UNIT = 'Similar address, excludes unit #, same postal code'
+DIFFERENT_POSTAL_CODE = 'Same street address, different postal code'
+
+
+def state_rows(states, chunk_size=2000):
+    """
+    DuplicateState of every state of the states queryset, in its order, read chunk_size rows at a time
+    """
+    street_parts = {'xd_' + key: KeyTextTransform(key, 'extra_data') for key in STREET_PARTS}
+    rows = states.annotate(**street_parts).values_list(*STATE_COLUMNS, *street_parts)
+    for row in rows.iterator(chunk_size=chunk_size):
+        yield DuplicateState(*row)
+
+
+def page_candidates(states, page):
+    """
+    States of the states queryset that can be matched with the states with an id in page:
+    those with the StreetNumber and StreetName of one of them, as every match requires both.
+    Read through the helix_propertystate_street index, so a page costs the same at any depth.
+    """
+    streets = PropertyState.objects.filter(pk__in=page).annotate(
+        street_number=KeyTextTransform('StreetNumber', 'extra_data'),
+        street_name=KeyTextTransform('StreetName', 'extra_data')).values_list('street_number', 'street_name')
+    numbers = set()
+    names = set()
+    for street_number, street_name in streets:
+        if street_number is not None and street_name is not None:
+            numbers.add(street_number)
+            names.add(street_name)
+    if not numbers:
+        return states.none()
+    return states.annotate(
+        street_number=KeyTextTransform('StreetNumber', 'extra_data'),
+        street_name=KeyTextTransform('StreetName', 'extra_data')).filter(street_number__in=numbers, street_name__in=names)
+
+
+def _match_reason(state, other):
+    """
+    Reason why two states with the same StreetNumber and StreetName are likely duplicates, or None
+    """
+    same_unit = state.UnitNumber == other.UnitNumber
+    if state.postal_code == other.postal_code:
+        # likely matches, same zip code, with or without unit number
+        return SAME_POSTAL_CODE if same_unit else SAME_POSTAL_CODE_EXCLUDES_UNIT
+    if same_unit and state.StreetDirPrefix == other.StreetDirPrefix:
+        # likely matches, different zip code
+        return DIFFERENT_POSTAL_CODE
+    return None
+
+
+def find_duplicates(states):
+    """
+    Likely duplicate pairs of states, as (reason, state, match) tuples.
+
+    states need the id, postal_code and STREET_PARTS attributes of a DuplicateState, with
+    None for a missing street part. Every match requires the same
+    StreetNumber and StreetName, so states are bucketed on (street, postal_code) for the
+    same postal code matches and on (street, StreetDirPrefix, UnitNumber) for the different
+    postal code match, and a state is only compared to the states sharing one of its buckets.
+
+    Pairs come out in the same order as when comparing every state to every other one: a
+    state matched by an earlier state does not start a pair of its own. States without a
+    parsed StreetNumber or StreetName are never matched.
+    """
+    states = list(states)
+    same_postal_code = defaultdict(list)
+    different_postal_code = defaultdict(list)
+    buckets = []
+    for position, state in enumerate(states):
+        if state.StreetNumber is None or state.StreetName is None:
+            buckets.append(None)
+            continue
+        street = (state.StreetNumber, state.StreetName)
+        same_key = street + (state.postal_code,)
+        different_key = street + (state.StreetDirPrefix, state.UnitNumber)
+        same_postal_code[same_key].append(position)
+        different_postal_code[different_key].append(position)
+        buckets.append((same_postal_code[same_key], different_postal_code[different_key]))
+
+    skip_states = set()
+    for state, bucket in zip(states, buckets):
+        if bucket is None or state.id in skip_states:
+            continue
+        same_bucket, different_bucket = bucket
+        if len(different_bucket) > 1:
+            candidates = sorted(set(same_bucket).union(different_bucket))
+        else:
+            candidates = same_bucket
+        for position in candidates:
+            other = states[position]
+            if other.id == state.id:
+                continue
+            reason = _match_reason(state, other)
+            if reason is not None:
+                skip_states.add(other.id)
+                yield reason, state, other
@@ -0,0 +1,415 @@
+# !/usr/bin/env python
+# encoding: utf-8
+"""
+Bulk loading helpers for the HELIX exports.
+
+Every helper loads its records in a fixed number of queries, independent of
+the number of exported properties.
+
+The address columns of the csv export are read as tuples of the few state columns
+they need, with the street parts extracted from extra_data by the database, instead
+of loading whole states and their extra_data.
+"""
+import datetime
+import re
+
+from django.conf import settings
+from django.http import HttpResponse
+from django.db.models import Q, prefetch_related_objects
+
+try:
+    from django.db.models.fields.json import KeyTextTransform
+except ImportError:  # django < 3.1
+    from django.contrib.postgres.fields.jsonb import KeyTextTransform
+
+from seed.models import PropertyState
+from seed.models.auditlog import AUDIT_USER_EXPORT
+from seed.models.certification import GreenAssessmentPropertyAuditLog
+
+from helix.models import HELIXGreenAssessmentProperty, HelixMeasurement, HELIXPropertyMeasure
+from helix.utils import lookups
+
+ADDRESS_MAP = {'custom_id_1': 'UniversalPropertyId', 'city': 'City', 'postal_code': 'PostalCode', 'state': 'State', 'latitude': 'Latitude', 'longitude': 'Longitude'}
+ADDRESS_MAP_XD = {'StreetDirPrefix': 'StreetDirPrefix', 'StreetDirSuffix': 'StreetDirSuffix', 'StreetName': 'StreetName', 'StreetNumber': 'StreetNumber', 'StreetSuffix': 'StreetSuffix', 'UnitNumber': 'UnitNumber'}
+GREEN_VERIFICATION_FIELDS = ['GreenVerificationBody',  'GreenBuildingVerificationType', 'GreenVerificationRating', 'GreenVerificationMetric', 'GreenVerificationVersion', 'GreenVerificationYear',  'GreenVerificationSource',  'GreenVerificationStatus', 'GreenVerificationURL']
+POWER_PRODUCTION_FIELDS = ['PowerProductionSource', 'PowerProductionOwnership', 'Electric', 'PowerProductionAnnualStatus', 'PowerProductionSize', 'PowerProductionType', 'PowerProductionAnnual', 'PowerProductionYearInstall']
+
+# state columns read for the address columns of a csv row, the ADDRESS_MAP_XD keys are read from extra_data
+ADDRESS_COLUMNS = list(ADDRESS_MAP) + ['address_line_1', 'address_line_2']
+
+# related objects of an assessment read by to_reso_dict
+ASSESSMENT_PREFETCH = ('urls',)
+
+# rows fetched per round trip when streaming an export
+EXPORT_CHUNK_SIZE = 2000
+
+# largest page of a paginated export, and the page size when limit is not given
+EXPORT_PAGE_LIMIT = 5000
+
+# properties read per round trip by the batch xml export
+XML_CHUNK_SIZE = 500
+
+# export audit log rows written per INSERT
+EXPORT_AUDIT_BATCH_SIZE = 1000
+
+# statuses of assessments left out of the xml export
+XML_EXCLUDED_STATUSES = ['draft', 'test', 'preliminary']
+
+# measurements of a property measure that are exported as RESO power production
+POWER_PRODUCTION_FILTER = {
+    'measurement_type__in': ['PROD', 'CAP'],
+    'measurement_subtype__in': ['PV', 'WIND']
+}
+
+
+def export_assessments(views, organizations, today=None):
+    """
+    Current, non opted out RESO green assessment properties of views, for the RESO
+    certifications of the organization ids in organizations.
+    The view, assessment and urls used by to_reso_dict, and the cycle used by the
+    audit log, are loaded up front. The state is not, see address_rows.
+    """
+    if today is None:
+        today = datetime.datetime.today()
+    reso_certifications = lookups.reso_certification_ids(organizations)
+    return HELIXGreenAssessmentProperty.objects.filter(
+        view__in=views).filter(Q(_expiration_date__gte=today) | Q(_expiration_date=None)).filter(opt_out=False).filter(
+        assessment_id__in=reso_certifications).select_related('view__cycle', 'assessment').prefetch_related(*ASSESSMENT_PREFETCH)
+
+
+def export_measures(views):
+    """
+    Property measures attached to the current state of views
+    """
+    return HELIXPropertyMeasure.objects.filter(property_state__in=views.values('state_id'))
+
+
+def measurements_by_measure(measures):
+    """
+    Merged RESO dict of the power production measurements of every measure that has any,
+    keyed by measure id, read in a single query without creating instances
+    """
+    matches = HelixMeasurement.objects.filter(
+        measure_property_id__in=[measure.pk for measure in measures], **POWER_PRODUCTION_FILTER).order_by('id')
+    return HelixMeasurement.reso_dicts(matches.values('measure_property_id', *HelixMeasurement.RESO_VALUES), 'measure_property_id')
+
+
+def page_params(params):
+    """
+    (after_id, limit) of a paginated export request, or (None, None) when neither is given
+    """
+    if 'after_id' not in params and 'limit' not in params:
+        return None, None
+    after_id = int(params.get('after_id') or 0)
+    limit = max(1, min(int(params.get('limit') or EXPORT_PAGE_LIMIT), EXPORT_PAGE_LIMIT))
+    return after_id, limit
+
+
+def chunk_size_param(params, default=EXPORT_CHUNK_SIZE):
+    """
+    chunk_size of an export request, default when it is not given.
+    Raises ValueError unless it is a positive integer.
+    """
+    chunk_size = int(params.get('chunk_size') or default)
+    if chunk_size < 1:
+        raise ValueError('chunk_size must be positive')
+    return chunk_size
+
+
+def page_ids(queryset, after_id, limit):
+    """
+    (ids, next_after_id) of the page of at most limit primary keys of queryset after after_id,
+    read with an ordered primary key scan so any page costs the same as the first.
+    next_after_id is None on the last page.
+    """
+    ids = list(queryset.filter(pk__gt=after_id).order_by('pk').values_list('pk', flat=True)[:limit + 1])
+    if len(ids) > limit:
+        return ids[:limit], ids[limit - 1]
+    return ids, None
+
+
+def xml_assessments(views, today=None):
+    """
+    Current, non opted out and published green assessment properties of views, with
+    what to_reso_dict and the audit log read loaded up front
+    """
+    if today is None:
+        today = datetime.datetime.today()
+    return HELIXGreenAssessmentProperty.objects.filter(
+        view__in=views).filter(Q(_expiration_date__gte=today) | Q(_expiration_date=None)).filter(opt_out=False).exclude(
+        status__in=XML_EXCLUDED_STATUSES).select_related('view__cycle', 'assessment').prefetch_related(*ASSESSMENT_PREFETCH)
+
+
+def reso_xml_content(views, organizations, crsdata=False, today=None):
+    """
+    content of the RESO xml export template for the property of views, and the list of green
+    assessment properties whose export is logged.
+    The state, assessments, measures and the measurements of both are read with one query each,
+    whatever the number of views, assessments and measures.
+    """
+    views = list(views.select_related('state').order_by('pk'))
+    return next(reso_xml_contents([views], organizations, crsdata, today))
+
+
+def stream_reso_xml_contents(views, organizations, chunk_size=XML_CHUNK_SIZE, crsdata=False, today=None, on_assessments=None):
+    """
+    reso_xml_content of every view of the views queryset on its own, in view id order, read chunk
+    by chunk. on_assessments is called with the assessments of every chunk once its contents are produced.
+    """
+    views = views.select_related('state').order_by('pk')
+    for chunk in iter_chunks(views, chunk_size):
+        chunk_assessments = []
+        for content, assessments in reso_xml_contents([[pv] for pv in chunk], organizations, crsdata, today):
+            yield content
+            chunk_assessments += assessments
+        if on_assessments is not None:
+            on_assessments(chunk_assessments)
+
+
+def reso_xml_contents(groups, organizations, crsdata=False, today=None):
+    """
+    (content, assessments) of reso_xml_content for every list of views in groups, with the
+    records of all groups read together
+    """
+    views = [pv for group in groups for pv in group]
+    reso_certifications = lookups.reso_certification_ids(organizations)
+
+    assessments_by_view = {}
+    for a in xml_assessments(views, today):
+        assessments_by_view.setdefault(a.view_id, []).append(a)
+    matching_measurements = HelixMeasurement.objects.filter(assessment_property_id__in=[
+        a.pk for assessments in assessments_by_view.values() for a in assessments if a.assessment_id in reso_certifications]).order_by('id')
+    measurements_by_assessment = HelixMeasurement.reso_dicts(
+        matching_measurements.values('assessment_property_id', *HelixMeasurement.RESO_VALUES), 'assessment_property_id')
+
+    measures_by_state = {}
+    measures = list(HELIXPropertyMeasure.objects.filter(property_state_id__in=[pv.state_id for pv in views]).order_by('id'))
+    for measure in measures:
+        measures_by_state.setdefault(measure.property_state_id, []).append(measure)
+    measurements = measurements_by_measure(measures) if measures else {}
+
+    for group in groups:
+        property = group[0].state
+        if crsdata:
+            property.jurisdiction_property_id = property.custom_id_1
+        if property.normalized_address and re.search(r'.*\d{5}', property.normalized_address):
+            property.normalized_address = property.normalized_address[0:property.normalized_address.rindex(' ')]
+        content = {
+            'property': property,
+        }
+
+        measurement_dict = {}
+        # assessments
+        assessments = [a for pv in group for a in assessments_by_view.get(pv.pk, [])]
+        if assessments:
+            content['assessments'] = [a for a in assessments if a.assessment_id in reso_certifications]
+            for a in content['assessments']:
+                measurement_dict.update(measurements_by_assessment.get(a.pk, {}))
+            content['measurements'] = measurement_dict
+
+        # measures, only pv can be exported
+        group_measures = [measure for state_id in dict.fromkeys(pv.state_id for pv in group) for measure in measures_by_state.get(state_id, [])]
+        if group_measures:
+            for measure in group_measures:
+                if measure.pk in measurements:
+                    measurement_dict.update(measurements[measure.pk])
+                    measurement_dict.update(measure.to_reso_dict())
+            content['measurements'] = measurement_dict
+
+        yield content, assessments
+
+
+def unparsed_address(address_line_1, address_line_2):
+    address = address_line_1
+    if address_line_2:
+        address += ' ' + address_line_2
+    return address
+
+
+def address_rows(state_ids):
+    """
+    Address columns of the csv row of every state id, by state id, in a single query
+    """
+    street_parts = {'xd_' + key: KeyTextTransform(key, 'extra_data') for key in ADDRESS_MAP_XD}
+    rows = PropertyState.objects.filter(pk__in=set(state_ids)).annotate(**street_parts).values_list(
+        'pk', *ADDRESS_COLUMNS, *street_parts)
+    columns = len(ADDRESS_MAP)
+    addresses = {}
+    for row in rows:
+        values = row[1:]
+        address_line_1, address_line_2 = values[columns:columns + 2]
+        addresses[row[0]] = ([str(value) for value in values[:columns]] +
+                             ['' if value is None else value for value in values[columns + 2:]] +
+                             [unparsed_address(address_line_1, address_line_2)])
+    return addresses
+
+
+def csv_header(include_measures):
+    header = list(ADDRESS_MAP.values()) + list(ADDRESS_MAP_XD.values()) + ['Unparsed Address'] + GREEN_VERIFICATION_FIELDS
+    if include_measures:
+        header += POWER_PRODUCTION_FIELDS
+    return header
+
+
+def assessment_row(assessment, address):
+    """
+    Row of an assessment, address the address columns of its state from address_rows
+    """
+    a_dict = assessment.to_reso_dict()
+    return address + [str(a_dict.get(f, '')) for f in GREEN_VERIFICATION_FIELDS]
+
+
+def measure_row(measure, address, measurement_dict=None):
+    """
+    Row of a measure, address the address columns of its state from address_rows and
+    measurement_dict the RESO dict of its measurements from measurements_by_measure
+    """
+    if measurement_dict is not None:
+        measurement_dict = dict(measurement_dict, **measure.to_reso_dict())
+    else:
+        measurement_dict = {}
+    return (address + ['' for f in GREEN_VERIFICATION_FIELDS] +
+            [measurement_dict.get(m, '') for m in POWER_PRODUCTION_FIELDS])
+
+
+def csv_rows(assessments, measures):
+    """
+    Rows of the csv export, one per assessment followed by one per measure.
+    assessments and measures are evaluated lists from export_assessments and export_measures.
+    """
+    addresses = address_rows([a.view.state_id for a in assessments] + [measure.property_state_id for measure in measures])
+    for assessment in assessments:
+        yield assessment_row(assessment, addresses[assessment.view.state_id])
+
+    measurements = measurements_by_measure(measures)
+    for measure in measures:
+        yield measure_row(measure, addresses[measure.property_state_id], measurements.get(measure.pk))
+
+
+class Echo:
+    """
+    File-like object that returns what is written, so csv.writer can feed a StreamingHttpResponse
+    """
+    def write(self, value):
+        return value
+
+
+def iter_chunks(queryset, chunk_size=EXPORT_CHUNK_SIZE, prefetch=()):
+    """
+    Iterate queryset over a server-side cursor, yielding lists of at most chunk_size
+    instances. prefetch lookups are loaded once per list, so memory stays bounded by chunk_size.
+    """
+    chunk = []
+    for obj in queryset.prefetch_related(None).iterator(chunk_size=chunk_size):
+        chunk.append(obj)
+        if len(chunk) == chunk_size:
+            prefetch_related_objects(chunk, *prefetch)
+            yield chunk
+            chunk = []
+    if chunk:
+        prefetch_related_objects(chunk, *prefetch)
+        yield chunk
+
+
+def stream_csv_rows(assessments, measures, chunk_size=EXPORT_CHUNK_SIZE, on_assessments=None):
+    """
+    Same rows as csv_rows, read chunk by chunk from the assessments and measures querysets.
+    on_assessments is called with every chunk of assessments once its rows are produced.
+    """
+    for chunk in iter_chunks(assessments, chunk_size, ASSESSMENT_PREFETCH):
+        addresses = address_rows([a.view.state_id for a in chunk])
+        for assessment in chunk:
+            yield assessment_row(assessment, addresses[assessment.view.state_id])
+        if on_assessments is not None:
+            on_assessments(chunk)
+
+    for chunk in iter_chunks(measures, chunk_size):
+        addresses = address_rows([measure.property_state_id for measure in chunk])
+        measurements = measurements_by_measure(chunk)
+        for measure in chunk:
+            yield measure_row(measure, addresses[measure.property_state_id], measurements.get(measure.pk))
+
+
+def audit_rows(assessments):
+    """
+    (organization_id, assessment_id, view_id) of the export log entry of every assessment
+    """
+    return [(a.view.cycle.organization_id, a.pk, a.view_id) for a in assessments]
+
+
+class ExportAuditLog:
+    """
+    Export audit log entries for green assessment properties, written with bulk_create
+    instead of one HELIXGreenAssessmentProperty.log call per exported row.
+    When deferred, nothing is written until the response has been sent.
+    """
+    def __init__(self, user, description, deferred=None, batch_size=EXPORT_AUDIT_BATCH_SIZE):
+        self.user = user
+        self.description = description
+        self.deferred = getattr(settings, 'HELIX_DEFER_EXPORT_AUDIT', False) if deferred is None else deferred
+        self.batch_size = batch_size
+        self.entries = []
+
+    def add(self, assessments):
+        """
+        Record the export of assessments, whose view and cycle should be loaded
+        """
+        self.add_rows(audit_rows(assessments))
+
+    def add_rows(self, rows):
+        """
+        Record exports given as audit_rows
+        """
+        for organization_id, assessment_id, view_id in rows:
+            self.entries.append(GreenAssessmentPropertyAuditLog(
+                organization_id=organization_id,
+                greenassessmentproperty_id=assessment_id,
+                property_view_id=view_id,
+                user=self.user,
+                record_type=AUDIT_USER_EXPORT,
+                name='Export log',
+                description=self.description))
+            if not self.deferred and len(self.entries) >= self.batch_size:
+                self.flush()
+
+    def flush(self):
+        if self.entries:
+            GreenAssessmentPropertyAuditLog.objects.bulk_create(self.entries, batch_size=self.batch_size)
+        self.entries = []
+
+    def finish(self, response):
+        """
+        Write the remaining entries. Streaming exports write them once their content
+        has been sent, deferred exports once an AuditedHttpResponse has been sent.
+        A deferred export with any other response writes them right away.
+        """
+        if response.streaming:
+            response.streaming_content = self._flush_after(response.streaming_content)
+        elif self.deferred and isinstance(response, AuditedHttpResponse):
+            response.audit_logs.append(self)
+        else:
+            self.flush()
+        return response
+
+    def _flush_after(self, content):
+        # runs when the content is exhausted, or closed by the server on a disconnect
+        try:
+            yield from content
+        finally:
+            self.flush()
+
+
+class AuditedHttpResponse(HttpResponse):
+    """
+    HttpResponse that writes the ExportAuditLog entries deferred to it once it has been sent
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.audit_logs = []
+
+    def close(self):
+        try:
+            super().close()
+        finally:
+            for audit_log in self.audit_logs:
+                audit_log.flush()
@@ -0,0 +1,128 @@
+# !/usr/bin/env python
+# encoding: utf-8
+"""
+Change feed of property views, for clients polling the RESO list export.
+
+A view changed when its property was updated or a green assessment audit log entry
+was written for it. Both are read in (timestamp, id) order from the position of an
+opaque cursor, with keyset conditions that the (organization_id, updated) and
+(organization_id, created) indexes answer directly, however far the feed has gone.
+
+Timestamps are taken when a row is saved, not when its transaction commits, so a row can
+appear behind a cursor that already passed its timestamp. Only changes older than a lag
+are listed, a transaction that takes longer than the lag to commit can still be missed.
+"""
+import base64
+import datetime
+import json
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from seed.models import Property, PropertyView
+from seed.models.auditlog import AUDIT_USER_EXPORT
+from seed.models.certification import GreenAssessmentPropertyAuditLog
+
+# changes per page, unless HELIX_CHANGE_FEED_LIMIT is set
+CHANGE_FEED_LIMIT = 1000
+# seconds a change must be old to be listed, unless HELIX_CHANGE_FEED_LAG is set
+CHANGE_FEED_LAG = 60
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(marks):
+    """
+    Opaque cursor for marks, a dict of (timestamp, id) positions by source
+    """
+    data = {source: [mark[0].isoformat(), mark[1]] for source, mark in marks.items() if mark is not None}
+    return base64.urlsafe_b64encode(json.dumps(data, sort_keys=True).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """
+    marks of a cursor made by encode_cursor. Raises InvalidCursor.
+    """
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+        marks = {}
+        for source in ('property', 'assessment'):
+            if source in data:
+                timestamp, pk = data[source]
+                marks[source] = (_aware(parse_datetime(timestamp)), int(pk))
+        return marks
+    except (ValueError, TypeError, KeyError, AttributeError) as e:
+        raise InvalidCursor('invalid cursor') from e
+
+
+def start_marks(start_date):
+    """
+    marks of a feed starting at start_date, a yyyy-mm-dd string, or at the beginning
+    """
+    if not start_date:
+        return {}
+    try:
+        start = _aware(datetime.datetime.strptime(start_date, '%Y-%m-%d'))
+    except ValueError as e:
+        raise InvalidCursor('invalid start_date') from e
+    # ids start at 1, so (start, 0) includes everything at start
+    return {'property': (start, 0), 'assessment': (start, 0)}
+
+
+def _aware(value):
+    if value is None:
+        raise ValueError('no timestamp')
+    if settings.USE_TZ and timezone.is_naive(value):
+        return timezone.make_aware(value)
+    return value
+
+
+def _after(queryset, field, mark):
+    if mark is None:
+        return queryset
+    timestamp, pk = mark
+    return queryset.filter(Q(**{field + '__gt': timestamp}) | Q(**{field: timestamp, 'id__gt': pk}))
+
+
+def changes(organizations, marks, limit=None, end_date=None, now=None):
+    """
+    (view ids, next marks, has_more) of the first limit changes after marks.
+    The view ids are those of the changes, in change order, without duplicates.
+    Audit log entries written by exports are not changes, nor are changes made in the
+    last HELIX_CHANGE_FEED_LAG seconds before now, they are listed once they are older.
+    """
+    limit = max(1, min(limit or CHANGE_FEED_LIMIT, getattr(settings, 'HELIX_CHANGE_FEED_LIMIT', CHANGE_FEED_LIMIT)))
+    cutoff = (now or timezone.now()) - datetime.timedelta(seconds=getattr(settings, 'HELIX_CHANGE_FEED_LAG', CHANGE_FEED_LAG))
+
+    properties = _after(Property.objects.filter(organization_id__in=organizations, updated__lte=cutoff), 'updated', marks.get('property'))
+    logs = _after(GreenAssessmentPropertyAuditLog.objects.filter(organization_id__in=organizations, created__lte=cutoff),
+                  'created', marks.get('assessment'))
+    logs = logs.exclude(record_type=AUDIT_USER_EXPORT)
+    if end_date:
+        properties = properties.filter(updated__lte=end_date)
+        logs = logs.filter(created__lte=end_date)
+
+    property_events = [(updated, pk, 'property', pk) for updated, pk in properties.order_by('updated', 'id').values_list('updated', 'id')[:limit]]
+    log_events = [(created, pk, 'assessment', view_id) for created, pk, view_id in logs.order_by('created', 'id').values_list('created', 'id', 'property_view_id')[:limit]]
+    # a full page from either source may have more changes after it
+    has_more = len(property_events) == limit or len(log_events) == limit
+    events = sorted(property_events + log_events, key=lambda event: event[:2])[:limit]
+
+    next_marks = dict(marks)
+    for timestamp, pk, source, target in events:
+        next_marks[source] = (timestamp, pk)
+
+    views = {}
+    property_ids = [target for timestamp, pk, source, target in events if source == 'property']
+    for view_id, property_id in PropertyView.objects.filter(property_id__in=property_ids).values_list('id', 'property_id'):
+        views.setdefault(property_id, []).append(view_id)
+    view_ids = {}
+    for timestamp, pk, source, target in events:
+        for view_id in (views.get(target, []) if source == 'property' else [target]):
+            if view_id is not None:
+                view_ids.setdefault(view_id, None)
+    return list(view_ids), next_marks, has_more
@@ -0,0 +1,72 @@
+# !/usr/bin/env python
+# encoding: utf-8
+"""
+Cache of query_hes responses by organization and hes_id.
+
+Scores of a finalized building rarely change, so responses are kept for
+HELIX_HES_CACHE_TIMEOUT seconds. Error responses, a building HES does not know, are
+kept for HELIX_HES_NEGATIVE_CACHE_TIMEOUT seconds, so a listing polled on every page
+view does not query HES for it every time either. refresh skips the cache.
+
+Hits and misses are counted in the django cache, across processes, see stats.
+"""
+from django.conf import settings
+from django.core.cache import cache
+
+# seconds a response is cached, unless HELIX_HES_CACHE_TIMEOUT is set
+HES_CACHE_TIMEOUT = 60 * 60 * 24
+
+# seconds an error response is cached, unless HELIX_HES_NEGATIVE_CACHE_TIMEOUT is set
+HES_NEGATIVE_CACHE_TIMEOUT = 60 * 60
+
+STATS = ('hits', 'negative_hits', 'misses', 'refreshes')
+
+
+def _key(org, hes_id):
+    return 'helix:hes:%s:%s' % (org.pk, hes_id)
+
+
+def _count(stat):
+    key = 'helix:hes:stats:' + stat
+    try:
+        cache.incr(key)
+    except ValueError:
+        if not cache.add(key, 1, timeout=None):
+            cache.incr(key)
+
+
+def query(pool, org, hes_id, refresh=False):
+    """
+    query_hes response of hes_id, on a session of pool, from the cache unless refresh
+    """
+    key = _key(org, hes_id)
+    if refresh:
+        _count('refreshes')
+    else:
+        hes_data = cache.get(key)
+        if hes_data is not None:
+            _count('negative_hits' if hes_data.get('status') == 'error' else 'hits')
+            return hes_data
+        _count('misses')
+
+    hes_data = pool.call(org, lambda client: client.query_hes(hes_id))
+    if hes_data.get('status') == 'error':
+        cache.set(key, hes_data, getattr(settings, 'HELIX_HES_NEGATIVE_CACHE_TIMEOUT', HES_NEGATIVE_CACHE_TIMEOUT))
+    else:
+        cache.set(key, hes_data, getattr(settings, 'HELIX_HES_CACHE_TIMEOUT', HES_CACHE_TIMEOUT))
+    return hes_data
+
+
+def stats():
+    """
+    Number of hits, negative hits, misses and refreshes, and the share of lookups that hit the cache
+    """
+    found = cache.get_many(['helix:hes:stats:' + stat for stat in STATS])
+    counts = {stat: found.get('helix:hes:stats:' + stat, 0) for stat in STATS}
+    total = sum(counts.values())
+    counts['hit_rate'] = (counts['hits'] + counts['negative_hits']) / total if total else None
+    return counts
+
+
+def reset_stats():
+    cache.delete_many(['helix:hes:stats:' + stat for stat in STATS])
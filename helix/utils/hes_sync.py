@@ -0,0 +1,182 @@
+# !/usr/bin/env python
+# encoding: utf-8
+"""
+Bulk Home Energy Score sync of an organization.
+
+The buildings of the organization's HES partner assessed in a date window, the
+organization's hes_start_date to hes_end_date by default, are fetched with query_hes on
+at most HELIX_HES_SYNC_WORKERS pooled sessions at once, through the response cache of
+helix.utils.hes_cache. A building whose Home Energy Score assessment already has the same
+assessment date and score is not written again.
+
+Properties are matched, or created, on their normalized address in one pass, assessments
+are saved and logged one by one like labels, and their measurements are replaced in bulk.
+
+Sessions come from helix.utils.clients unless a client_factory, a function returning a
+logged in client of an organization, is given, e.g. a stub in tests. Addresses are
+normalized in this process, the management command passes workers=None to normalize
+them in a process pool.
+"""
+import datetime
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import transaction
+from django.utils.dateparse import parse_date
+
+from seed.models import Cycle
+
+from helix.models import HELIXGreenAssessmentProperty, HelixMeasurement
+import helix.helix_utils as utils
+from helix.utils import clients, hes_cache, lookups, reso_cache
+
+logger = logging.getLogger(__name__)
+
+# concurrent HES calls of a sync, unless HELIX_HES_SYNC_WORKERS is set
+HES_SYNC_WORKERS = 4
+
+HES_ASSESSMENT_NAME = 'Home Energy Score'
+
+# fields of an existing assessment updated by a sync
+HES_ASSESSMENT_FIELDS = ['date', 'metric', 'version', 'reference_id']
+
+# model fields bulk_update writes for HES_ASSESSMENT_FIELDS, metric is a property over _metric
+HES_ASSESSMENT_COLUMNS = ['date', '_metric', 'version', 'reference_id']
+
+# query_hes field and the HelixMeasurement (measurement_type, fuel, unit) it is stored as
+HES_MEASUREMENTS = {
+    'utility_electric': ('CONS', 'ELEC', 'KWH'),
+    'utility_natural_gas': ('CONS', 'NATG', 'THERM'),
+    'utility_fuel_oil': ('CONS', 'FUEL', 'GAL'),
+    'utility_lpg': ('CONS', 'PROP', 'GAL'),
+    'utility_cord_wood': ('CONS', 'CWOOD', 'CORD'),
+    'utility_pellet_wood': ('CONS', 'PWOOD', 'LB'),
+    'utility_generated': ('PROD', 'ELEC', 'KWH'),
+}
+
+
+def building_ids(pool, org, start_date, end_date):
+    """
+    ids of the buildings of the organization's HES partner assessed from start_date to end_date
+    """
+    return list(pool.call(org, lambda client: client.query_by_partner(org.hes, start_date, end_date)))
+
+
+def sync(org, user=None, hes_ids=None, start_date=None, end_date=None, refresh=False, client_factory=None, job=None,
+         workers=1):
+    """
+    Fetch the buildings hes_ids, or those of the date window, and write their assessments
+    and measurements. Returns counts of the buildings fetched, written, unchanged and failed.
+    """
+    pool = clients.HESSessionPool(client_factory) if client_factory is not None else clients.HES_SESSIONS
+    assessment = lookups.assessment(org.pk, HES_ASSESSMENT_NAME)
+    if hes_ids is None:
+        hes_ids = building_ids(pool, org, start_date or org.hes_start_date, end_date or org.hes_end_date)
+    hes_ids = list(dict.fromkeys(str(hes_id) for hes_id in hes_ids))
+
+    if job is not None:
+        job.stage('fetch')
+    responses = {}
+    failed = []
+    workers = max(1, getattr(settings, 'HELIX_HES_SYNC_WORKERS', HES_SYNC_WORKERS))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='helix-hes') as executor:
+        futures = [(hes_id, executor.submit(hes_cache.query, pool, org, hes_id, refresh)) for hes_id in hes_ids]
+        for done, (hes_id, future) in enumerate(futures):
+            try:
+                hes_data = future.result()
+            except Exception:
+                logger.exception('HES sync of building %s failed', hes_id)
+                hes_data = None
+            # a building without an address can not be matched to a property
+            if hes_data and hes_data.get('status') != 'error' and hes_data.get('address'):
+                responses[hes_id] = hes_data
+            else:
+                failed.append(hes_id)
+            if job is not None and done % 50 == 0:
+                job.stage('fetch', 100 * done // len(futures))
+
+    if job is not None:
+        job.stage('write')
+    written, unchanged = write(org, user, assessment, responses, workers)
+    if client_factory is not None:
+        pool.clear()
+    return {'fetched': len(responses), 'written': written, 'unchanged': unchanged, 'failed': failed}
+
+
+def _import_row(hes_data):
+    return {
+        'Address Line 1': hes_data.get('address'),
+        'City': hes_data.get('city'),
+        'State': hes_data.get('state'),
+        'Postal Code': hes_data.get('zip_code'),
+    }
+
+
+def _assessment_date(hes_data):
+    value = hes_data.get('assessment_date')
+    if isinstance(value, datetime.date):
+        return value
+    return parse_date(str(value)[:10]) if value else None
+
+
+def _score(hes_data):
+    value = hes_data.get('base_score')
+    return float(value) if value not in (None, '') else None
+
+
+def write(org, user, assessment, responses, workers=1):
+    """
+    Write the assessments and measurements of responses, query_hes responses by hes_id.
+    Returns the number of buildings written and unchanged.
+    """
+    if not responses:
+        return 0, 0
+    cycle = Cycle.objects.filter(organization=org).last()
+
+    with transaction.atomic():
+        propertyviews = utils.create_propertyviews(org, cycle, [_import_row(hes_data) for hes_data in responses.values()], workers)
+        views = [pv for propertyview in propertyviews for pv in propertyview]
+        green_properties, audit_logs = utils.latest_assessments(views, assessment)
+
+        written = unchanged = 0
+        updated = {}
+        synced = []
+        for (hes_id, hes_data), propertyview in zip(responses.items(), propertyviews):
+            assessment_date = _assessment_date(hes_data) or datetime.date.today()
+            metric = _score(hes_data)
+            changed = False
+            for pv in propertyview:
+                green_property = green_properties.get(pv.pk)
+                if (green_property is not None and green_property.date == assessment_date and
+                        green_property.metric == metric and green_property.reference_id == hes_id):
+                    continue
+                changed = True
+                assessment_data = {'assessment': assessment, 'view': pv, 'date': assessment_date,
+                                   'metric': metric, 'version': hes_data.get('hescore_version'), 'reference_id': hes_id}
+                if green_property is None:
+                    green_property = green_properties[pv.pk] = HELIXGreenAssessmentProperty(**assessment_data)
+                else:
+                    for field in HES_ASSESSMENT_FIELDS:
+                        setattr(green_property, field, assessment_data[field])
+                    updated[green_property.pk] = green_property
+                utils.log_assessment(green_property, assessment_data, audit_logs, user)
+                synced.append((green_property, hes_data, assessment_date))
+            if changed:
+                written += 1
+            else:
+                unchanged += 1
+        HELIXGreenAssessmentProperty.objects.bulk_update(list(updated.values()), HES_ASSESSMENT_COLUMNS)
+
+        assessment_ids = [green_property.pk for green_property, hes_data, assessment_date in synced]
+        HelixMeasurement.objects.filter(
+            assessment_property_id__in=assessment_ids,
+            measurement_type__in={measurement_type for measurement_type, fuel, unit in HES_MEASUREMENTS.values()}).delete()
+        HelixMeasurement.objects.bulk_create([
+            HelixMeasurement(assessment_property_id=green_property.pk, measurement_type=measurement_type, fuel=fuel,
+                             unit=unit, quantity=hes_data[field], status='ESTIMATE', year=assessment_date.year)
+            for green_property, hes_data, assessment_date in synced
+            for field, (measurement_type, fuel, unit) in HES_MEASUREMENTS.items() if hes_data.get(field) is not None])
+        # bulk writes send no signals
+        reso_cache.invalidate_views({green_property.view_id for green_property, hes_data, assessment_date in synced})
+    return written, unchanged
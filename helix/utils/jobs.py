@@ -0,0 +1,140 @@
+# !/usr/bin/env python
+# encoding: utf-8
+"""
+Background jobs for long running requests.
+
+Jobs run in a thread pool of the web process. Their status is kept in the
+django cache, so any process serving the status endpoint can report it.
+
+Jobs are not persisted: a job queued or running in a process that stops, e.g. on a
+deploy or a worker restart, is lost and has to be submitted again. Every process with
+jobs keeps a heartbeat in the cache, and get_job reports the queued and running jobs
+of a process whose heartbeat expired as failed, instead of leaving them pending.
+"""
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections
+
+logger = logging.getLogger(__name__)
+
+# seconds a finished job's status stays available
+JOB_STATUS_TIMEOUT = 60 * 60 * 24
+
+# seconds between the heartbeats of a process with jobs, and after which a process
+# without heartbeat is taken to have stopped
+JOB_HEARTBEAT_INTERVAL = 15
+JOB_HEARTBEAT_TIMEOUT = 60
+
+# (pid, id) of this process, new in every forked worker
+_worker = (None, None)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'HELIX_JOB_WORKERS', 4),
+                thread_name_prefix='helix-job')
+            threading.Thread(target=_heartbeat_loop, name='helix-job-heartbeat', daemon=True).start()
+        return _executor
+
+
+def _cache_key(job_id):
+    return 'helix:job:' + job_id
+
+
+def _worker_key(worker_id):
+    return 'helix:job:worker:' + worker_id
+
+
+def worker_id():
+    """
+    Id of this process in the status of its jobs
+    """
+    global _worker
+    if _worker[0] != os.getpid():
+        _worker = (os.getpid(), uuid.uuid4().hex)
+    return _worker[1]
+
+
+def heartbeat():
+    cache.set(_worker_key(worker_id()), time.time(), JOB_HEARTBEAT_TIMEOUT)
+
+
+def _heartbeat_loop():
+    while True:
+        try:
+            heartbeat()
+        except Exception:
+            logger.exception('helix job heartbeat failed')
+        time.sleep(JOB_HEARTBEAT_INTERVAL)
+
+
+def _update(job_id, **fields):
+    status = cache.get(_cache_key(job_id)) or {'id': job_id}
+    status.update(fields)
+    cache.set(_cache_key(job_id), status, JOB_STATUS_TIMEOUT)
+
+
+def get_job(job_id):
+    """
+    Status of a job: id, status (queued, running, success or error), stage, progress and result.
+    A queued or running job of a process that stopped is marked as failed.
+    """
+    status = cache.get(_cache_key(job_id))
+    if (status is not None and status.get('status') in ('queued', 'running') and
+            cache.get(_worker_key(status.get('worker', ''))) is None):
+        logger.warning('helix job %s was lost with its worker process', job_id)
+        _update(job_id, status='error', message='job was lost when its worker process stopped, submit it again')
+        status = cache.get(_cache_key(job_id))
+    return status
+
+
+class Job(object):
+    """
+    Handle given to a running job to report its progress
+    """
+
+    def __init__(self, job_id):
+        self.id = job_id
+
+    def stage(self, name, progress=0):
+        _update(self.id, stage=name, progress=progress)
+
+
+def submit(func, *args, **kwargs):
+    """
+    Run func(job, *args, **kwargs) in the background and return the job id.
+    The value returned by func, which must be json serializable, becomes the job result.
+    """
+    job_id = uuid.uuid4().hex
+    executor = _get_executor()
+    heartbeat()
+    _update(job_id, status='queued', stage=None, progress=0, result=None, worker=worker_id())
+    executor.submit(_run, job_id, func, args, kwargs)
+    return job_id
+
+
+def _run(job_id, func, args, kwargs):
+    close_old_connections()
+    _update(job_id, status='running')
+    try:
+        result = func(Job(job_id), *args, **kwargs)
+    except Exception as e:
+        logger.exception('helix job %s failed', job_id)
+        _update(job_id, status='error', message=str(e))
+    else:
+        _update(job_id, status='success', progress=100, result=result)
+    finally:
+        close_old_connections()
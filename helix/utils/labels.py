@@ -0,0 +1,157 @@
+# !/usr/bin/env python
+# encoding: utf-8
+"""
+Pool rendering PDF labels.
+
+The label builders render a pdf and upload it to S3, which takes seconds of mostly
+CPU bound work. Labels are rendered by a pool of HELIX_LABEL_WORKERS workers, threads
+or, with HELIX_LABEL_POOL = 'process', processes so that a batch of labels renders on
+every core. Process workers are forked from the web process and only get the label
+method name and its data, which must be picklable.
+
+A label is fingerprinted by its label type, the template version and its data. The
+fingerprint is stored with the GreenAssessmentURL of the label, so a property labeled
+again with the same data gets its existing label back instead of a new render and upload.
+"""
+import hashlib
+import json
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import django
+from django.conf import settings
+from django.db.models import OuterRef, Subquery
+
+from helix.models import HELIXGreenAssessmentProperty, HELIXLabelFingerprint
+from helix.utils import clients
+
+# workers rendering labels, unless HELIX_LABEL_WORKERS is set
+LABEL_WORKERS = 4
+
+# part of every fingerprint, unless HELIX_LABEL_TEMPLATE_VERSION is set. Change it when
+# the label templates change, so labels are rendered again with the new templates.
+LABEL_TEMPLATE_VERSION = '1'
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _init_worker():
+    # a no-op in forked workers, sets django up in spawned ones
+    django.setup()
+
+
+def _get_executor(broken=None):
+    global _executor
+    with _executor_lock:
+        if _executor is not None and _executor is broken:
+            _executor = None
+        if _executor is None:
+            workers = getattr(settings, 'HELIX_LABEL_WORKERS', LABEL_WORKERS)
+            if getattr(settings, 'HELIX_LABEL_POOL', 'thread') == 'process':
+                _executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker)
+            else:
+                _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='helix-label')
+        return _executor
+
+
+def _render(method, data, bucket):
+    return getattr(clients.label_client(), method)(data, bucket)
+
+
+def submit(method, data):
+    """
+    Future of Label.<method>(data, bucket), the S3 key or url of the rendered label
+    """
+    executor = _get_executor()
+    try:
+        return executor.submit(_render, method, data, settings.AWS_BUCKET_NAME)
+    except BrokenProcessPool:
+        # a worker died, start a new pool
+        return _get_executor(broken=executor).submit(_render, method, data, settings.AWS_BUCKET_NAME)
+
+
+def render(method, data):
+    """
+    Render a label in the pool and wait for it
+    """
+    return submit(method, data).result()
+
+
+def render_many(labels):
+    """
+    Render (method, data) labels in parallel. Returns the result, or the exception
+    raised, of every label in order.
+    """
+    futures = [submit(method, data) for method, data in labels]
+    results = []
+    for future in futures:
+        try:
+            results.append(future.result())
+        except Exception as e:
+            results.append(e)
+    return results
+
+
+def url(key):
+    """
+    url of a label uploaded to the S3 bucket under key
+    """
+    return 'https://s3.amazonaws.com/' + settings.AWS_BUCKET_NAME + '/' + key
+
+
+def fingerprint(method, data):
+    """
+    (label type, digest) of the label Label.<method> renders from data
+    """
+    version = getattr(settings, 'HELIX_LABEL_TEMPLATE_VERSION', LABEL_TEMPLATE_VERSION)
+    payload = json.dumps([method, version, data], sort_keys=True, default=str)
+    return method, hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def find_many(items, assessment):
+    """
+    url of the existing label of every (views, fingerprint) item, the label of the latest
+    assessment of one of the views with the same fingerprint, or None. Labels of older
+    assessments are never reused, their file may have been removed. One query for all items.
+    """
+    view_ids = {pv.pk for views, label_fingerprint in items for pv in views or ()}
+    digests = {label_fingerprint[1] for views, label_fingerprint in items}
+    if not view_ids:
+        return [None] * len(items)
+
+    # the assessment latest_assessments returns for the view
+    latest = HELIXGreenAssessmentProperty.objects.filter(
+        view_id=OuterRef('assessment_url__property_assessment__view_id'),
+        assessment=assessment).order_by('-date', '-id').values('pk')[:1]
+    found = {}
+    matches = HELIXLabelFingerprint.objects.filter(
+        digest__in=digests,
+        assessment_url__property_assessment__assessment=assessment,
+        assessment_url__property_assessment__view_id__in=view_ids,
+        assessment_url__property_assessment_id=Subquery(latest)).values_list(
+        'assessment_url__property_assessment__view_id', 'label_type', 'digest', 'assessment_url__url')
+    for view_id, label_type, digest, label_url in matches:
+        if label_url:
+            found[(view_id, label_type, digest)] = label_url
+
+    urls = []
+    for views, (label_type, digest) in items:
+        urls.append(next((found[(pv.pk, label_type, digest)] for pv in views or () if (pv.pk, label_type, digest) in found), None))
+    return urls
+
+
+def find(views, label_fingerprint, assessment):
+    return find_many([(views, label_fingerprint)], assessment)[0]
+
+
+def save_fingerprints(assessment_urls):
+    """
+    Store the fingerprints of (GreenAssessmentURL, fingerprint or None) pairs, replacing the
+    fingerprints of labels they were rendered for before
+    """
+    HELIXLabelFingerprint.objects.filter(assessment_url__in=[assessment_url.pk for assessment_url, label_fingerprint in assessment_urls]).delete()
+    HELIXLabelFingerprint.objects.bulk_create([
+        HELIXLabelFingerprint(assessment_url_id=assessment_url.pk, label_type=label_fingerprint[0], digest=label_fingerprint[1])
+        for assessment_url, label_fingerprint in assessment_urls if label_fingerprint is not None])
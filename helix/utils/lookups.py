@@ -0,0 +1,203 @@
+# !/usr/bin/env python
+# encoding: utf-8
+"""
+Caches of the organization and certification lookups every label and export request
+starts with.
+
+Organizations and certifications are cached per process. Entries expire after
+HELIX_LOOKUP_TTL seconds and are dropped as soon as a model they were read from is
+saved or deleted in this process, other processes see the change once their entry
+expires. Cached instances are shared between requests and must be treated as read only.
+
+Organization membership decides what a user may export and label, so it is cached in
+the django cache instead, under versions shared by all processes. Every change to the
+membership of a user, or to an organization, bumps a version, so no process keeps
+serving membership that was revoked.
+"""
+import hashlib
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+
+from seed.lib.superperms.orgs.models import Organization as SEEDOrganization, OrganizationUser
+from seed.models.certification import GreenAssessment
+
+from helix.models import HELIXGreenAssessment, HELIXOrganization
+
+# seconds a lookup is cached, unless HELIX_LOOKUP_TTL is set
+LOOKUP_TTL = 300
+
+# entries per cache, all entries are dropped when it is full
+LOOKUP_CACHE_SIZE = 10000
+
+
+class TTLCache:
+    """
+    Thread safe mapping whose entries expire ttl seconds after they were loaded
+    """
+    def __init__(self, maxsize=LOOKUP_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.entries = {}
+        self.generation = 0
+        self.lock = threading.Lock()
+
+    def get(self, key, load):
+        """
+        Value of key, calling load to read it when it is missing or expired.
+        A value loaded while the cache was cleared is returned but not kept.
+        """
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] > now:
+                return entry[1]
+            generation = self.generation
+
+        value = load()
+        with self.lock:
+            if generation == self.generation:
+                if len(self.entries) >= self.maxsize:
+                    self.entries.clear()
+                self.entries[key] = (now + getattr(settings, 'HELIX_LOOKUP_TTL', LOOKUP_TTL), value)
+        return value
+
+    def discard(self, key):
+        with self.lock:
+            self.generation += 1
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.generation += 1
+            self.entries.clear()
+
+
+ORGANIZATIONS = TTLCache()
+RESO_CERTIFICATIONS = TTLCache()
+ASSESSMENTS = TTLCache()
+
+
+def organization(name=None, pk=None):
+    """
+    HELIXOrganization by name or primary key. Raises DoesNotExist like Organization.objects.get.
+    """
+    if pk is not None:
+        return ORGANIZATIONS.get(('pk', int(pk)), lambda: HELIXOrganization.objects.get(pk=pk))
+    return ORGANIZATIONS.get(('name', name), lambda: HELIXOrganization.objects.get(name=name))
+
+
+def _version_key(scope):
+    return 'helix:lookups:version:' + scope
+
+
+def _new_version():
+    # a version lost to eviction restarts from a value nothing was cached with
+    return int(time.time() * 1000000)
+
+
+def _versions(*scopes):
+    keys = [_version_key(scope) for scope in scopes]
+    found = cache.get_many(keys)
+    for key in keys:
+        if key not in found:
+            cache.add(key, _new_version(), timeout=None)
+    if len(found) < len(keys):
+        found = cache.get_many(keys)
+    return [found.get(key) for key in keys]
+
+
+def _bump(scope):
+    try:
+        cache.incr(_version_key(scope))
+    except ValueError:
+        cache.add(_version_key(scope), _new_version(), timeout=None)
+
+
+def invalidate(scope):
+    """
+    Bump the version of scope, 'organizations' or 'user:<id>', right away and again once
+    the current transaction commits, so nothing read before the commit stays cached
+    """
+    _bump(scope)
+    transaction.on_commit(lambda: _bump(scope))
+
+
+def _shared(key, load):
+    value = cache.get(key)
+    if value is None:
+        value = load()
+        cache.set(key, value, getattr(settings, 'HELIX_LOOKUP_TTL', LOOKUP_TTL))
+    return value
+
+
+def user_organization_ids(user):
+    """
+    frozenset of the ids of the organizations user belongs to
+    """
+    version, = _versions('user:%s' % user.pk)
+    return _shared('helix:lookups:user_organization_ids:%s:%s' % (user.pk, version), lambda: frozenset(
+        HELIXOrganization.objects.filter(users=user).values_list('pk', flat=True)))
+
+
+def user_organization(user, name):
+    """
+    Organization called name that user belongs to. Raises DoesNotExist otherwise, and
+    MultipleObjectsReturned when user belongs to several organizations called name.
+    """
+    user_version, organizations_version = _versions('user:%s' % user.pk, 'organizations')
+    key = 'helix:lookups:user_organization:%s:%s:%s:%s' % (
+        user.pk, user_version, organizations_version, hashlib.sha1(str(name).encode('utf-8')).hexdigest())
+    return organization(pk=_shared(key, lambda: HELIXOrganization.objects.get(users=user, name=name).pk))
+
+
+def reso_certification_ids(organization_ids):
+    """
+    frozenset of the ids of the RESO certifications of all organization_ids
+    """
+    certification_ids = set()
+    for organization_id in organization_ids:
+        certification_ids |= RESO_CERTIFICATIONS.get(organization_id, lambda: frozenset(
+            HELIXGreenAssessment.objects.filter(organization_id=organization_id, is_reso_certification=True).values_list('pk', flat=True)))
+    return frozenset(certification_ids)
+
+
+def assessment(organization_id, name):
+    """
+    HELIXGreenAssessment of an organization by name. Raises DoesNotExist like HELIXGreenAssessment.objects.get.
+    """
+    return ASSESSMENTS.get((int(organization_id), name), lambda: HELIXGreenAssessment.objects.get(
+        name=name, organization_id=organization_id))
+
+
+def clear():
+    """
+    Drop every lookup cached in this process
+    """
+    for lookup_cache in (ORGANIZATIONS, RESO_CERTIFICATIONS, ASSESSMENTS):
+        lookup_cache.clear()
+
+
+def _organization_changed(sender, **kwargs):
+    clear()
+    invalidate('organizations')
+
+
+def _organization_user_changed(sender, instance, **kwargs):
+    invalidate('user:%s' % instance.user_id)
+
+
+def _assessment_changed(sender, **kwargs):
+    RESO_CERTIFICATIONS.clear()
+    ASSESSMENTS.clear()
+
+
+for signal in (post_save, post_delete):
+    for model in (SEEDOrganization, HELIXOrganization):
+        signal.connect(_organization_changed, sender=model, dispatch_uid='helix_lookups_organization')
+    signal.connect(_organization_user_changed, sender=OrganizationUser, dispatch_uid='helix_lookups_organization_user')
+    for model in (GreenAssessment, HELIXGreenAssessment):
+        signal.connect(_assessment_changed, sender=model, dispatch_uid='helix_lookups_assessment')
@@ -0,0 +1,149 @@
+# !/usr/bin/env python
+# encoding: utf-8
+"""
+Cache of the rendered RESO xml export of property views.
+
+Every property view has a content version in the django cache, bumped whenever its
+state, green assessments, urls, measures or measurements are saved or deleted. The
+rendered xml is cached under the versions of the exported views, together with the
+date and the RESO certifications of the user, which also decide what is exported.
+The same key, hashed, is the ETag of the response.
+
+Bulk writes do not send signals, code writing these models in bulk calls invalidate_views.
+Writes that bypass the ORM are picked up once HELIX_RESO_CACHE_TIMEOUT expires.
+"""
+import datetime
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+
+from seed.models import PropertyState, PropertyView
+from seed.models.certification import GreenAssessmentProperty, GreenAssessmentURL
+from seed.models.property_measures import PropertyMeasure
+
+from helix.models import HELIXGreenAssessmentProperty, HelixMeasurement, HELIXPropertyMeasure
+
+# seconds a rendered export is kept, unless HELIX_RESO_CACHE_TIMEOUT is set
+RESO_CACHE_TIMEOUT = 60 * 60
+
+
+def _version_key(view_id):
+    return 'helix:reso:version:' + str(view_id)
+
+
+def _new_version():
+    # a version lost to eviction restarts from a value no cached export was rendered with
+    return int(time.time() * 1000000)
+
+
+def versions(view_ids):
+    """
+    Content version of every view id
+    """
+    keys = [_version_key(view_id) for view_id in view_ids]
+    found = cache.get_many(keys)
+    for key in keys:
+        if key not in found:
+            cache.add(key, _new_version(), timeout=None)
+    if len(found) < len(keys):
+        found = cache.get_many(keys)
+    return [found.get(key) for key in keys]
+
+
+def export_key(view_ids, reso_certifications, crsdata=False, today=None):
+    """
+    Cache key of the xml export of view_ids for a user with reso_certifications
+    """
+    if today is None:
+        today = datetime.date.today()
+    view_ids = sorted(view_ids)
+    parts = [
+        ','.join('%s:%s' % pair for pair in zip(view_ids, versions(view_ids))),
+        today.isoformat(),
+        ','.join(str(pk) for pk in sorted(reso_certifications)),
+        str(bool(crsdata)),
+    ]
+    return 'helix:reso:xml:' + hashlib.sha1('|'.join(parts).encode('utf-8')).hexdigest()
+
+
+def etag(key):
+    return '"' + key.rsplit(':', 1)[-1] + '"'
+
+
+def get(key):
+    """
+    (rendered xml, export audit rows) cached under key, or None
+    """
+    return cache.get(key)
+
+
+def store(key, rendered_xml, audit_rows):
+    cache.set(key, (rendered_xml, audit_rows), getattr(settings, 'HELIX_RESO_CACHE_TIMEOUT', RESO_CACHE_TIMEOUT))
+
+
+def invalidate_views(view_ids):
+    """
+    Bump the content version of view_ids once the current transaction commits, so no
+    export is rendered and cached from data that is about to change
+    """
+    view_ids = list(view_ids)
+    if view_ids:
+        transaction.on_commit(lambda: _bump(view_ids))
+
+
+def _bump(view_ids):
+    for view_id in view_ids:
+        try:
+            cache.incr(_version_key(view_id))
+        except ValueError:
+            cache.add(_version_key(view_id), _new_version(), timeout=None)
+
+
+def invalidate_states(state_ids):
+    invalidate_views(PropertyView.objects.filter(state_id__in=list(state_ids)).values_list('pk', flat=True))
+
+
+def invalidate_assessments(assessment_ids):
+    invalidate_views(GreenAssessmentProperty.objects.filter(pk__in=list(assessment_ids)).values_list('view_id', flat=True))
+
+
+def _view_changed(sender, instance, **kwargs):
+    invalidate_views([instance.pk])
+
+
+def _state_changed(sender, instance, **kwargs):
+    invalidate_states([instance.pk])
+
+
+def _assessment_changed(sender, instance, **kwargs):
+    invalidate_views([instance.view_id])
+
+
+def _url_changed(sender, instance, **kwargs):
+    invalidate_assessments([instance.property_assessment_id])
+
+
+def _measure_changed(sender, instance, **kwargs):
+    invalidate_states([instance.property_state_id])
+
+
+def _measurement_changed(sender, instance, **kwargs):
+    if instance.assessment_property_id:
+        invalidate_assessments([instance.assessment_property_id])
+    if instance.measure_property_id:
+        invalidate_states(PropertyMeasure.objects.filter(pk=instance.measure_property_id).values_list('property_state_id', flat=True))
+
+
+for signal in (post_save, post_delete):
+    signal.connect(_view_changed, sender=PropertyView, dispatch_uid='helix_reso_cache_view')
+    signal.connect(_state_changed, sender=PropertyState, dispatch_uid='helix_reso_cache_state')
+    for model in (GreenAssessmentProperty, HELIXGreenAssessmentProperty):
+        signal.connect(_assessment_changed, sender=model, dispatch_uid='helix_reso_cache_assessment')
+    signal.connect(_url_changed, sender=GreenAssessmentURL, dispatch_uid='helix_reso_cache_url')
+    for model in (PropertyMeasure, HELIXPropertyMeasure):
+        signal.connect(_measure_changed, sender=model, dispatch_uid='helix_reso_cache_measure')
+    signal.connect(_measurement_changed, sender=HelixMeasurement, dispatch_uid='helix_reso_cache_measurement')
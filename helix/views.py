@@ -1,6 +1,6 @@
 import os
+import io
 import csv
-import re
 import datetime
 import json
 # from urlparse import urlparse
@@ -10,17 +10,18 @@ from seed.data_importer.tasks import save_raw_data, map_data, match_buildings
 
 from django.conf import settings
 from django.contrib.auth.decorators import login_required
-from django.http import JsonResponse, HttpResponse, HttpResponseNotFound
+from django.http import FileResponse, JsonResponse, HttpResponse, HttpResponseBadRequest, HttpResponseNotFound, HttpResponseNotModified, StreamingHttpResponse
 from django.shortcuts import render
 from django.views.decorators.csrf import csrf_exempt
-from django.template.loader import render_to_string
+from django.template.loader import get_template, render_to_string
+from django.utils.http import parse_etags
 from django.db.models import Q
 from rest_framework.decorators import api_view
 
 from seed.models import Cycle, PropertyView, PropertyState, Property
 
 from seed.models.certification import GreenAssessmentPropertyAuditLog, GreenAssessmentURL
-from helix.models import HELIXGreenAssessment, HELIXGreenAssessmentProperty, HelixMeasurement, HELIXPropertyMeasure
+from helix.models import HELIXGreenAssessment, HELIXGreenAssessmentProperty, HELIXLabelFingerprint, HelixMeasurement, HELIXPropertyMeasure
 from seed.models.auditlog import (
     AUDIT_USER_EXPORT,
 )
@@ -31,10 +32,7 @@ from helix.models import HELIXOrganization as Organization
 from seed.utils.api import api_endpoint
 
 import helix.helix_utils as utils
-
-from hes import hes
-
-from label import label
+from helix.utils import arrow_export, clients, duplicates, export, feed, hes_cache, hes_sync, jobs, labels, lookups, reso_cache
 
 # Return the green assessment front end page. This can be accessed through
 # the seed side bar or at /app/assessments
@@ -57,87 +55,131 @@ def assessment_edit(request):
     assessment = HELIXGreenAssessment.objects.get(pk=request.GET['id'])
     return render(request, 'helix/assessment_edit.html', {'assessment': assessment})
 
+def _export_response(file_name, streaming_content=None, next_after_id=None):
+    """
+    csv export response, streamed when streaming_content is given
+    """
+    # Handle optional parameter
+    kwargs = {'content_type': 'text/csv'} if file_name is not None else {}
+    if streaming_content is not None:
+        response = StreamingHttpResponse(streaming_content, **kwargs)
+    else:
+        response = export.AuditedHttpResponse(**kwargs)
+    if (file_name is not None):
+        response['Content-Disposition'] = 'attachment; filename="' + file_name + '"'
+    if next_after_id is not None:
+        response['X-Next-After-Id'] = str(next_after_id)
+    return response
+
+
 # Export the GreenAssessmentProperty information for the list of property ids provided
 # Parameters:
 #   ids: comma separated list of views ids to retrieve
 #   file_name: optional parameter that can be set to have the web browser open
 #              a save dialog with this as the file name. When not set, raw text
 #              is displayed
+#   stream: optional, when true rows are streamed to the client as they are read
+#           from the database instead of being built in memory first
+#   chunk_size: optional, number of rows read per database round trip when streaming,
+#               and rows per record batch of the arrow and parquet formats
+#   after_id, limit: optional, export the page of at most limit property views with an id
+#                    above after_id. The X-Next-After-Id response header is the after_id of
+#                    the next page, it is missing on the last page.
+#   format: optional, csv (default), arrow for an Arrow IPC file or parquet for a Parquet
+#           file, with the csv columns and numeric metrics, sizes and years. Needs pyarrow.
 # Example:
 #   GET /helix/helix-csv-export/?view_ids=11,12,13,14
+#   GET /helix/helix-csv-export/?view_ids=11,12,13,14&format=parquet&filename=export.parquet
 @api_endpoint
 @api_view(['GET', 'POST'])
 def helix_csv_export(request):
     #    property_ids = map(lambda view_id: int(view_id), request.data.get['ids'].split(','))
     property_ids = request.data.get('ids', [])
     view_ids = PropertyView.objects.filter(property_id__in=property_ids)
-    state_ids = view_ids.values_list('state_id', flat=True)
-
-    # retrieve green assessment properties that belong to one of these ids
-    today = datetime.datetime.today()
-    organizations = Organization.objects.filter(users=request.user)
-    reso_certifications = HELIXGreenAssessment.objects.filter(organization_id__in=organizations).filter(is_reso_certification=True)
-    assessments = HELIXGreenAssessmentProperty.objects.filter(
-        view__pk__in=view_ids).filter(Q(_expiration_date__gte=today) | Q(_expiration_date=None)).filter(opt_out=False).filter(assessment_id__in=reso_certifications)
-    #    num_certification = assessments.values_list('assessment_id', flat=True)
-
-    # retrieve measures that belogn to one of these ids
-    matching_measures = HELIXPropertyMeasure.objects.filter(property_state__in=state_ids)  # only pv can be exported
+    try:
+        after_id, limit = export.page_params(request.data)
+    except ValueError:
+        return HttpResponseBadRequest('after_id and limit must be integers')
+    next_after_id = None
+    if limit is not None:
+        page, next_after_id = export.page_ids(view_ids, after_id, limit)
+        view_ids = PropertyView.objects.filter(pk__in=page)
+
+    # retrieve green assessment properties and measures that belong to one of these ids
+    organizations = lookups.user_organization_ids(request.user)
+    assessments = export.export_assessments(view_ids, organizations)
+    matching_measures = export.export_measures(view_ids)  # only pv can be exported
 
     file_name = request.data.get('filename')
+    file_format = request.data.get('format', 'csv')
+    if file_format != 'csv' and file_format not in arrow_export.FORMATS:
+        return HttpResponseBadRequest('format must be one of csv, ' + ', '.join(arrow_export.FORMATS))
+    if file_format != 'csv' and not arrow_export.available():
+        return HttpResponseBadRequest('The ' + file_format + ' format needs pyarrow')
 
-    # Handle optional parameter
-    if (file_name is not None):
-        response = HttpResponse(content_type='text/csv')
-        response['Content-Disposition'] = 'attachment; filename="' + file_name + '"'
-    else:
-        response = HttpResponse()
+    # log changes
+    audit_log = export.ExportAuditLog(request.user, 'Exported via ' + file_format)
+
+    if file_format != 'csv':
+        try:
+            chunk_size = export.chunk_size_param(request.data)
+        except ValueError:
+            return HttpResponseBadRequest('chunk_size must be a positive integer')
+        output = arrow_export.export_file(file_format, assessments, matching_measures, chunk_size, on_assessments=audit_log.add)
+        response = FileResponse(output, content_type=arrow_export.FORMATS[file_format])
+        if file_name is not None:
+            response['Content-Disposition'] = 'attachment; filename="' + file_name + '"'
+        if next_after_id is not None:
+            response['X-Next-After-Id'] = str(next_after_id)
+        return audit_log.finish(response)
+
+    if utils.is_true(request.data.get('stream')):
+        try:
+            chunk_size = export.chunk_size_param(request.data)
+        except ValueError:
+            return HttpResponseBadRequest('chunk_size must be a positive integer')
+
+        def stream():
+            writer = csv.writer(export.Echo())
+            yield writer.writerow(export.csv_header(matching_measures.exists()))
+            for row in export.stream_csv_rows(assessments, matching_measures, chunk_size, on_assessments=audit_log.add):
+                yield writer.writerow(row)
+
+        return audit_log.finish(_export_response(file_name, stream(), next_after_id))
+
+    assessments = list(assessments)
+    matching_measures = list(matching_measures)
+    response = _export_response(file_name, next_after_id=next_after_id)
 
     # Dump all fields of all retrieved assessments properties into csv
-    addressmap = {'custom_id_1': 'UniversalPropertyId', 'city': 'City', 'postal_code': 'PostalCode', 'state': 'State', 'latitude': 'Latitude', 'longitude': 'Longitude'}
-    addressmapxd = {'StreetDirPrefix': 'StreetDirPrefix', 'StreetDirSuffix': 'StreetDirSuffix', 'StreetName': 'StreetName', 'StreetNumber': 'StreetNumber', 'StreetSuffix': 'StreetSuffix', 'UnitNumber': 'UnitNumber'}
-    fieldnames = ['GreenVerificationBody',  'GreenBuildingVerificationType', 'GreenVerificationRating', 'GreenVerificationMetric', 'GreenVerificationVersion', 'GreenVerificationYear',  'GreenVerificationSource',  'GreenVerificationStatus', 'GreenVerificationURL']
-    measurenames = ['PowerProductionSource', 'PowerProductionOwnership', 'Electric', 'PowerProductionAnnualStatus', 'PowerProductionSize', 'PowerProductionType', 'PowerProductionAnnual', 'PowerProductionYearInstall']
-
     writer = csv.writer(response)
-    arr = [value for key, value in addressmap.items()] + [value for key, value in addressmapxd.items()] + ['Unparsed Address'] + [str(f) for f in fieldnames]
-    if matching_measures:
-        arr += [str(m) for m in measurenames]
-    writer.writerow(arr)
-    for a in assessments:
-        a_dict = a.to_reso_dict()
-        unparsedAddress = a.view.state.address_line_1
-        if a.view.state.address_line_2:
-            unparsedAddress += ' ' + a.view.state.address_line_2
-        writer.writerow([str(getattr(a.view.state, key, '')) for key, value in addressmap.items()] +
-                        [str(getattr(a.view.state, key, '')) for key, value in addressmapxd.items()] + [unparsedAddress] +
-                        [str(a_dict.get(f, '')) for f in fieldnames])
-        # log changes
-        a.log(
-            user=request.user,
-            record_type=AUDIT_USER_EXPORT,
-            name='Export log',
-            description='Exported via csv')
-
-    for measure in matching_measures:
-        matching_measurements = HelixMeasurement.objects.filter(
-            measure_property__pk=measure.propertymeasure_ptr_id,
-            measurement_type__in=['PROD', 'CAP'],
-            measurement_subtype__in=['PV', 'WIND']
-        )
-        measurement_dict = {}
-        for match in matching_measurements:
-            measurement_dict.update(match.to_reso_dict())
-            measurement_dict.update(measure.to_reso_dict())
-        unparsedAddress = measure.property_state.address_line_1
-        if measure.property_state.address_line_2:
-            unparsedAddress += ' ' + measure.property_state.address_line_2
-
-        writer.writerow([str(getattr(measure.property_state, key, '')) for key, value in addressmap.items()] +
-                        [str(getattr(measure.property_state, key, '')) for key, value in addressmapxd.items()] + [unparsedAddress] +
-                        [str(getattr({}, f, '')) for f in fieldnames] + [measurement_dict.get(m, '') for m in measurenames])
+    writer.writerow(export.csv_header(bool(matching_measures)))
+    for row in export.csv_rows(assessments, matching_measures):
+        writer.writerow(row)
+    audit_log.add(assessments)
+
+    return audit_log.finish(response)
+
+
+def _duplicate_rows(states, after_id=None, last_id=None):
+    """
+    Pairs of likely duplicate DuplicateState rows, each preceded by the reason for the match.
+    With after_id and last_id, only the pairs of the states with an id in (after_id, last_id]
+    are listed, matched against all the given states, which must be ordered by id.
+    """
+    addressmap = ['id', 'address_line_1', 'city', 'postal_code']
+    yield addressmap
+
+    for reason, state, match in duplicates.find_duplicates(states):
+        if after_id is not None:
+            if state.id <= after_id:
+                continue
+            if last_id is None or state.id > last_id:
+                break
+        yield [reason]
+        yield [str(getattr(state, elem, '')) for elem in addressmap]
+        yield [str(getattr(match, elem, '')) for elem in addressmap]
 
-    return response
 
 # Export the property address information for the list of property ids provided, matching up likely duplicates
 # Parameters:
@@ -145,6 +187,13 @@ def helix_csv_export(request):
 #   file_name: optional parameter that can be set to have the web browser open
 #              a save dialog with this as the file name. When not set, raw text
 #              is displayed
+#   stream: optional, when true rows are streamed to the client as soon as they are found
+#   chunk_size: optional, number of states read per database round trip when streaming
+#   after_id, limit: optional, list the pairs starting at the at most limit states with an
+#                    id above after_id, each matched against the states on its street, so
+#                    the pages list the same pairs as the whole export. The
+#                    X-Next-After-Id response header is the after_id of the next page,
+#                    it is missing on the last page.
 # Example:
 #   GET /helix/helix-dups-export/?view_ids=11,12,13,14
 @api_endpoint
@@ -153,51 +202,39 @@ def helix_dups_export(request):
     property_ids = request.data.get('ids', [])
     view_ids = PropertyView.objects.filter(property_id__in=property_ids)
     state_ids = view_ids.values_list('state_id', flat=True)
-    # convert to list to facilitate removal later on
-    states = [s for s in PropertyState.objects.filter(id__in=state_ids).only("id", "address_line_1", "normalized_address", "postal_code", "extra_data")]
+    states = PropertyState.objects.filter(id__in=state_ids).order_by('id')
+
+    try:
+        after_id, limit = export.page_params(request.data)
+    except ValueError:
+        return HttpResponseBadRequest('after_id and limit must be integers')
+    last_id = next_after_id = None
+    if limit is not None:
+        page, next_after_id = export.page_ids(states, after_id, limit)
+        last_id = page[-1] if page else None
+        # only states on the streets of the page can be matched with it
+        states = duplicates.page_candidates(states, page)
 
     file_name = request.data.get('filename')
-    # Handle optional parameter
-    if (file_name is not None):
-        response = HttpResponse(content_type='text/csv')
-        response['Content-Disposition'] = 'attachment; filename="' + file_name + '"'
-    else:
-        response = HttpResponse()
 
-    writer = csv.writer(response)
+    if utils.is_true(request.data.get('stream')):
+        try:
+            chunk_size = export.chunk_size_param(request.data)
+        except ValueError:
+            return HttpResponseBadRequest('chunk_size must be a positive integer')
 
-    addressmap = ['id', 'address_line_1', 'city', 'postal_code']
-    writer.writerow(addressmap)
+        def stream():
+            writer = csv.writer(export.Echo())
+            # states are bucketed before matching, so all of their small rows are read first
+            for row in _duplicate_rows(list(duplicates.state_rows(states, chunk_size)), after_id, last_id):
+                yield writer.writerow(row)
 
-    remaining_states = states
-    skip_states = []
-    for state in states:
-        if state.id in skip_states:
-            continue
-        for rem_state in remaining_states:
-            # likely matches, same zip code
-            if state.extra_data['StreetNumber'] == rem_state.extra_data['StreetNumber'] and state.extra_data['StreetName'] == rem_state.extra_data['StreetName'] and state.extra_data['UnitNumber'] == rem_state.extra_data['UnitNumber'] and state.postal_code == rem_state.postal_code and state.id != rem_state.id:
-                writer.writerow(['Similar street address, same postal code'])
-                writer.writerow([str(getattr(state, elem, '')) for elem in addressmap])
-                writer.writerow([str(getattr(rem_state, elem, '')) for elem in addressmap])
-#                remaining_states = list(filter(lambda i: i.id != rem_state.id, remaining_states))
-                skip_states.append(rem_state.id)
-                continue
-            # likely matches, no unit number, same zip code
-            if state.extra_data['StreetNumber'] == rem_state.extra_data['StreetNumber'] and state.extra_data['StreetName'] == rem_state.extra_data['StreetName'] and state.postal_code == rem_state.postal_code and state.id != rem_state.id:
-                writer.writerow(['Similar address, excludes unit #, same postal code'])
-                writer.writerow([str(getattr(state, elem, '')) for elem in addressmap])
-                writer.writerow([str(getattr(rem_state, elem, '')) for elem in addressmap])
-                skip_states.append(rem_state.id)
-                continue
-            # likely matches, different zip code
-            if state.extra_data['StreetNumber'] == rem_state.extra_data['StreetNumber'] and state.extra_data['StreetDirPrefix'] == rem_state.extra_data['StreetDirPrefix'] and state.extra_data['StreetName'] == rem_state.extra_data['StreetName'] and state.extra_data['UnitNumber'] == rem_state.extra_data['UnitNumber'] and state.postal_code != rem_state.postal_code and state.id != rem_state.id:
-                writer.writerow(['Same street address, different postal code'])
-                writer.writerow([str(getattr(state, elem, '')) for elem in addressmap])
-                writer.writerow([str(getattr(rem_state, elem, '')) for elem in addressmap])
-                skip_states.append(rem_state.id)
-                continue
-# { 'StreetSuffix': 'court', 'StreetDirSuffix': '', 'StreetNamePreDirectional': ''}
+        return _export_response(file_name, stream(), next_after_id)
+
+    response = _export_response(file_name, next_after_id=next_after_id)
+    writer = csv.writer(response)
+    for row in _duplicate_rows(list(duplicates.state_rows(states)), after_id, last_id):
+        writer.writerow(row)
     return response
 
 # Export List of updated properties in an xml
@@ -213,48 +250,64 @@ def helix_dups_export(request):
 #                  At the moment, this can be set by any user. It might be
 #                  that case that only owners/admins should be able to retrieve
 #                  private data.
+#    cursor: optional, read the list as a change feed. Empty for the first page, which
+#            starts at start_date or at the beginning, then the next_cursor of the
+#            previous page. Every page lists the views changed after the cursor, in change
+#            order, and the next_cursor to continue from. has_more is true while pages are full.
+#            Export log entries are not changes. Changes are listed once they are
+#            HELIX_CHANGE_FEED_LAG seconds old, 60 by default, so that changes committed late
+#            are not passed by the cursor. A page may end before the latest changes even
+#            when has_more is false, poll again with the same next_cursor for them.
+#    limit: optional, maximum number of changes in a page of the change feed. Without a
+#           cursor, maximum number of property views listed, see after_id.
+#    after_id: optional, list the property views with an id above after_id, in id order.
+#              next_after_id is the after_id of the next page, it is missing on the last page.
 # Example:
 #    http://localhost:8000/helix/helix-reso-export-list-xml/?start_date=2016-09-14&end_date=2017-07-11&private_data=True
+#    http://localhost:8000/helix/helix-reso-export-list-xml/?start_date=2016-09-14&cursor=&limit=500
 @api_endpoint
 @api_view(['GET'])
 def helix_reso_export_list_xml(request):
-    content = []
-    ga_pks = GreenAssessmentPropertyAuditLog.objects.none()
-    property_pks = Property.objects.none()
+    organizations = _export_organizations(request)
     start_date = request.GET.get('start_date', None)
     end_date = request.GET.get('end_date', None)
-    print(start_date)
-    print(end_date)
-    organization = request.GET.get('organization', None)
-    if organization:
-        organizations = Organization.objects.filter(users=request.user, name=organization)
-        organizations = organizations | Organization.objects.filter(parent_org_id__in=organizations)  # add sub-organizations with same parent
-    else:
-        organizations = Organization.objects.filter(users=request.user)
-        organizations = organizations | Organization.objects.filter(parent_org_id__in=organizations)  # add sub-organizations with same parent
-    
+
 #    if propertyview.state.data_quality == 2:
 #        return HttpResponse('<errors><error>Property has errors and cannot be exported</error></errors>', content_type='text/xml')
 
+    if 'cursor' in request.GET:
+        try:
+            if request.GET['cursor']:
+                marks = feed.decode_cursor(request.GET['cursor'])
+            else:
+                marks = feed.start_marks(start_date)
+            limit = int(request.GET.get('limit', feed.CHANGE_FEED_LIMIT))
+        except ValueError:
+            return HttpResponseBadRequest('<?xml version="1.0"?>\n<!--Invalid cursor, start_date or limit --!>')
+        content, marks, has_more = feed.changes(organizations, marks, limit, end_date)
+        context = {
+            'content': content,
+            'next_cursor': feed.encode_cursor(marks),
+            'has_more': has_more,
+            }
+        rendered_xml = render_to_string('reso_export_list_template.xml', context)
+        return HttpResponse(rendered_xml, content_type='text/xml')
+
     try:
-        # select green assessment properties that are in the specified create / update date range
-        # and associated with the correct property view
-        if start_date:
-            ga_pks = GreenAssessmentPropertyAuditLog.objects.filter(organization_id__in=organizations, created__gte=start_date)
-            property_pks = Property.objects.filter(organization_id__in=organizations, updated__gte=start_date)
-        if end_date:
-            ga_pks = ga_pks & GreenAssessmentPropertyAuditLog.objects.filter(organization_id__in=organizations, created__lte=end_date)
-            property_pks = property_pks & Property.objects.filter(organization_id__in=organizations, updated__lte=end_date)
-
-        if property_pks:
-            property_views = PropertyView.objects.filter(property__in=property_pks)
-            content = list(property_views.values_list('id', flat=True))
-        if ga_pks:
-            content = list(set(content) | set(list(ga_pks.values_list('property_view_id', flat=True))))
+        after_id, limit = export.page_params(request.GET)
+    except ValueError:
+        return HttpResponseBadRequest('<?xml version="1.0"?>\n<!--after_id and limit must be integers --!>')
 
+    try:
+        next_after_id = None
+        if limit is not None:
+            content, next_after_id = export.page_ids(_updated_views(organizations, start_date, end_date), after_id, limit)
+        else:
+            content = _updated_view_ids(organizations, start_date, end_date)
         if content:
             context = {
-                'content': content
+                'content': content,
+                'next_after_id': next_after_id,
                 }
             rendered_xml = render_to_string('reso_export_list_template.xml', context)
             return HttpResponse(rendered_xml, content_type='text/xml')
@@ -264,123 +317,186 @@ def helix_reso_export_list_xml(request):
         return HttpResponseNotFound('<?xml version="1.0"?>\n<!--No properties found --!>')
 
 
+def _export_organizations(request):
+    """
+    Organizations of the user, or the one named by the organization parameter, with their sub-organizations
+    """
+    organization = request.GET.get('organization', None)
+    if organization:
+        organizations = Organization.objects.filter(users=request.user, name=organization)
+    else:
+        organizations = Organization.objects.filter(users=request.user)
+    return organizations | Organization.objects.filter(parent_org_id__in=organizations)  # add sub-organizations with same parent
+
+
+def _updated_views(organizations, start_date, end_date):
+    """
+    property views of organizations whose property or green assessments changed between start_date and end_date
+    """
+    if not start_date:
+        return PropertyView.objects.none()
+    # select green assessment properties that are in the specified create / update date range
+    # and associated with the correct property view
+    ga_pks = GreenAssessmentPropertyAuditLog.objects.filter(organization_id__in=organizations, created__gte=start_date)
+    property_pks = Property.objects.filter(organization_id__in=organizations, updated__gte=start_date)
+    if end_date:
+        ga_pks = ga_pks.filter(created__lte=end_date)
+        property_pks = property_pks.filter(updated__lte=end_date)
+    return PropertyView.objects.filter(Q(property__in=property_pks) | Q(pk__in=ga_pks.values('property_view_id')))
+
+
+def _updated_view_ids(organizations, start_date, end_date):
+    return list(_updated_views(organizations, start_date, end_date).order_by('pk').values_list('pk', flat=True))
+
+
 # Export GreenAssessmentProperty and Measures information for a property view in an xml
 # format using RESO fields
 # Parameters:
-#    propertyview_pk: primary key into the property view table. Determines
-#                     which records are exported. If the key does not exist
-#                     in the database, a response code 404 is returned.
+#    property_id: primary key into the property view table. Determines
+#                 which records are exported. If the key does not exist in the
+#                 database, the view is looked up by property_uid or street and
+#                 postal_code as in propertyview_find, a response code 404 is
+#                 returned when that finds nothing either.
+# The rendered xml is cached until the property's data changes. Responses carry an
+# ETag, a request whose If-None-Match matches it gets a 304 Not Modified.
 # Example:
 #    http://localhost:8000/helix/helix-reso-export-xml/?property_id=11
 # @login_required
 @api_endpoint
 @api_view(['GET'])
 def helix_reso_export_xml(request):
-    propertyview = utils.propertyview_find(request)
+    organizations = lookups.user_organization_ids(request.user)
+    crsdata = 'crsdata' in request.GET
+    property_id = request.GET.get('property_id', '')
+    propertyview = None
+    if property_id.isdigit():
+        # known view, its id is the cache key, its data is only read when the cache misses
+        view_ids = [int(property_id)]
+        propertyview = PropertyView.objects.filter(pk=view_ids[0])
+        if not propertyview.exists():
+            propertyview = None
+    if propertyview is None:
+        propertyview = utils.propertyview_find(request)
+        if not propertyview:
+            return HttpResponseNotFound('<?xml version="1.0"?>\n<!--No property found --!>')
+        view_ids = [pv.pk for pv in propertyview]
+
+    cache_key = reso_cache.export_key(view_ids, lookups.reso_certification_ids(organizations), crsdata)
+    etag = reso_cache.etag(cache_key)
+    if etag in parse_etags(request.META.get('HTTP_IF_NONE_MATCH', '')):
+        response = HttpResponseNotModified()
+        response['ETag'] = etag
+        return response
+
+    cached = reso_cache.get(cache_key)
+    if cached is None:
+        content, assessments = export.reso_xml_content(propertyview, organizations, crsdata=crsdata)
 
-    if not propertyview:
-        return HttpResponseNotFound('<?xml version="1.0"?>\n<!--No property found --!>')
+#    for pv in propertyview:
+#        if pv.state.data_quality == 2: #exclude records with data quality errors
+#            propertyview.exclude(pv)
+#        return HttpResponse('<errors><error>Property has errors and cannot be exported</error></errors>', content_type='text/xml')
 
-    today = datetime.datetime.today()
+        context = {
+            'content': content
+            }
+        cached = (render_to_string('reso_export_template.xml', context), export.audit_rows(assessments))
+        reso_cache.store(cache_key, *cached)
+    rendered_xml, audit_rows = cached
 
-    if 'crsdata' in request.GET:
-        propertyview.state.jurisdiction_property_id = propertyview.state.custom_id_1
+    # log changes
+    audit_log = export.ExportAuditLog(request.user, 'Exported via xml')
+    audit_log.add_rows(audit_rows)
 
-    organizations = Organization.objects.filter(users=request.user)
-    property = propertyview.first().state
-    match = re.search(r'.*\d{5}',property.normalized_address)
-    if match:
-        property.normalized_address = property.normalized_address[0:property.normalized_address.rindex(' ')]
+    response = export.AuditedHttpResponse(rendered_xml, content_type='text/xml')
+    response['ETag'] = etag
+    return audit_log.finish(response)
 
-    property_info = {
-        "property": property,
-    }
 
-#    for pv in propertyview:
-#        if pv.state.data_quality == 2: #exclude records with data quality errors
-#            propertyview.exclude(pv)
-#        return HttpResponse('<errors><error>Property has errors and cannot be exported</error></errors>', content_type='text/xml')
+# Export GreenAssessmentProperty and Measures information for many property views in a
+# single xml document using RESO fields, with one Property element per property view.
+# The document is streamed as it is built, properties are read chunk by chunk.
+# Parameters:
+#    ids: comma separated list of property view ids, e.g. as listed by helix-reso-export-list-xml
+#    start_date, end_date, organization: instead of ids, export the property views that
+#                helix-reso-export-list-xml lists for these parameters
+#    chunk_size: optional, number of properties read per database round trip
+# Example:
+#    http://localhost:8000/helix/helix-reso-export-batch-xml/?ids=11,12,13
+#    http://localhost:8000/helix/helix-reso-export-batch-xml/?start_date=2016-09-14&end_date=2017-07-11
+@api_endpoint
+@api_view(['GET'])
+def helix_reso_export_batch_xml(request):
+    if 'ids' in request.GET:
+        view_ids = [int(view_id) for view_id in request.GET['ids'].split(',') if view_id.strip().isdigit()]
+    else:
+        view_ids = _updated_view_ids(_export_organizations(request), request.GET.get('start_date', None), request.GET.get('end_date', None))
+    views = PropertyView.objects.filter(pk__in=view_ids)
+    if not view_ids or not views.exists():
+        return HttpResponseNotFound('<?xml version="1.0"?>\n<!--No properties found --!>')
 
-    measurement_dict = {}
-    # assessments
-    matching_assessments = HELIXGreenAssessmentProperty.objects.filter(
-        view__in=propertyview).filter(Q(_expiration_date__gte=today) | Q(_expiration_date=None)).filter(opt_out=False).exclude(status__in=['draft','test','preliminary'])
-    if matching_assessments:
-        reso_certifications = HELIXGreenAssessment.objects.filter(organization_id__in=organizations).filter(is_reso_certification=True)
-        property_info["assessments"] = matching_assessments.filter(assessment_id__in=reso_certifications)
-        for assessment in matching_assessments.filter(assessment_id__in=reso_certifications):
-            matching_measurements = HelixMeasurement.objects.filter(
-                assessment_property__pk=assessment.greenassessmentproperty_ptr_id
-            )
-            for match in matching_measurements:
-                measurement_dict.update(match.to_reso_dict())
-        property_info["measurements"] = measurement_dict
-
-    # measures
-    for pv in propertyview:
-        matching_measures = HELIXPropertyMeasure.objects.filter(property_state=pv.state)  # only pv can be exported
-        if matching_measures:
-            for measure in matching_measures:
-                matching_measurements = HelixMeasurement.objects.filter(
-                    measure_property__pk=measure.propertymeasure_ptr_id,
-                    measurement_type__in=['PROD', 'CAP'],
-                    measurement_subtype__in=['PV', 'WIND']
-                )
-
-            for match in matching_measurements:
-                measurement_dict.update(match.to_reso_dict())
-                measurement_dict.update(measure.to_reso_dict())
-
-            property_info["measurements"] = measurement_dict
-
-    context = {
-        'content': property_info
-        }
+    try:
+        chunk_size = export.chunk_size_param(request.GET, export.XML_CHUNK_SIZE)
+    except ValueError:
+        return HttpResponseBadRequest('chunk_size must be a positive integer')
+    organizations = lookups.user_organization_ids(request.user)
+    crsdata = 'crsdata' in request.GET
 
     # log changes
-    for a in matching_assessments:
-        a.log(
-            user=request.user,
-            record_type=AUDIT_USER_EXPORT,
-            name='Export log',
-            description='Exported via xml')
-    rendered_xml = render_to_string('reso_export_template.xml', context)
+    audit_log = export.ExportAuditLog(request.user, 'Exported via xml')
 
-    return HttpResponse(rendered_xml, content_type='text/xml')
+    def stream():
+        template = get_template('reso_export_property.xml')
+        yield '<?xml version="1.0"?>\n<document>\n'
+        for content in export.stream_reso_xml_contents(views, organizations, chunk_size, crsdata, on_assessments=audit_log.add):
+            yield template.render({'content': content})
+        yield '</document>\n'
+
+    return audit_log.finish(StreamingHttpResponse(stream(), content_type='text/xml'))
 
 
 @api_endpoint
 @api_view(['GET'])
 def helix_green_addendum(request, pk=None):
-    lab = label.Label(settings.AWS_ACCESS_KEY_ID, settings.AWS_SECRET_ACCESS_KEY)
     if 'organization_id' in request.GET:
         org_id = request.GET['organization_id']
-        org = Organization.objects.get(pk=org_id)
+        org = lookups.organization(pk=org_id)
     elif 'organization_name' in request.GET:
-        org = Organization.objects.get(name=request.GET['organization_name'])
+        org = lookups.organization(name=request.GET['organization_name'])
         org_id = org.id
     else:
         return HttpResponseNotFound('<?xml version="1.0"?>\n<!--No organization found --!>')
         
     user = request.user
 #    try:
-    assessment = HELIXGreenAssessment.objects.get(name='Green Addendum', organization_id=org_id)
+    assessment = lookups.assessment(org_id, 'Green Addendum')
     dataset_name = request.GET.get('dataset_name','Green Addendum')
     
+    def make_label(propertyview):
+        return _green_addendum(request, user, assessment, dataset_name, propertyview[0], propertyview[0].state)
+
     if pk is not None:
         property_state = PropertyState.objects.get(pk=pk)
-        property_view = PropertyView.objects.get(state=property_state)
+        property_view = [PropertyView.objects.get(state=property_state)]
     else:
         property_view = utils.propertyview_find(request, org)
-        if not property_view:
-            property_view = _create_propertyview(request, org, user, dataset_name)
+    if not _label_wait(request.GET):
+        return _label_job_response(request, org, user, dataset_name, make_label, property_view)
+    if not property_view:
+        property_view = _create_propertyview(request, org, user, dataset_name)
 
     if not property_view:
         return HttpResponseNotFound('<?xml version="1.0"?>\n<!--No property found --!>')
-    elif pk is None:
-        property_view = property_view[0]
-        property_state = property_view.state
 
+    return JsonResponse(make_label(property_view))
+#    except:
+#        return JsonResponse({'status': 'error', 'msg': 'Green Addendum generation failed'})
+
+
+def _green_addendum(request, user, assessment, dataset_name, property_view, property_state):
+    """
+    Generate the green addendum of a property and attach it to the property's assessment
+    """
     data_dict = {
         'street': property_state.address_line_1,
         'street_2': property_state.address_line_1,
@@ -439,7 +555,7 @@ def helix_green_addendum(request, pk=None):
                 measurements = HelixMeasurement.objects.filter(measure_property=meas)
                 for measurement in measurements:
                     data_dict.update(measurement.to_label_dict(index))
-        key = lab.green_addendum(data_dict, settings.AWS_BUCKET_NAME)        
+        method = 'green_addendum'
     elif dataset_name == "Project Summary":
         txtvars = ['address_line_1', 'city', 'state', 'postal_code', 
             'customer_name', 'customer_phone', 'customer_email', 
@@ -457,9 +573,12 @@ def helix_green_addendum(request, pk=None):
         
         data_dict.update(source_data_dict)
         
-        key = lab.energy_first_mortgage(data_dict, settings.AWS_BUCKET_NAME)
-        
-    url = 'https://s3.amazonaws.com/' + settings.AWS_BUCKET_NAME + '/' + key
+        method = 'energy_first_mortgage'
+
+    fingerprint = labels.fingerprint(method, data_dict)
+    url = labels.find([property_view], fingerprint, assessment)
+    if url is None:
+        url = labels.url(labels.render(method, data_dict))
 
     priorAssessments = HELIXGreenAssessmentProperty.objects.filter(
             view=property_view,
@@ -487,51 +606,119 @@ def helix_green_addendum(request, pk=None):
     ga_url.url = url
     ga_url.description = 'Green Addendum Generated on ' + datetime.datetime.now().strftime("%Y-%m-%d %H:%M")
     ga_url.save()
+    labels.save_fingerprints([(ga_url, fingerprint)])
 
-    return JsonResponse({'status': 'success', 'url': url})
-#    except:
-#        return JsonResponse({'status': 'error', 'msg': 'Green Addendum generation failed'})
+    return {'status': 'success', 'url': url}
 
 
 @api_endpoint
 @api_view(['GET'])
 # Test with /helix-home-energy-score?organization_name=ClearlyEnergy&hes_id=332297
+# Responses are cached, add refresh=true to query HES again
 def helix_home_energy_score(request):
     user = request.user
-    org = Organization.objects.get(name=request.GET['organization_name'])
+    org = lookups.organization(name=request.GET['organization_name'])
     hes_id = request.GET['hes_id']
-    # instantiate HES client for external API
-    hes_auth = {'user_key': settings.HES_USER_KEY,
-                'user_name': org.hes_partner_name,
-                'password': org.hes_partner_password,
-                'client_url': settings.HES_CLIENT_URL}
-    hes_client = hes.HesHelix(hes_auth['client_url'], hes_auth['user_name'], hes_auth['password'], hes_auth['user_key'])
-    hes_data = hes_client.query_hes(hes_id)
+    # HES session of the organization, reused across requests
+    hes_data = dict(hes_cache.query(clients.HES_SESSIONS, org, hes_id, utils.is_true(request.GET.get('refresh'))))
     if hes_data['status'] == 'error':
         return JsonResponse({'status': 'error', 'message': 'no existing home'})
     else:
         del hes_data['status']
-            
-    if(hes_client is not None):
-        hes_client.end_session()
-        
+
     return JsonResponse({'status': 'success', 'data': hes_data})
 
+
+# Hit rate of the Home Energy Score response cache
+# Returns:
+#    hits, negative_hits (cached errors), misses, refreshes and hit_rate, the share of
+#    lookups answered from the cache, counted since the cache was last reset
+# Example: http://localhost:8000/helix/helix-hes-cache-stats/
+@api_endpoint
+@api_view(['GET'])
+def helix_hes_cache_stats(request):
+    return JsonResponse({'status': 'success', 'stats': hes_cache.stats()})
+
+
+# Requests resolved by each propertyview_find tier, e.g. of helix-reso-export-xml
+# Returns:
+#    count and seconds, the total time taken, of each of the property_id, uid, address and
+#    uid_substring tiers, and of not_found for the requests no tier resolved, counted
+#    since this process started
+# Example: http://localhost:8000/helix/helix-propertyview-find-stats/
+@api_endpoint
+@api_view(['GET'])
+def helix_propertyview_find_stats(request):
+    stats = {tier or 'not_found': tier_stats for tier, tier_stats in utils.propertyview_find_stats().items()}
+    return JsonResponse({'status': 'success', 'stats': stats})
+
+
+# Sync the Home Energy Scores of an organization in the background
+# Parameters:
+#    organization_name
+#    start_date, end_date: assessment dates of the buildings, yyyy-mm-dd, default to the
+#                          organization's hes_start_date and hes_end_date
+#    hes_ids: comma separated building ids to sync instead of the date window
+#    refresh: true to fetch buildings again even when their response is cached
+# Returns:
+#    job_id of the sync. Its result has the number of buildings fetched, written and
+#    unchanged, and the ids of the buildings that failed.
+# Example:
+#    POST http://localhost:8000/helix/helix-hes-sync/?organization_name=ClearlyEnergy&start_date=2020-01-01&end_date=2020-12-31
+@csrf_exempt
+@api_endpoint
+@api_view(['POST'])
+def helix_hes_sync(request):
+    user = request.user
+    try:
+        org = lookups.user_organization(user, request.GET['organization_name'])
+    except (KeyError, Organization.DoesNotExist):
+        return JsonResponse({'status': 'error', 'message': 'organization does not exist'})
+    try:
+        lookups.assessment(org.pk, hes_sync.HES_ASSESSMENT_NAME)
+    except HELIXGreenAssessment.DoesNotExist:
+        return JsonResponse({'status': 'error', 'message': 'Please create certification with name: ' + hes_sync.HES_ASSESSMENT_NAME})
+
+    dates = {}
+    for param in ('start_date', 'end_date'):
+        value = request.GET.get(param, None)
+        try:
+            dates[param] = datetime.datetime.strptime(value, '%Y-%m-%d').date() if value else None
+        except ValueError:
+            return JsonResponse({'status': 'error', 'message': param + ' must be yyyy-mm-dd'}, status=400)
+    hes_ids = [hes_id.strip() for hes_id in request.GET.get('hes_ids', '').split(',') if hes_id.strip()] or None
+    refresh = utils.is_true(request.GET.get('refresh'))
+
+    job_id = jobs.submit(lambda job: hes_sync.sync(
+        org, user, hes_ids, dates['start_date'], dates['end_date'], refresh, job=job))
+    return JsonResponse({'status': 'pending', 'job_id': job_id}, status=202)
+
+
 @api_endpoint
 @api_view(['GET'])
 def helix_vermont_profile(request):
-    org = Organization.objects.get(name=request.GET['organization_name'])
+    org = lookups.organization(name=request.GET['organization_name'])
     user = request.user
     propertyview = utils.propertyview_find(request, org)
     dataset_name = request.GET['dataset_name']
+    assessment = lookups.assessment(org.pk, dataset_name)
+    if not _label_wait(request.GET):
+        return _label_job_response(
+            request, org, user, dataset_name,
+            lambda propertyview: _vermont_profile(request, user, assessment, propertyview), propertyview)
     if not propertyview:
         propertyview = _create_propertyview(request, org, user, dataset_name)
 
     if not propertyview:
         return HttpResponseNotFound('<?xml version="1.0"?>\n<!--No property found --!>')
 
-    assessment = HELIXGreenAssessment.objects.get(name=dataset_name, organization=org)
+    return JsonResponse(_vermont_profile(request, user, assessment, propertyview))
+
 
+def _vermont_profile(request, user, assessment, propertyview):
+    """
+    Generate the energy profile of a property and attach it to the property's assessment
+    """
     txtvars = ['street', 'city', 'state', 'zipcode', 'evt', 'leed', 'ngbs', 'heatingfuel', 'author_name', 'author_company', 'auditor', 'rating', 'low_cost_action', 'heater_type', 'water_type', 'solar_ownership', 'weatherization', 'source', 'third_party', 'bill', 'comments']
     floatvars = ['cons_mmbtu', 'cons_mmbtu_avg', 'cons_mmbtu_max', 'cons_mmbtu_min', 'cons_mmbtu_avg', 'score', 'elec_score', 'ng_score', 'ho_score', 'propane_score', 'wood_cord_score', 'wood_pellet_score', 'solar_score',
                  'finishedsqft', 'yearbuilt', 'hers_score', 'hes_score', 'capacity',
@@ -541,18 +728,17 @@ def helix_vermont_profile(request):
     intvars = []
     data_dict = utils.data_dict_from_vars(request, txtvars, floatvars, intvars, boolvars)
 
-    lab = label.Label(settings.AWS_ACCESS_KEY_ID, settings.AWS_SECRET_ACCESS_KEY)
-    if request.GET['state'] == 'VT':
-        key = lab.vermont_energy_profile(data_dict, settings.AWS_BUCKET_NAME)
-    else:
-        key = lab.generic_energy_profile(data_dict, settings.AWS_BUCKET_NAME)
-    url = 'https://s3.amazonaws.com/' + settings.AWS_BUCKET_NAME + '/' + key
+    method = 'vermont_energy_profile' if request.GET['state'] == 'VT' else 'generic_energy_profile'
+    fingerprint = labels.fingerprint(method, data_dict)
+    url = labels.find(propertyview, fingerprint, assessment)
+    if url is None:
+        url = labels.url(labels.render(method, data_dict))
     
     if propertyview is not None:
-        utils.add_certification_label_to_property(propertyview, user, assessment, url, data_dict)
-        return JsonResponse({'status': 'success', 'url': url})
+        utils.add_certification_label_to_property(propertyview, user, assessment, url, data_dict, fingerprint=fingerprint)
+        return {'status': 'success', 'url': url}
     else:
-        return JsonResponse({'status': 'error', 'message': 'no existing home'})
+        return {'status': 'error', 'message': 'no existing home'}
 
 
 @api_endpoint
@@ -566,7 +752,18 @@ def helix_massachusetts_scorecard(request, pk=None):
     if not propertyview:
         return HttpResponseNotFound('<?xml version="1.0"?>\n<!--No property found --!>')
 
-    assessment = HELIXGreenAssessment.objects.get(name='Massachusetts Scorecard', organization_id=org_id)
+    assessment = lookups.assessment(org_id, 'Massachusetts Scorecard')
+    if not _label_wait(request.GET):
+        return _label_job_response(
+            request, None, user, None,
+            lambda propertyview: _massachusetts_scorecard_of_state(request, user, assessment, property_state, propertyview), propertyview)
+    return JsonResponse(_massachusetts_scorecard_of_state(request, user, assessment, property_state, propertyview))
+
+
+def _massachusetts_scorecard_of_state(request, user, assessment, property_state, propertyview):
+    """
+    Generate the scorecard of a property from its state and attach it to the property's assessment
+    """
     data_dict = {
         'address_line_1': property_state.address_line_1,
         'address_line_2': property_state.address_line_2,
@@ -611,20 +808,22 @@ def helix_massachusetts_scorecard(request, pk=None):
     data_dict['electric_percentage'] = 100.0 - data_dict['fuel_percentage']
     data_dict['electric_percentage_co2'] = 100.0 - data_dict['fuel_percentage_co2']
 
-    lab = label.Label(settings.AWS_ACCESS_KEY_ID, settings.AWS_SECRET_ACCESS_KEY)
-    key = lab.massachusetts_energy_scorecard(data_dict, settings.AWS_BUCKET_NAME)
-    url = 'https://s3.amazonaws.com/' + settings.AWS_BUCKET_NAME + '/' + key
+    fingerprint = labels.fingerprint('massachusetts_energy_scorecard', data_dict)
+    url = labels.find(propertyview, fingerprint, assessment)
+    if url is None:
+        url = labels.url(labels.render('massachusetts_energy_scorecard', data_dict))
 
     if propertyview is not None:
-        utils.add_certification_label_to_property(propertyview, user, assessment, url, data_dict, request.GET.get('status', None), request.GET.get('reference_id', None))
-        return JsonResponse({'status': 'success', 'url': url})
+        utils.add_certification_label_to_property(propertyview, user, assessment, url, data_dict, request.GET.get('status', None), request.GET.get('reference_id', None), fingerprint=fingerprint)
+        return {'status': 'success', 'url': url}
     else:
-        return JsonResponse({'status': 'error', 'message': 'no existing home'})
-    return None
+        return {'status': 'error', 'message': 'no existing home'}
 
 # Create Massachusetts Scorecard (external service)
 # Parameters:
 #    property attributes
+#    wait: false to return a job_id right away and get the result from helix-job-status,
+#          defaults to HELIX_LABEL_WAIT_DEFAULT. async=true is the same as wait=false.
 # Example: http://localhost:8000/helix/massachusetts-scorecard/?address_line_1=298%20Highland%20Ave&city=Cambridge&postal_code=02139&state=MA&propane=2.3&fuel_oil=2.4&natural_gas=0.1&electricity=0.1&wood=200&pellets=0.5&conditioned_area=2000&year_built=1945&number_of_bedrooms=3&primary_heating_fuel_type=propane&name=JoeContractor&assessment_date=2019-06-07&fuel_energy_usage_base=120&total_energy_cost_base=2500&total_energy_cost_improved=1500&total_energy_usage_base=150&total_energy_usage_improved=120&electric_energy_usage_base=12000&co2_production_base=12.1&co2_production_improved=9.9&base_score=7&improved_score=9&incentive_1=5000&status=draft&organization=Snugg%20Pro&reference_id=myref124&url=https://mysnuggurl.com&organization=ClearlyEnergy
 
 # @login_required
@@ -633,25 +832,49 @@ def helix_massachusetts_scorecard(request, pk=None):
 def massachusetts_scorecard(request, pk=None):
     user = request.user
     try:
-        org = Organization.objects.get(users=user, name=request.GET['organization'])
+        org = lookups.user_organization(user, request.GET['organization'])
     except:
         return JsonResponse({'status': 'error', 'message': 'organization does not exist'})
     
     try:
-        assessment = HELIXGreenAssessment.objects.get(name='Massachusetts Scorecard', organization=org)
+        assessment = lookups.assessment(org.pk, 'Massachusetts Scorecard')
     except:
         return JsonResponse({'status': 'error', 'message': 'Please create certification with name: Massachusetts Scorecard'})
 
 # test if property exists
     propertyview = utils.propertyview_find(request, org)
+    dataset_name = 'MA API'
+    if not _label_wait(request.GET):
+        return _label_job_response(
+            request, org, user, dataset_name,
+            lambda propertyview: _massachusetts_scorecard(request, org, user, assessment, propertyview), propertyview)
     if not propertyview:
-        dataset_name = 'MA API'
         propertyview = _create_propertyview(request, org, user, dataset_name)
     if not propertyview:
         return HttpResponseNotFound('<?xml version="1.0"?>\n<!--No property found --!>')
 
-    data_dict = None 
+    return JsonResponse(_massachusetts_scorecard(request, org, user, assessment, propertyview))
+
+
+def _massachusetts_scorecard(request, org, user, assessment, propertyview):
+    """
+    Generate, or take from the url parameter, the scorecard of a property and attach it to the property's assessment
+    """
+    data_dict = _massachusetts_scorecard_data(request.GET)
+    url, fingerprint = _massachusetts_scorecard_url(request.GET, data_dict, propertyview, assessment)
+
+    if propertyview is not None:
+        # need to save data_dict to extra data
+        utils.add_certification_label_to_property(propertyview, user, assessment, url, data_dict, request.GET.get('status', None), request.GET.get('reference_id', None), org, fingerprint)
+        return {'status': 'success', 'url': url, 'property_id': propertyview.first().id}
+    else:
+        return {'status': 'error', 'message': 'no existing home'}
+
 
+def _massachusetts_scorecard_data(params):
+    """
+    Scorecard data of a property from request parameters, or from a record of a batch request
+    """
     txtvars = ['address_line_1', 'address_line_2', 'city', 'state', 'postal_code', 'primary_heating_fuel_type', 'name', 'assessment_date']
     floatvars = ['fuel_oil', 'electricity', 'natural_gas', 'wood', 'pellets', 'propane',
                  'conditioned_area', 'year_built', 'number_of_bedrooms',
@@ -664,48 +887,206 @@ def massachusetts_scorecard(request, pk=None):
     intvars = ['base_score', 'improved_score']
     boolvars = []
 
-    data_dict = utils.data_dict_from_vars(request, txtvars, floatvars, intvars, boolvars)
+    return utils.data_dict_from_params(params, txtvars, floatvars, intvars, boolvars)
+
+
+def _massachusetts_scorecard_url(params, data_dict, propertyview, assessment):
+    """
+    (url, fingerprint) of the scorecard: the url parameter if there is one, else the
+    scorecard of propertyview with the same data, else a scorecard generated from data_dict
+    """
+    if params.get('url', None):
+        return params['url'], None
+
+    _massachusetts_scorecard_percentages(data_dict)
+    fingerprint = labels.fingerprint('massachusetts_energy_scorecard', data_dict)
+    url = labels.find(propertyview, fingerprint, assessment)
+    if url is None:
+        url = labels.url(labels.render('massachusetts_energy_scorecard', data_dict))
+    return url, fingerprint
 
-    if request.GET.get('url', None):
-        url = request.GET['url']
+
+def _massachusetts_scorecard_percentages(data_dict):
+    """
+    Add the fuel and electric shares of energy use and CO2 production to data_dict
+    """
+    # to_btu = {'electric': 0.003412, 'fuel_oil': 0.1, 'propane': 0.1, 'natural_gas': 0.1, 'wood': 0.1, 'pellets': 0.1}
+    to_co2 = {'electric': 0.00061}
+
+    if data_dict['fuel_energy_usage_base'] is not None and data_dict['electric_energy_usage_base'] is not None:
+        data_dict['fuel_percentage'] = 100.0 * data_dict['fuel_energy_usage_base']*0.1 / (data_dict['fuel_energy_usage_base']*0.1 + data_dict['electric_energy_usage_base']*0.003412)
+        data_dict['fuel_percentage_co2'] = 100.0 * (data_dict['co2_production_base'] - to_co2['electric'] * data_dict['electric_energy_usage_base']) / data_dict['co2_production_base']
     else:
-        # to_btu = {'electric': 0.003412, 'fuel_oil': 0.1, 'propane': 0.1, 'natural_gas': 0.1, 'wood': 0.1, 'pellets': 0.1}
-        to_co2 = {'electric': 0.00061}
+        data_dict['fuel_percentage'] = 0.0
+        data_dict['fuel_percentage_co2'] = 0.0
+
+    data_dict['electric_percentage'] = 100.0 - data_dict['fuel_percentage']
+    data_dict['electric_percentage_co2'] = 100.0 - data_dict['fuel_percentage_co2']
+
+
+# Create or update Massachusetts Scorecards of many properties at once
+# Parameters:
+#    organization: name of the organization, in the query string or in a JSON object body
+#    scorecards: a JSON array of scorecards, each with the parameters of massachusetts-scorecard,
+#                sent as the body or as the scorecards key of a JSON object body.
+#                Alternatively a csv file with one scorecard per row and the parameters as
+#                headers, uploaded as file or sent as the body with content type text/csv.
+# Properties are matched by property_id, property_uid or address with one query for all
+# scorecards, the properties that do not exist yet are created, and the assessments, urls and
+# measurements of all scorecards are written together. The scorecards are rendered in parallel
+# by the label pool.
+#    wait: false to return a job_id right away and get the results from helix-job-status,
+#          defaults to HELIX_LABEL_WAIT_DEFAULT. async=true is the same as wait=false.
+# Returns:
+#    results: one entry per scorecard, in request order, with the status, url and property_id,
+#             or the error message of the scorecard
+# Example:
+#    POST http://localhost:8000/helix/massachusetts-scorecard-batch/?organization=ClearlyEnergy
+#    [{"address_line_1": "298 Highland Ave", "city": "Cambridge", "postal_code": "02139", "state": "MA", "status": "draft", "reference_id": "myref124", "url": "https://mysnuggurl.com"}]
+@csrf_exempt
+@api_endpoint
+@api_view(['POST'])
+def massachusetts_scorecard_batch(request):
+    user = request.user
+    try:
+        organization, records = _batch_records(request, 'scorecards')
+    except (ValueError, UnicodeDecodeError, csv.Error):
+        return JsonResponse({'status': 'error', 'message': 'scorecards must be a JSON array or a csv file'}, status=400)
+
+    try:
+        org = lookups.user_organization(user, organization)
+    except:
+        return JsonResponse({'status': 'error', 'message': 'organization does not exist'})
+
+    try:
+        assessment = lookups.assessment(org.pk, 'Massachusetts Scorecard')
+    except:
+        return JsonResponse({'status': 'error', 'message': 'Please create certification with name: Massachusetts Scorecard'})
+
+    if not _label_wait(request.GET):
+        job_id = jobs.submit(_massachusetts_scorecard_batch, org, user, assessment, records)
+        return JsonResponse({'status': 'pending', 'job_id': job_id}, status=202)
+    return JsonResponse(_massachusetts_scorecard_batch(None, org, user, assessment, records))
+
 
-        if data_dict['fuel_energy_usage_base'] is not None and data_dict['electric_energy_usage_base'] is not None:
-            data_dict['fuel_percentage'] = 100.0 * data_dict['fuel_energy_usage_base']*0.1 / (data_dict['fuel_energy_usage_base']*0.1 + data_dict['electric_energy_usage_base']*0.003412)
-            data_dict['fuel_percentage_co2'] = 100.0 * (data_dict['co2_production_base'] - to_co2['electric'] * data_dict['electric_energy_usage_base']) / data_dict['co2_production_base']
+def _massachusetts_scorecard_batch(job, org, user, assessment, records):
+    """
+    Generate the scorecards of a batch request in parallel and attach them to their properties' assessments
+    """
+    results = [None] * len(records)
+    for i, record in enumerate(records):
+        if not isinstance(record, dict):
+            results[i] = {'status': 'error', 'message': 'scorecard must be an object'}
+    records = [record if isinstance(record, dict) else {} for record in records]
+
+    if job is not None:
+        job.stage('properties')
+    propertyviews = _batch_propertyviews(org, records)
+
+    if job is not None:
+        job.stage('label')
+    data_dicts = [None] * len(records)
+    urls = [None] * len(records)
+    fingerprints = {}
+    to_render = []
+    for i, (record, propertyview) in enumerate(zip(records, propertyviews)):
+        if results[i] is not None:
+            continue
+        if not propertyview:
+            results[i] = {'status': 'error', 'message': 'no existing home'}
+            continue
+        try:
+            data_dicts[i] = _massachusetts_scorecard_data(record)
+            if record.get('url', None):
+                urls[i] = record['url']
+            else:
+                _massachusetts_scorecard_percentages(data_dicts[i])
+                fingerprints[i] = labels.fingerprint('massachusetts_energy_scorecard', data_dicts[i])
+        except Exception as e:
+            results[i] = {'status': 'error', 'message': str(e)}
+
+    # scorecards whose properties already have one with the same data are not rendered again
+    found = labels.find_many([(propertyviews[i], fingerprint) for i, fingerprint in fingerprints.items()], assessment)
+    for i, url in zip(list(fingerprints), found):
+        if url is None:
+            to_render.append(i)
         else:
-            data_dict['fuel_percentage'] = 0.0
-            data_dict['fuel_percentage_co2'] = 0.0
+            urls[i] = url
 
-        data_dict['electric_percentage'] = 100.0 - data_dict['fuel_percentage']
-        data_dict['electric_percentage_co2'] = 100.0 - data_dict['fuel_percentage_co2']
-        lab = label.Label(settings.AWS_ACCESS_KEY_ID, settings.AWS_SECRET_ACCESS_KEY)
-        key = lab.massachusetts_energy_scorecard(data_dict, settings.AWS_BUCKET_NAME)
-        url = 'https://s3.amazonaws.com/' + settings.AWS_BUCKET_NAME + '/' + key
+    rendered = labels.render_many([('massachusetts_energy_scorecard', data_dicts[i]) for i in to_render])
+    for i, key in zip(to_render, rendered):
+        if isinstance(key, Exception):
+            results[i] = {'status': 'error', 'message': str(key)}
+        else:
+            urls[i] = labels.url(key)
 
-    if propertyview is not None:
-        # need to save data_dict to extra data
-        utils.add_certification_label_to_property(propertyview, user, assessment, url, data_dict, request.GET.get('status', None), request.GET.get('reference_id', None), org)
-        return JsonResponse({'status': 'success', 'url': url, 'property_id': propertyview.first().id})
-    else:
-        return JsonResponse({'status': 'error', 'message': 'no existing home'})
+    certification_labels = []
+    for i, (record, propertyview) in enumerate(zip(records, propertyviews)):
+        if results[i] is not None:
+            continue
+        certification_labels += [(pv, urls[i], data_dicts[i], record.get('status') or None, record.get('reference_id') or None) for pv in propertyview]
+        results[i] = {'status': 'success', 'url': urls[i], 'property_id': propertyview[0].id}
+
+    utils.add_certification_labels(certification_labels, user, assessment, org,
+                                   {urls[i]: fingerprint for i, fingerprint in fingerprints.items() if results[i]['status'] == 'success'})
+    return {'status': 'success', 'results': results}
+
+
+def _batch_records(request, key):
+    """
+    Organization name and records of a batch request, from a csv file or body, or from a
+    JSON array or object body. Raises ValueError for any other body.
+    """
+    organization = request.GET.get('organization', None)
+    if 'file' in request.FILES:
+        return organization, list(csv.DictReader(io.TextIOWrapper(request.FILES['file'], encoding='utf-8-sig')))
+    if request.content_type == 'text/csv':
+        return organization, list(csv.DictReader(io.StringIO(request.body.decode('utf-8-sig'))))
+
+    data = request.data
+    if isinstance(data, dict):
+        organization = data.get('organization', organization)
+        data = data.get(key, None)
+    if not isinstance(data, list):
+        raise ValueError('records must be a list')
+    return organization, data
+
+
+def _batch_propertyviews(org, records):
+    """
+    Views of every record of a batch request, matched like propertyview_find. The properties of
+    the records that do not match are created directly, in bulk, whatever HELIX_DIRECT_PROPERTY_CREATE is.
+    A record without the address fields needed to create its property gets an empty list.
+    """
+    propertyviews = utils.propertyviews_find(records, org)
+    missing = []
+    for i, (record, propertyview) in enumerate(zip(records, propertyviews)):
+        if not propertyview:
+            try:
+                missing.append((i, _import_row(record)))
+            except KeyError:
+                pass
+    if missing:
+        cycle = Cycle.objects.filter(organization=org).last()  # might need to hardcode this
+        created = utils.create_propertyviews(org, cycle, [row for i, row in missing])
+        for (i, row), propertyview in zip(missing, created):
+            propertyviews[i] = propertyview
+    return propertyviews
 
 
 @api_endpoint
 @api_view(['GET'])
 def helix_remove_profile(request):
-    org = Organization.objects.get(name=request.GET['organization_name'])
+    org = lookups.organization(name=request.GET['organization_name'])
     propertyview = utils.propertyview_find(request, org=None)
 
     if not propertyview:
         return HttpResponseNotFound('<?xml version="1.0"?>\n<!--No property found --!>')
 
     certification_name = request.GET['certification_name']
-    assessment = HELIXGreenAssessment.objects.get(name=certification_name, organization=org)
+    assessment = lookups.assessment(org.pk, certification_name)
     
-    lab = label.Label(settings.AWS_ACCESS_KEY_ID, settings.AWS_SECRET_ACCESS_KEY)
+    lab = clients.label_client()
 
     if propertyview is not None:
         for pv in propertyview:
@@ -725,6 +1106,8 @@ def helix_remove_profile(request):
                         link_parts = os.path.split(o.path)
                         label_link = link_parts[1]
                         lab.remove_label(label_link, settings.AWS_BUCKET_NAME)
+                        # other assessments reusing the removed file must not offer it again
+                        HELIXLabelFingerprint.objects.filter(assessment_url__url=ga_url.url).delete()
                         ga_url.delete()  # delete URL entry in DB
                     else:
                         JsonResponse({'status': 'success', 'message': 'no existing profile'})
@@ -732,6 +1115,13 @@ def helix_remove_profile(request):
     else:
         return JsonResponse({'status': 'error', 'message': 'no existing home'})
 
+# label_type of remotely_label requests, and the Label method rendering them
+REMOTELY_LABEL_METHODS = {
+    'ipc_label': 'remotely_ipc_pdf',
+    'berkeley_elec_checklist': 'electrification_checklist',
+}
+
+
 @csrf_exempt
 @api_endpoint
 @api_view(['POST'])
@@ -746,66 +1136,179 @@ def remotely_label(request):
         "label_type": "ipc_label",
         "data": { "key": "value" }
     }
+    ```
+
+    or, to render many labels in parallel:
+
+    ```json
+    {
+        "labels": [{"label_type": "ipc_label", "data": { "key": "value" }}]
+    }
+    ```
+
+    wait, in the body or the query string, set to false returns a job_id right away,
+    the labels are then the result of helix-job-status.
 
     Returns:
     ```json
     { 'status': 'success', 'url': <label_url> }
+    { 'status': 'success', 'results': [{ 'status': 'success', 'url': <label_url> }] }
     ```
     """
 
     request_data = request.data
-    label_type = request_data['label_type']
-    data = request_data['data']
-    lab = label.Label(settings.AWS_ACCESS_KEY_ID, settings.AWS_SECRET_ACCESS_KEY)
-    label_methods = {
-        'ipc_label': lab.remotely_ipc_pdf,
-        'berkeley_elec_checklist': lab.electrification_checklist,
-    }
-    method = label_methods.get(label_type)
-    if not method:
-        return JsonResponse({'status': 'error', 'message': f'Unknown label_type: {label_type}'}, status=400)
+    if 'labels' in request_data:
+        items = request_data['labels']
+        if not isinstance(items, list):
+            return JsonResponse({'status': 'error', 'message': 'labels must be a list'}, status=400)
+    else:
+        label_type = request_data['label_type']
+        if label_type not in REMOTELY_LABEL_METHODS:
+            return JsonResponse({'status': 'error', 'message': f'Unknown label_type: {label_type}'}, status=400)
+        items = [request_data]
+
+    params = request.GET.dict()
+    params.update({key: request_data[key] for key in ('wait', 'async') if key in request_data})
+    if not _label_wait(params):
+        job_id = jobs.submit(lambda job: {'status': 'success', 'results': _remotely_labels(job, items)})
+        return JsonResponse({'status': 'pending', 'job_id': job_id}, status=202)
+
+    results = _remotely_labels(None, items, errors=(ValueError, KeyError, TypeError))
+    if 'labels' in request_data:
+        return JsonResponse({'status': 'success', 'results': results})
+    return JsonResponse(results[0], status=200 if results[0]['status'] == 'success' else 400)
+
+
+def _remotely_labels(job, items, errors=(Exception,)):
+    """
+    Render the labels of a remotely_label request in parallel. Exceptions of a label that
+    are instances of errors become its error message, others are raised.
+    """
+    results = [None] * len(items)
+    to_render = []
+    for i, item in enumerate(items):
+        label_type = item.get('label_type') if isinstance(item, dict) else None
+        if label_type not in REMOTELY_LABEL_METHODS:
+            results[i] = {'status': 'error', 'message': f'Unknown label_type: {label_type}'}
+        elif 'data' not in item:
+            results[i] = {'status': 'error', 'message': 'data is missing'}
+        else:
+            to_render.append(i)
+
+    rendered = labels.render_many([(REMOTELY_LABEL_METHODS[items[i]['label_type']], items[i]['data']) for i in to_render])
+    for i, file_url in zip(to_render, rendered):
+        if isinstance(file_url, errors):
+            results[i] = {'status': 'error', 'message': str(file_url)}
+        elif isinstance(file_url, Exception):
+            raise file_url
+        else:
+            results[i] = {'status': 'success', 'url': file_url}
+    return results
+
+
+# Status of a background job, e.g. a label requested with wait=false
+# Parameters:
+#    job_id: id returned when the job was started
+# Returns:
+#    status: queued, running, success or error
+#    stage: step the job is at
+#    result: response of the label endpoint, once the job succeeded
+# Example:
+#    http://localhost:8000/helix/helix-job-status/?job_id=0f8fad5bd9cb469fa16570867728950e
+@api_endpoint
+@api_view(['GET'])
+def helix_job_status(request):
+    job = jobs.get_job(request.GET.get('job_id', ''))
+    if job is None:
+        return JsonResponse({'status': 'error', 'message': 'job does not exist'}, status=404)
+    return JsonResponse(job)
+
+
+def _label_wait(params):
+    """
+    Whether a label request waits for its label: the wait parameter, async=true meaning
+    wait=false, or HELIX_LABEL_WAIT_DEFAULT
+    """
+    if 'async' in params:
+        return not utils.is_true(params['async'])
+    if 'wait' in params:
+        return utils.is_true(params['wait'])
+    return getattr(settings, 'HELIX_LABEL_WAIT_DEFAULT', True)
+
+
+def _label_job_response(request, org, user, dataset_name, make_label, propertyview=None):
+    """
+    Call make_label with the views of a label request in the background, creating the
+    property first when propertyview is empty. Returns the id of the job right away.
+    """
+    job_id = jobs.submit(_label_job, request, org, user, dataset_name, make_label, propertyview)
+    return JsonResponse({'status': 'pending', 'job_id': job_id}, status=202)
 
-    try:
-        file_url = method(data, settings.AWS_BUCKET_NAME)
-        return JsonResponse({'status': 'success', 'url': file_url})
-    except ValueError as e:
-        return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
-    except KeyError as e:
-        return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
-    except TypeError as e:
-        return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
 
+def _label_job(job, request, org, user, dataset_name, make_label, propertyview=None):
+    if not propertyview:
+        propertyview = _create_propertyview(request, org, user, dataset_name, job)
+        if isinstance(propertyview, dict):
+            # matching failed
+            return propertyview
+    if not propertyview:
+        return {'status': 'error', 'message': 'no existing home'}
+    job.stage('label')
+    return make_label(propertyview)
+
+
+def _create_propertyview(request, org, user, dataset_name, job=None):
+    """
+    Import the address of the request as a new property. Unless HELIX_DIRECT_PROPERTY_CREATE
+    is False, the property is created directly instead of through the import pipeline.
+    job, when given, is kept up to date with the import stage and its progress.
+    """
+    def progress(stage):
+        if job is not None:
+            job.stage(stage)
+            return lambda prog: job.stage(stage, prog)
 
-def _create_propertyview(request, org, user, dataset_name):
     cycle = Cycle.objects.filter(organization=org).last()  # might need to hardcode this
+    result = [_import_row(request.GET)]
+
+    if getattr(settings, 'HELIX_DIRECT_PROPERTY_CREATE', True):
+        return utils.create_propertyview(org, cycle, result[0])
+
     dataset = ImportRecord.objects.get(name=dataset_name, super_organization=org)
-    result = [{'City': request.GET['city'],
-              'State': request.GET['state']}]
-    if 'street' in request.GET:
-        result[0]['Address Line 1'] = request.GET['street']
-    else:
-        result[0]['Address Line 1'] = request.GET['address_line_1']
-    if 'zipcode' in request.GET:
-        result[0]['Postal Code'] = request.GET['zipcode']
-    else:
-        result[0]['Postal Code'] = request.GET['postal_code']
-    if 'property_uid' in request.GET:
-        result[0]['Custom ID 1'] = request.GET['property_uid']
     file_pk = utils.save_and_load(user, dataset, cycle, result, "profile_data.csv")
     # save data
     resp = save_raw_data(file_pk)
     save_prog_key = resp['progress_key']
-    utils.wait_for_task(save_prog_key)
+    utils.wait_for_task(save_prog_key, on_progress=progress('save_raw_data'))
     # map data
 #        save_column_mappings(file_id, col_mappings) #perform column mapping
     resp = map_data(file_pk)
     map_prog_key = resp['progress_key']
-    utils.wait_for_task(map_prog_key)
+    utils.wait_for_task(map_prog_key, on_progress=progress('map_data'))
     resp = match_buildings(file_pk)
 #        resp = geocode_buildings_task(file_pk)
     if (resp['status'] == 'error'):
         return resp
     match_prog_key = resp['progress_key']
-    utils.wait_for_task(match_prog_key)
+    utils.wait_for_task(match_prog_key, on_progress=progress('match_buildings'))
     propertyview = utils.propertyview_find(request, org)
     return propertyview
+
+
+def _import_row(params):
+    """
+    Row of the single property import file with the address in params
+    """
+    row = {'City': params['city'],
+           'State': params['state']}
+    if 'street' in params:
+        row['Address Line 1'] = params['street']
+    else:
+        row['Address Line 1'] = params['address_line_1']
+    if 'zipcode' in params:
+        row['Postal Code'] = params['zipcode']
+    else:
+        row['Postal Code'] = params['postal_code']
+    if 'property_uid' in params:
+        row['Custom ID 1'] = params['property_uid']
+    return row